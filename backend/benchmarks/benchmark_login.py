@@ -0,0 +1,95 @@
+"""
+Mede a latência do login (p50/p99) enquanto outras requisições de listagem
+rodam em paralelo contra uma API em execução.
+
+Com o bcrypt no event loop, cada login trava as listagens do worker; com o
+hash no pool de threads as listagens seguem respondendo durante o login.
+
+Uso (a partir da pasta backend, com a API no ar e um usuário já cadastrado):
+
+    python benchmarks/benchmark_login.py --email a@b.com --senha 123 \\
+        --logins 50 --listagens 8
+"""
+import argparse
+import statistics
+import threading
+import time
+import requests
+
+
+def percentil(valores, p):
+    ordenados = sorted(valores)
+    indice = min(len(ordenados) - 1, max(0, round(p / 100 * len(ordenados)) - 1))
+    return ordenados[indice]
+
+
+def resumo(nome, latencias):
+    if not latencias:
+        return f"{nome}: nenhuma requisição"
+    return (
+        f"{nome}: n={len(latencias)} "
+        f"p50={percentil(latencias, 50) * 1000:.1f}ms "
+        f"p99={percentil(latencias, 99) * 1000:.1f}ms "
+        f"media={statistics.mean(latencias) * 1000:.1f}ms"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de login com listagens concorrentes")
+    parser.add_argument("--url", default="http://localhost:8001", help="URL base da API")
+    parser.add_argument("--email", required=True)
+    parser.add_argument("--senha", required=True)
+    parser.add_argument("--logins", type=int, default=50, help="Logins medidos (sequenciais por thread)")
+    parser.add_argument("--threads-login", type=int, default=4, help="Threads fazendo login ao mesmo tempo")
+    parser.add_argument("--listagens", type=int, default=8, help="Threads listando empresas durante o teste")
+    args = parser.parse_args()
+
+    credenciais = {"email": args.email, "senha": args.senha}
+    resposta = requests.post(f"{args.url}/api/auth/login", json=credenciais)
+    resposta.raise_for_status()
+    headers = {"Authorization": f"Bearer {resposta.json()['access_token']}"}
+
+    parar = threading.Event()
+    lat_login, lat_listagem = [], []
+    trava = threading.Lock()
+
+    def listar():
+        sessao = requests.Session()
+        while not parar.is_set():
+            inicio = time.perf_counter()
+            sessao.get(f"{args.url}/api/empresas", headers=headers).raise_for_status()
+            with trava:
+                lat_listagem.append(time.perf_counter() - inicio)
+
+    def logar(quantidade):
+        sessao = requests.Session()
+        for _ in range(quantidade):
+            inicio = time.perf_counter()
+            sessao.post(f"{args.url}/api/auth/login", json=credenciais).raise_for_status()
+            with trava:
+                lat_login.append(time.perf_counter() - inicio)
+
+    listadores = [threading.Thread(target=listar, daemon=True) for _ in range(args.listagens)]
+    for thread in listadores:
+        thread.start()
+
+    por_thread = max(1, args.logins // args.threads_login)
+    inicio = time.perf_counter()
+    logadores = [threading.Thread(target=logar, args=(por_thread,)) for _ in range(args.threads_login)]
+    for thread in logadores:
+        thread.start()
+    for thread in logadores:
+        thread.join()
+    duracao = time.perf_counter() - inicio
+
+    parar.set()
+    for thread in listadores:
+        thread.join()
+
+    print(f"Duração: {duracao:.1f}s")
+    print(resumo("login", lat_login))
+    print(resumo("listagem", lat_listagem))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+Compara o parser original (xmltodict, utils.xml_parser) com o parser por
+layout (iterparse, utils.parser_notas) num corpus gerado em memória.
+
+- corpus municipal (uma nota por arquivo): os dois parsers, com conferência
+  de que extraem os mesmos campos;
+- ListaNfse ABRASF com muitas notas num arquivo só: apenas o parser novo
+  (o original não reconhece o layout), com o pico de memória do parse.
+
+Uso (a partir da pasta backend):
+
+    python -m benchmarks.benchmark_parser --arquivos 2000 --notas-lista 5000
+"""
+import argparse
+import random
+import time
+import tracemalloc
+from datetime import date, timedelta
+from utils.xml_parser import parse_xml_nota
+from utils.parser_notas import parse_xml_notas
+from utils.campos_nota import para_centavos
+
+CAMPOS = ["numero_nota", "data_emissao", "codigo_servico", "valor_total", "chave_validacao", "cnpj_tomador"]
+
+
+def gerar_municipal(numero: int, aleatorio: random.Random):
+    emissao = date(2024, 1, 1) + timedelta(days=aleatorio.randrange(365))
+    itens = "".join(
+        f"<ITENS><Quantidade>1</Quantidade><ValorUnitario>{aleatorio.randrange(100, 9999)}.00</ValorUnitario>"
+        f"<Descricao>Servico prestado item {i} {'x' * 200}</Descricao></ITENS>"
+        for i in range(aleatorio.randrange(1, 6))
+    )
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        "<tbnfd><nfdok numeronfd=\"1\"><NewDataSet><NOTA_FISCAL>"
+        f"<NumeroNota>{numero}</NumeroNota>"
+        f"<DataEmissao>{emissao.isoformat()}T10:00:00</DataEmissao>"
+        f"<Cae>{aleatorio.choice(['620910000', '631190000', '702040000'])}</Cae>"
+        f"<ValorTotalNota>{aleatorio.randrange(100, 99999)}.{aleatorio.randrange(100):02d}</ValorTotalNota>"
+        f"<ChaveValidacao>{aleatorio.getrandbits(64):016X}</ChaveValidacao>"
+        f"<ClienteCNPJCPF>{aleatorio.randrange(10 ** 13, 10 ** 14)}</ClienteCNPJCPF>"
+        f"<ClienteNomeRazaoSocial>Cliente {numero} Ltda</ClienteNomeRazaoSocial>"
+        f"{itens}"
+        "</NOTA_FISCAL></NewDataSet></nfdok></tbnfd>"
+    ).encode("utf-8")
+
+
+def gerar_lista_abrasf(quantidade: int, aleatorio: random.Random):
+    partes = ['<?xml version="1.0" encoding="utf-8"?><ConsultarNfseResposta xmlns="http://www.abrasf.org.br/nfse.xsd"><ListaNfse>']
+    for numero in range(1, quantidade + 1):
+        partes.append(
+            "<CompNfse><Nfse><InfNfse>"
+            f"<Numero>{numero}</Numero><CodigoVerificacao>{aleatorio.getrandbits(32):08X}</CodigoVerificacao>"
+            f"<DataEmissao>2024-{aleatorio.randrange(1, 13):02d}-10T09:30:00</DataEmissao>"
+            "<Servico><Valores>"
+            f"<ValorServicos>{aleatorio.randrange(100, 9999)}.50</ValorServicos>"
+            "</Valores><ItemListaServico>01.07</ItemListaServico>"
+            f"<CodigoTributacaoMunicipio>620910000</CodigoTributacaoMunicipio>"
+            f"<Discriminacao>{'Desenvolvimento de software ' * 10}</Discriminacao></Servico>"
+            "<TomadorServico><IdentificacaoTomador><CpfCnpj>"
+            f"<Cnpj>{aleatorio.randrange(10 ** 13, 10 ** 14)}</Cnpj>"
+            "</CpfCnpj></IdentificacaoTomador></TomadorServico>"
+            "</InfNfse></Nfse></CompNfse>"
+        )
+    partes.append("</ListaNfse></ConsultarNfseResposta>")
+    return "".join(partes).encode("utf-8")
+
+
+def normalizar(campo, valor):
+    return para_centavos(valor) if campo == "valor_total" else valor
+
+
+def medir(funcao, corpus):
+    inicio = time.perf_counter()
+    resultados = [funcao(conteudo) for conteudo in corpus]
+    return time.perf_counter() - inicio, resultados
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark do parser de XML de notas")
+    parser.add_argument("--arquivos", type=int, default=2000, help="Arquivos no corpus municipal")
+    parser.add_argument("--notas-lista", type=int, default=5000, help="Notas no arquivo ListaNfse")
+    parser.add_argument("--semente", type=int, default=42)
+    args = parser.parse_args()
+
+    aleatorio = random.Random(args.semente)
+    corpus = [gerar_municipal(n, aleatorio) for n in range(1, args.arquivos + 1)]
+    tamanho_mb = sum(len(c) for c in corpus) / 1024 / 1024
+    print(f"Corpus municipal: {len(corpus)} arquivos, {tamanho_mb:.1f} MB")
+
+    tempo_antigo, antigos = medir(parse_xml_nota, corpus)
+    tempo_novo, novos = medir(parse_xml_notas, corpus)
+
+    divergencias = 0
+    for antigo, novo in zip(antigos, novos):
+        if "erro" in antigo or "erro" in novo or len(novo["notas"]) != 1:
+            divergencias += 1
+            continue
+        # O parser original devolve o valor em float, o novo em Decimal: compara em centavos
+        if any(normalizar(c, antigo[c]) != normalizar(c, novo["notas"][0][c]) for c in CAMPOS):
+            divergencias += 1
+
+    print(f"  xmltodict (original): {tempo_antigo:.2f}s  {len(corpus) / tempo_antigo:,.0f} arquivos/s")
+    print(f"  iterparse (layouts):  {tempo_novo:.2f}s  {len(corpus) / tempo_novo:,.0f} arquivos/s")
+    print(f"  ganho: {tempo_antigo / tempo_novo:.1f}x, divergências: {divergencias}")
+
+    lista = gerar_lista_abrasf(args.notas_lista, aleatorio)
+    inicio = time.perf_counter()
+    resultado = parse_xml_notas(lista)
+    tempo_lista = time.perf_counter() - inicio
+
+    # Medido numa segunda execução: o tracemalloc deixa o parse bem mais lento
+    tracemalloc.start()
+    parse_xml_notas(lista)
+    _, pico = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"ListaNfse ABRASF: {len(lista) / 1024 / 1024:.1f} MB, {len(resultado.get('notas', []))} notas")
+    print(f"  iterparse (layouts):  {tempo_lista:.2f}s  {args.notas_lista / tempo_lista:,.0f} notas/s, "
+          f"pico de memória {pico / 1024 / 1024:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,29 @@
-from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Header
+from fastapi import FastAPI, HTTPException, Depends, UploadFile, File, Header, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import DuplicateKeyError
 from pydantic import BaseModel, EmailStr
 from typing import Optional, List
 from datetime import datetime, timedelta
 import os
+import asyncio
+import logging
 from dotenv import load_dotenv
-from utils.auth import verify_password, get_password_hash, create_access_token, decode_token
-from utils.brasil_api import consultar_cnpj
-from utils.xml_parser import parse_xml_nota
+from utils.auth import gerar_hash_senha, verificar_senha, encerrar_executor_hash, create_access_token, decode_token, dados_token_usuario, TOKEN_COM_DADOS_USUARIO
+from utils.cache import CacheTTL
+from utils.brasil_api import consultar_cnpj, encerrar_cliente_cnpj, cliente_cnpj, indice_cnpj
+from utils.cache_cnpj import CacheCNPJ
+from utils.executor_parser import ler_xml_notas_async, encerrar_executor, PARSER_MAX_CONCORRENCIA
+from utils.ingestao_stream import iterar_arquivos_upload
+from utils.fila_importacao import FilaImportacao, formatar_job
+from utils.indices import preparar_indices
+from utils import resumo_mensal, armazem_xml, campos_nota, pdf_notas, relatorios_notas
+from utils.regras_auditoria import auditar_notas, invalidar_regras, reauditar_servicos, calcular_limite_anual
 
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+
 # Configuração MongoDB
 MONGO_URL = os.getenv("MONGO_URL", "mongodb://localhost:27017")
 client = AsyncIOMotorClient(MONGO_URL)
@@ -53,7 +65,23 @@ class EmpresaCadastro(BaseModel):
     data_abertura: Optional[str] = None
     cnaes_permitidos: List[CnaePermitido]
 
+class ConsultaLoteCNPJ(BaseModel):
+    cnpjs: List[str]
+
+class EmpresasLote(BaseModel):
+    empresas: List[EmpresaCadastro]
+
 # ==================== AUTH MIDDLEWARE ====================
+# Usuários autenticados recentes, para não consultar o banco em toda requisição.
+# Toda escrita em db.usuarios deve chamar invalidar_usuario_cache; a invalidação
+# só vale para o processo que escreveu, nos demais a entrada expira pelo TTL.
+CACHE_USUARIOS_TTL = int(os.getenv("CACHE_USUARIOS_TTL", "60"))
+CACHE_USUARIOS_TAMANHO = int(os.getenv("CACHE_USUARIOS_TAMANHO", "10000"))
+cache_usuarios = CacheTTL(CACHE_USUARIOS_TAMANHO, CACHE_USUARIOS_TTL)
+
+def invalidar_usuario_cache(usuario_id):
+    cache_usuarios.invalidar(str(usuario_id))
+
 async def get_current_user(authorization: Optional[str] = Header(None)):
     from bson import ObjectId
     
@@ -70,16 +98,124 @@ async def get_current_user(authorization: Optional[str] = Header(None)):
     if not user_id:
         raise HTTPException(status_code=401, detail="Token inválido")
     
+    # Token com os dados do usuário assinados: dispensa a consulta
+    if TOKEN_COM_DADOS_USUARIO and payload.get("email"):
+        try:
+            return {
+                "_id": ObjectId(user_id),
+                "nome": payload.get("nome"),
+                "email": payload["email"],
+                "telefone": payload.get("telefone")
+            }
+        except:
+            raise HTTPException(status_code=401, detail="Token inválido")
+    
+    user = cache_usuarios.obter(user_id)
+    if user is not None:
+        return user
+    
     try:
-        user = await db.usuarios.find_one({"_id": ObjectId(user_id)})
+        user = await db.usuarios.find_one({"_id": ObjectId(user_id)}, {"senha_hash": 0})
     except:
         raise HTTPException(status_code=401, detail="Token inválido")
     
     if not user:
         raise HTTPException(status_code=401, detail="Usuário não encontrado")
     
+    cache_usuarios.definir(user_id, user)
     return user
 
+# ==================== AUTORIZAÇÃO DE EMPRESAS ====================
+# Empresas consultadas recentemente (dono, CNAEs, regime, limite...). TTL curto
+# porque outros processos da API podem alterar a empresa; atualizar_empresa e
+# excluir_empresa invalidam a entrada no processo que fez a alteração.
+CACHE_EMPRESAS_TTL = int(os.getenv("CACHE_EMPRESAS_TTL", "30"))
+CACHE_EMPRESAS_TAMANHO = int(os.getenv("CACHE_EMPRESAS_TAMANHO", "5000"))
+cache_empresas = CacheTTL(CACHE_EMPRESAS_TAMANHO, CACHE_EMPRESAS_TTL)
+
+def invalidar_empresa_cache(empresa_id):
+    cache_empresas.invalidar(str(empresa_id))
+    # As regras de auditoria compiladas dependem de CNAEs, regime e data de abertura
+    invalidar_regras(empresa_id)
+    # PDFs em cache trazem dados da empresa e o status das notas (reauditoria)
+    pdf_notas.invalidar_empresa(empresa_id)
+
+async def obter_empresa_cache(empresa_id: str):
+    """
+    Busca a empresa pelo id passando pelo cache. Levanta 400 para id inválido;
+    retorna None se não existir. Devolve uma cópia, que pode ser alterada.
+    """
+    from bson import ObjectId
+    
+    empresa = cache_empresas.obter(empresa_id)
+    if empresa is None:
+        try:
+            empresa = await db.empresas.find_one({"_id": ObjectId(empresa_id)})
+        except:
+            raise HTTPException(status_code=400, detail="ID de empresa inválido")
+        if not empresa:
+            return None
+        cache_empresas.definir(empresa_id, empresa)
+    return dict(empresa)
+
+async def empresa_autorizada(empresa_id: str, current_user: dict = Depends(get_current_user)):
+    """
+    Dependência das rotas /{empresa_id}: devolve a empresa se ela existir e
+    pertencer ao usuário autenticado.
+    """
+    empresa = await obter_empresa_cache(empresa_id)
+    
+    if not empresa:
+        raise HTTPException(status_code=404, detail="Empresa não encontrada")
+    
+    if str(empresa.get("usuario_id")) != str(current_user["_id"]):
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    return empresa
+
+async def obter_nota_autorizada(nota_id: str, current_user: dict, projecao: Optional[dict] = None):
+    """
+    Busca a nota e a empresa dona dela em uma única consulta ($lookup) e
+    verifica se a empresa pertence ao usuário. Retorna (nota, empresa).
+    `projecao` limita os campos da nota (empresa_id é sempre mantido).
+    """
+    from bson import ObjectId
+    
+    try:
+        filtro = {"_id": ObjectId(nota_id)}
+    except:
+        raise HTTPException(status_code=400, detail="ID de nota inválido")
+    
+    pipeline = [{"$match": filtro}]
+    if projecao:
+        # Projeção de inclusão precisa trazer empresa_id para o $lookup
+        if any(projecao.values()):
+            projecao = {**projecao, "empresa_id": 1}
+        pipeline.append({"$project": projecao})
+    pipeline.append({"$lookup": {
+        "from": "empresas",
+        # $convert em vez de $toObjectId: um empresa_id inválido vira "empresa não encontrada" em vez de erro
+        "let": {"empresa_id": {"$convert": {"input": "$empresa_id", "to": "objectId", "onError": None, "onNull": None}}},
+        "pipeline": [{"$match": {"$expr": {"$eq": ["$_id", "$$empresa_id"]}}}],
+        "as": "empresa"
+    }})
+    
+    resultado = await db.notas_fiscais.aggregate(pipeline).to_list(1)
+    if not resultado:
+        raise HTTPException(status_code=404, detail="Nota não encontrada")
+    
+    nota = resultado[0]
+    empresas = nota.pop("empresa")
+    empresa = empresas[0] if empresas else None
+    
+    if not empresa:
+        raise HTTPException(status_code=404, detail="Nota não encontrada")
+    if str(empresa.get("usuario_id")) != str(current_user["_id"]):
+        raise HTTPException(status_code=403, detail="Acesso negado")
+    
+    cache_empresas.definir(str(empresa["_id"]), empresa)
+    return nota, dict(empresa)
+
 # ==================== ROTAS DE AUTENTICAÇÃO ====================
 @app.post("/api/auth/registro")
 async def registrar_usuario(usuario: UsuarioRegistro):
@@ -92,16 +228,20 @@ async def registrar_usuario(usuario: UsuarioRegistro):
     usuario_doc = {
         "nome": usuario.nome,
         "email": usuario.email,
-        "senha_hash": get_password_hash(usuario.senha),
+        "senha_hash": await gerar_hash_senha(usuario.senha),
         "telefone": usuario.telefone,
         "data_criacao": datetime.utcnow().isoformat()
     }
     
-    result = await db.usuarios.insert_one(usuario_doc)
+    # O índice único de email cobre cadastros simultâneos com o mesmo email
+    try:
+        result = await db.usuarios.insert_one(usuario_doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Email já cadastrado")
     usuario_id = str(result.inserted_id)
     
     # Gera token
-    access_token = create_access_token(data={"sub": usuario_id})
+    access_token = create_access_token(data=dados_token_usuario(usuario_id, usuario_doc))
     
     return {
         "mensagem": "Usuário cadastrado com sucesso",
@@ -122,12 +262,19 @@ async def login(credenciais: UsuarioLogin):
         raise HTTPException(status_code=401, detail="Email ou senha incorretos")
     
     # Verifica senha
-    if not verify_password(credenciais.senha, usuario["senha_hash"]):
+    senha_valida, novo_hash = await verificar_senha(credenciais.senha, usuario["senha_hash"])
+    if not senha_valida:
         raise HTTPException(status_code=401, detail="Email ou senha incorretos")
     
-    # Gera token
     usuario_id = str(usuario["_id"])
-    access_token = create_access_token(data={"sub": usuario_id})
+    
+    # Hash gerado com outro custo (BCRYPT_ROUNDS mudou): regrava com o custo atual
+    if novo_hash:
+        await db.usuarios.update_one({"_id": usuario["_id"]}, {"$set": {"senha_hash": novo_hash}})
+        invalidar_usuario_cache(usuario_id)
+    
+    # Gera token
+    access_token = create_access_token(data=dados_token_usuario(usuario_id, usuario))
     
     return {
         "access_token": access_token,
@@ -149,9 +296,91 @@ async def obter_usuario_atual(current_user: dict = Depends(get_current_user)):
     }
 
 # ==================== ROTAS DE EMPRESAS ====================
+cache_cnpj = CacheCNPJ(db, consultar_cnpj)
+
 @app.get("/api/empresas/consulta/{cnpj}")
-async def consultar_cnpj_endpoint(cnpj: str, current_user: dict = Depends(get_current_user)):
-    return consultar_cnpj(cnpj)
+async def consultar_cnpj_endpoint(
+    cnpj: str,
+    atualizar: bool = False,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Dados do CNPJ para o cadastro. `atualizar=true` ignora o cache e consulta os provedores.
+    """
+    return await cache_cnpj.consultar(cnpj, atualizar)
+
+# Limites da consulta em lote (onboarding de carteiras inteiras)
+CNPJ_LOTE_MAXIMO = int(os.getenv("CNPJ_LOTE_MAXIMO", "500"))
+CNPJ_LOTE_CONCORRENCIA = int(os.getenv("CNPJ_LOTE_CONCORRENCIA", "5"))
+
+@app.post("/api/empresas/consulta-lote")
+async def consultar_cnpjs_em_lote(
+    consulta: ConsultaLoteCNPJ,
+    request: Request,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Consulta vários CNPJs em paralelo (até CNPJ_LOTE_CONCORRENCIA por vez) e
+    devolve NDJSON: uma linha por CNPJ, na ordem em que cada consulta termina.
+    O cache é usado primeiro; as idas aos provedores passam pelo limitador de taxa.
+    Cada linha indica também se o CNPJ já está cadastrado no sistema.
+    """
+    import json
+    from fastapi.responses import StreamingResponse
+    
+    # Remove duplicados mantendo a ordem
+    cnpjs = list(dict.fromkeys(
+        "".join([n for n in cnpj if n.isdigit()]) for cnpj in consulta.cnpjs
+    ))
+    cnpjs = [cnpj for cnpj in cnpjs if cnpj]
+    if not cnpjs:
+        raise HTTPException(status_code=400, detail="Informe ao menos um CNPJ")
+    if len(cnpjs) > CNPJ_LOTE_MAXIMO:
+        raise HTTPException(status_code=400, detail=f"Máximo de {CNPJ_LOTE_MAXIMO} CNPJs por consulta")
+    
+    cadastrados = set()
+    async for existente in db.empresas.find({"cnpj": {"$in": cnpjs}}, {"cnpj": 1, "_id": 0}):
+        cadastrados.add(existente["cnpj"])
+    
+    semaforo = asyncio.Semaphore(CNPJ_LOTE_CONCORRENCIA)
+    
+    async def consultar_um(cnpj: str):
+        linha = {"cnpj": cnpj, "ja_cadastrada": cnpj in cadastrados}
+        async with semaforo:
+            try:
+                linha.update({"status": "OK", "dados": await cache_cnpj.consultar(cnpj)})
+            except HTTPException as e:
+                status = "NAO_ENCONTRADO" if e.status_code == 404 else "ERRO"
+                linha.update({"status": status, "erro": e.detail})
+            except Exception as e:
+                linha.update({"status": "ERRO", "erro": str(e)})
+        return linha
+    
+    async def gerar():
+        tarefas = [asyncio.create_task(consultar_um(cnpj)) for cnpj in cnpjs]
+        try:
+            for proxima in asyncio.as_completed(tarefas):
+                if await request.is_disconnected():
+                    return
+                yield json.dumps(await proxima, ensure_ascii=False) + "\n"
+        finally:
+            # Cliente desconectou ou stream encerrado: não deixa consultas órfãs
+            for tarefa in tarefas:
+                tarefa.cancel()
+    
+    return StreamingResponse(gerar(), media_type="application/x-ndjson")
+
+def montar_empresa_doc(empresa: EmpresaCadastro, usuario_id: str, cnpj_limpo: str):
+    return {
+        "usuario_id": usuario_id,
+        "cnpj": cnpj_limpo,
+        "razao_social": empresa.razao_social,
+        "nome_fantasia": empresa.nome_fantasia,
+        "regime_tributario": empresa.regime_tributario,
+        "data_abertura": empresa.data_abertura,
+        "cnaes_permitidos": [cnae.dict() for cnae in empresa.cnaes_permitidos],
+        "data_cadastro": datetime.utcnow().isoformat()
+    }
 
 @app.post("/api/empresas")
 async def cadastrar_empresa(empresa: EmpresaCadastro, current_user: dict = Depends(get_current_user)):
@@ -164,24 +393,76 @@ async def cadastrar_empresa(empresa: EmpresaCadastro, current_user: dict = Depen
         raise HTTPException(status_code=400, detail="Empresa já cadastrada")
     
     # Cria a empresa
-    empresa_doc = {
-        "usuario_id": usuario_id,
-        "cnpj": cnpj_limpo,
-        "razao_social": empresa.razao_social,
-        "nome_fantasia": empresa.nome_fantasia,
-        "regime_tributario": empresa.regime_tributario,
-        "data_abertura": empresa.data_abertura,
-        "cnaes_permitidos": [cnae.dict() for cnae in empresa.cnaes_permitidos],
-        "data_cadastro": datetime.utcnow().isoformat()
-    }
+    empresa_doc = montar_empresa_doc(empresa, usuario_id, cnpj_limpo)
     
-    result = await db.empresas.insert_one(empresa_doc)
+    try:
+        result = await db.empresas.insert_one(empresa_doc)
+    except DuplicateKeyError:
+        raise HTTPException(status_code=400, detail="Empresa já cadastrada")
     
     return {
         "mensagem": "Empresa cadastrada com sucesso",
         "id": str(result.inserted_id)
     }
 
+@app.post("/api/empresas/lote")
+async def cadastrar_empresas_em_lote(lote: EmpresasLote, current_user: dict = Depends(get_current_user)):
+    """
+    Cadastra várias empresas com um único insert_many. CNPJs repetidos no lote
+    ou já cadastrados voltam como falha sem impedir as demais.
+    """
+    from pymongo.errors import BulkWriteError
+    
+    usuario_id = str(current_user["_id"])
+    if not lote.empresas:
+        raise HTTPException(status_code=400, detail="Nenhuma empresa enviada")
+    if len(lote.empresas) > CNPJ_LOTE_MAXIMO:
+        raise HTTPException(status_code=400, detail=f"Máximo de {CNPJ_LOTE_MAXIMO} empresas por lote")
+    
+    cnpjs = ["".join([n for n in empresa.cnpj if n.isdigit()]) for empresa in lote.empresas]
+    cadastrados = set()
+    async for existente in db.empresas.find({"cnpj": {"$in": cnpjs}}, {"cnpj": 1, "_id": 0}):
+        cadastrados.add(existente["cnpj"])
+    
+    resultados = [None] * len(cnpjs)
+    documentos = []
+    posicoes = []
+    vistos_no_lote = set()
+    for i, (empresa, cnpj_limpo) in enumerate(zip(lote.empresas, cnpjs)):
+        if cnpj_limpo in cadastrados or cnpj_limpo in vistos_no_lote:
+            resultados[i] = {"cnpj": cnpj_limpo, "sucesso": False, "erro": "Empresa já cadastrada"}
+            continue
+        vistos_no_lote.add(cnpj_limpo)
+        documentos.append(montar_empresa_doc(empresa, usuario_id, cnpj_limpo))
+        posicoes.append(i)
+    
+    erros_por_posicao = {}
+    if documentos:
+        try:
+            await db.empresas.insert_many(documentos, ordered=False)
+        except BulkWriteError as e:
+            for erro in e.details.get("writeErrors", []):
+                erros_por_posicao[erro["index"]] = erro
+    
+    for posicao, i in enumerate(posicoes):
+        erro = erros_por_posicao.get(posicao)
+        if erro is None:
+            resultados[i] = {"cnpj": cnpjs[i], "sucesso": True, "id": str(documentos[posicao]["_id"])}
+        elif erro.get("code") == 11000:
+            # Cadastrada por outra requisição entre a consulta e o insert
+            resultados[i] = {"cnpj": cnpjs[i], "sucesso": False, "erro": "Empresa já cadastrada"}
+        else:
+            resultados[i] = {"cnpj": cnpjs[i], "sucesso": False, "erro": erro.get("errmsg", "Erro de gravação")}
+    
+    criadas = sum(1 for r in resultados if r["sucesso"])
+    return {
+        "mensagem": f"{criadas} empresa(s) cadastrada(s)",
+        "total": len(resultados),
+        "criadas": criadas,
+        "falhas": len(resultados) - criadas,
+        "resultados": resultados
+    }
+
 @app.get("/api/empresas")
 async def listar_empresas(current_user: dict = Depends(get_current_user)):
     usuario_id = str(current_user["_id"])
@@ -199,237 +480,548 @@ async def listar_empresas(current_user: dict = Depends(get_current_user)):
     return empresas
 
 @app.get("/api/empresas/{empresa_id}")
-async def obter_empresa(empresa_id: str, current_user: dict = Depends(get_current_user)):
-    from bson import ObjectId
-    
-    try:
-        empresa = await db.empresas.find_one({"_id": ObjectId(empresa_id)})
-    except:
-        raise HTTPException(status_code=400, detail="ID inválido")
-    
-    if not empresa:
-        raise HTTPException(status_code=404, detail="Empresa não encontrada")
-    
-    if str(empresa.get("usuario_id")) != str(current_user["_id"]):
-        raise HTTPException(status_code=403, detail="Acesso negado")
-    
+async def obter_empresa(empresa_id: str, empresa: dict = Depends(empresa_autorizada)):
     empresa["id"] = str(empresa.pop("_id"))
     return empresa
 
 # ==================== ROTAS DE NOTAS FISCAIS ====================
 
-# Função auxiliar para processar um único XML
-async def processar_xml_nota(empresa_id: str, empresa: dict, conteudo: bytes, nome_arquivo: str):
+# Tamanho máximo de cada insert_many na importação em lote
+TAMANHO_LOTE_INSERCAO = int(os.getenv("TAMANHO_LOTE_INSERCAO", "500"))
+
+def calcular_impressao_digital(empresa_id: str, dados_xml: dict, conteudo: bytes):
     """
-    Processa um arquivo XML e retorna o resultado do processamento.
-    Não levanta exceções, retorna dict com sucesso ou erro.
+    Identifica uma nota dentro da empresa para detectar reimportações
+    (campos_nota.impressao_digital).
+    """
+    import hashlib
+    
+    chave = dados_xml.get('chave_validacao')
+    hash_xml = None if chave else hashlib.sha256(conteudo).hexdigest()
+    return campos_nota.impressao_digital(empresa_id, chave, dados_xml['numero_nota'], hash_xml)
+
+# Função auxiliar para montar os documentos das notas de um arquivo (parse, sem auditar nem gravar)
+async def preparar_notas(empresa_id: str, conteudo: bytes, nome_arquivo: str):
+    """
+    Faz o parse (no pool de parsing) de um XML e devolve uma lista com o
+    documento de cada nota do arquivo (um arquivo pode trazer várias, ex.:
+    ListaNfse ABRASF). Com mais de uma nota, o nome de cada item recebe o
+    sufixo "#n". A auditoria é feita por lote, em auditar_notas, logo antes de gravar.
+    Não levanta exceções; um erro de parse vira um único item com erro.
     """
     try:
-        # Parse do XML
-        dados_xml = parse_xml_nota(conteudo)
+        # Parse e compactação do XML fora do event loop
+        dados_arquivo = await ler_xml_notas_async(conteudo)
         
-        if "erro" in dados_xml:
-            return {
+        if "erro" in dados_arquivo:
+            return [{
                 "sucesso": False,
                 "nome_arquivo": nome_arquivo,
-                "erro": dados_xml["erro"]
-            }
+                "erro": dados_arquivo["erro"]
+            }]
         
-        # Auditoria: Verifica se o código de serviço está permitido
-        codigo_servico = dados_xml['codigo_servico']
-        cnaes_permitidos = empresa.get("cnaes_permitidos", [])
-        
-        cnae_encontrado = None
-        for cnae in cnaes_permitidos:
-            if cnae.get("codigo_servico_municipal") == codigo_servico:
-                cnae_encontrado = cnae
-                break
-        
-        status = "APROVADA"
-        mensagem = "Nota fiscal em conformidade"
-        
-        if not cnae_encontrado:
-            status = "ERRO_CNAE"
-            mensagem = f"Código de serviço '{codigo_servico}' não autorizado para este CNPJ"
-        
-        # Salva a nota (incluindo o XML original)
-        nota_doc = {
-            "empresa_id": empresa_id,
-            "numero_nota": dados_xml['numero_nota'],
-            "data_emissao": dados_xml['data_emissao'],
-            "chave_validacao": dados_xml.get('chave_validacao'),
-            "cnpj_tomador": dados_xml.get('cnpj_tomador'),
-            "codigo_servico_utilizado": codigo_servico,
-            "valor_total": dados_xml['valor_total'],
-            "status_auditoria": status,
-            "mensagem_erro": mensagem,
-            "xml_original": dados_xml.get('xml_bruto', ''),  # Armazena o XML completo
-            "data_importacao": datetime.utcnow().isoformat()
-        }
-        
-        result = await db.notas_fiscais.insert_one(nota_doc)
+        notas = dados_arquivo["notas"]
+        xml_blob = dados_arquivo["xml_blob"]
+        data_importacao = datetime.utcnow().isoformat()
+        preparados = []
+        for posicao, dados_xml in enumerate(notas, start=1):
+            # Documento da nota (incluindo o XML original); status preenchido pela auditoria
+            nota_doc = {
+                "empresa_id": empresa_id,
+                "impressao_digital": calcular_impressao_digital(empresa_id, dados_xml, conteudo),
+                "numero_nota": dados_xml['numero_nota'],
+                "data_emissao": campos_nota.para_data(dados_xml['data_emissao']),
+                "chave_validacao": dados_xml.get('chave_validacao'),
+                "cnpj_tomador": dados_xml.get('cnpj_tomador'),
+                "codigo_servico_utilizado": dados_xml['codigo_servico'],
+                "valor_centavos": campos_nota.para_centavos(dados_xml['valor_total']),
+                "status_auditoria": None,
+                "mensagem_erro": None,
+                "layout_xml": dados_arquivo["layout"],
+                "xml_hash": xml_blob["_id"],  # XML completo fica em xml_blobs (utils.armazem_xml)
+                "data_importacao": data_importacao
+            }
+            preparados.append({
+                "sucesso": True,
+                "nome_arquivo": nome_arquivo if len(notas) == 1 else f"{nome_arquivo}#{posicao}",
+                "nota_doc": nota_doc,
+                "xml_blob": xml_blob
+            })
+        return preparados
         
+    except Exception as e:
+        return [{
+            "sucesso": False,
+            "nome_arquivo": nome_arquivo,
+            "erro": f"Erro ao processar: {str(e)}"
+        }]
+
+def combinar_resultados_arquivo(nome_arquivo: str, resultados: list):
+    """
+    Junta os resultados das notas de um mesmo arquivo num resultado só (o
+    formato de um arquivo com uma nota). O arquivo conta como sucesso se ao
+    menos uma nota foi gravada; a primeira vai em "nota", todas em "notas" e
+    as que falharam em "falhas_parciais".
+    """
+    if len(resultados) == 1:
+        return resultados[0]
+    
+    gravadas = [r for r in resultados if r["sucesso"]]
+    falhas = [{"arquivo": r["nome_arquivo"], "erro": r["erro"]} for r in resultados if not r["sucesso"]]
+    
+    if gravadas:
         return {
             "sucesso": True,
             "nome_arquivo": nome_arquivo,
-            "nota": {
-                "id": str(result.inserted_id),
-                "numero_nota": nota_doc["numero_nota"],
-                "status_auditoria": nota_doc["status_auditoria"],
-                "valor_total": nota_doc["valor_total"]
-            }
+            "nota": gravadas[0]["nota"],
+            "notas": [r["nota"] for r in gravadas],
+            "falhas_parciais": falhas
         }
-        
+    
+    combinado = {
+        "sucesso": False,
+        "nome_arquivo": nome_arquivo,
+        "erro": "; ".join(f"{f['arquivo']}: {f['erro']}" for f in falhas)
+    }
+    if all(r.get("duplicada") for r in resultados):
+        combinado.update({"duplicada": True, "status": "DUPLICADA"})
+    return combinado
+
+def registrar_resultado_arquivo(resumo: dict, resultado: dict):
+    """
+    Soma o resultado (combinado) de um arquivo ao resumo de uma importação em
+    lote. sucesso/falhas/duplicadas contam arquivos, como total_arquivos;
+    notas_importadas conta as notas gravadas.
+    """
+    if resultado["sucesso"]:
+        resumo["sucesso"] += 1
+        resumo["notas_importadas"] += len(resultado.get("notas", [resultado["nota"]]))
+    else:
+        resumo["falhas"] += 1
+        if resultado.get("duplicada"):
+            resumo["duplicadas"] += 1
+        resumo["detalhes_falhas"].append({
+            "arquivo": resultado["nome_arquivo"],
+            "erro": resultado["erro"]
+        })
+
+def novo_resumo_importacao():
+    return {"total_arquivos": 0, "sucesso": 0, "falhas": 0, "duplicadas": 0, "notas_importadas": 0, "detalhes_falhas": []}
+
+def resultado_nota_gravada(nome_arquivo: str, nota_id, nota_doc: dict):
+    """
+    Monta o item de resultado de uma nota gravada com sucesso.
+    """
+    return {
+        "sucesso": True,
+        "nome_arquivo": nome_arquivo,
+        "nota": {
+            "id": str(nota_id),
+            "numero_nota": nota_doc["numero_nota"],
+            "status_auditoria": nota_doc["status_auditoria"],
+            "valor_total": campos_nota.valor_nota(nota_doc)
+        }
+    }
+
+# Função auxiliar para processar um único XML
+async def processar_xml_nota(empresa_id: str, empresa: dict, conteudo: bytes, nome_arquivo: str):
+    """
+    Processa um arquivo XML (uma ou mais notas) e retorna o resultado do processamento.
+    Não levanta exceções, retorna dict com sucesso ou erro.
+    """
+    preparados = await preparar_notas(empresa_id, conteudo, nome_arquivo)
+    try:
+        resultados = await gravar_notas_em_lote(empresa, preparados)
     except Exception as e:
         return {
             "sucesso": False,
             "nome_arquivo": nome_arquivo,
             "erro": f"Erro ao processar: {str(e)}"
         }
+    return combinar_resultados_arquivo(nome_arquivo, resultados)
+
+def resultado_duplicada(nome_arquivo: str, nota_doc: dict):
+    return {
+        "sucesso": False,
+        "duplicada": True,
+        "status": "DUPLICADA",
+        "nome_arquivo": nome_arquivo,
+        "erro": f"DUPLICADA: nota {nota_doc['numero_nota']} já foi importada para esta empresa"
+    }
+
+async def gravar_notas_em_lote(empresa: dict, preparados: list, job_id: Optional[str] = None):
+    """
+    Audita e grava os documentos preparados com insert_many não ordenado, em
+    blocos de TAMANHO_LOTE_INSERCAO. Cada bloco é auditado de uma vez (após
+    descartar duplicadas) e cada erro de escrita é mapeado de volta ao arquivo
+    de origem. Retorna a lista de resultados na mesma ordem de `preparados`.
+    
+    Notas repetidas (dentro do próprio lote ou já gravadas) são devolvidas como
+    DUPLICADA: uma única consulta $in por bloco pelas impressões digitais, e o
+    índice único cobre importações simultâneas.
+    
+    Com `job_id` (fila de importação) as notas são gravadas com import_job_id,
+    e uma nota já gravada pelo mesmo job conta como importada: é a rodada
+    sendo refeita depois de um worker cair entre o insert e o registro dos
+    resultados.
+    """
+    from pymongo.errors import BulkWriteError
+    
+    resultados = list(preparados)
+    pendentes = [i for i, p in enumerate(preparados) if p["sucesso"]]
+    vistas_no_lote = set()
+    
+    for inicio in range(0, len(pendentes), TAMANHO_LOTE_INSERCAO):
+        bloco = pendentes[inicio:inicio + TAMANHO_LOTE_INSERCAO]
+        
+        impressoes = [preparados[i]["nota_doc"]["impressao_digital"] for i in bloco]
+        ja_gravadas = {}
+        async for existente in db.notas_fiscais.find(
+            {"impressao_digital": {"$in": impressoes}},
+            {"impressao_digital": 1, "import_job_id": 1, "numero_nota": 1, "status_auditoria": 1,
+             "valor_centavos": 1, "valor_total": 1}
+        ):
+            ja_gravadas[existente["impressao_digital"]] = existente
+        
+        # Separa as duplicadas antes de enviar ao banco
+        a_gravar = []
+        for i in bloco:
+            nota_doc = preparados[i]["nota_doc"]
+            impressao = nota_doc["impressao_digital"]
+            existente = ja_gravadas.get(impressao)
+            if impressao in vistas_no_lote:
+                resultados[i] = resultado_duplicada(preparados[i]["nome_arquivo"], nota_doc)
+            elif existente is not None:
+                vistas_no_lote.add(impressao)
+                if job_id and existente.get("import_job_id") == job_id:
+                    resultados[i] = resultado_nota_gravada(preparados[i]["nome_arquivo"], existente["_id"], existente)
+                else:
+                    resultados[i] = resultado_duplicada(preparados[i]["nome_arquivo"], nota_doc)
+            else:
+                if job_id:
+                    nota_doc["import_job_id"] = job_id
+                vistas_no_lote.add(impressao)
+                a_gravar.append(i)
+        
+        if not a_gravar:
+            continue
+        
+        documentos = [preparados[i]["nota_doc"] for i in a_gravar]
+        await auditar_notas(db, empresa, documentos)
+        erros_por_posicao = {}
+        
+        try:
+            # O XML vai antes das notas, para nenhuma nota gravada ficar sem ele
+            await armazem_xml.guardar_blobs(db, [preparados[i]["xml_blob"] for i in a_gravar])
+        except Exception as e:
+            erros_por_posicao = {posicao: {"errmsg": f"XML original: {str(e)}"} for posicao in range(len(a_gravar))}
+        
+        try:
+            if not erros_por_posicao:
+                await db.notas_fiscais.insert_many(documentos, ordered=False)
+        except BulkWriteError as e:
+            for erro in e.details.get("writeErrors", []):
+                erros_por_posicao[erro["index"]] = erro
+        except Exception as e:
+            # Falha geral (ex.: conexão): nenhum documento do bloco é considerado gravado
+            erros_por_posicao = {posicao: {"errmsg": str(e)} for posicao in range(len(a_gravar))}
+        
+        gravadas = []
+        for posicao, i in enumerate(a_gravar):
+            nome_arquivo = preparados[i]["nome_arquivo"]
+            nota_doc = documentos[posicao]
+            erro = erros_por_posicao.get(posicao)
+            if erro is None:
+                # insert_many preenche o _id em cada documento antes de enviar
+                gravadas.append(nota_doc)
+                resultados[i] = resultado_nota_gravada(nome_arquivo, nota_doc["_id"], nota_doc)
+            elif erro.get("code") == 11000:
+                # Gravada por outra importação entre a consulta e o insert
+                resultados[i] = resultado_duplicada(nome_arquivo, nota_doc)
+            else:
+                resultados[i] = {
+                    "sucesso": False,
+                    "nome_arquivo": nome_arquivo,
+                    "erro": f"Erro ao gravar: {erro.get('errmsg', 'Erro de gravação')}"
+                }
+        
+        await resumo_mensal.registrar_notas(db, gravadas)
+    
+    return resultados
 
 @app.post("/api/notas/importar/{empresa_id}")
 async def importar_nota_xml(
     empresa_id: str, 
     file: UploadFile = File(...), 
-    current_user: dict = Depends(get_current_user)
+    empresa: dict = Depends(empresa_autorizada)
 ):
-    from bson import ObjectId
-    
-    # Verifica se a empresa existe e pertence ao usuário
-    try:
-        empresa = await db.empresas.find_one({"_id": ObjectId(empresa_id)})
-    except:
-        raise HTTPException(status_code=400, detail="ID de empresa inválido")
-    
-    if not empresa:
-        raise HTTPException(status_code=404, detail="Empresa não encontrada")
-    
-    if str(empresa.get("usuario_id")) != str(current_user["_id"]):
-        raise HTTPException(status_code=403, detail="Acesso negado")
-    
     # Lê o XML
     conteudo = await file.read()
     resultado = await processar_xml_nota(empresa_id, empresa, conteudo, file.filename)
     
+    if resultado.get("duplicada"):
+        raise HTTPException(status_code=409, detail=resultado["erro"])
+    
     if not resultado["sucesso"]:
         raise HTTPException(status_code=400, detail=resultado["erro"])
     
-    # Busca a nota completa para retornar
+    # Busca a nota completa para retornar (a primeira, se o arquivo trouxer várias)
     from bson import ObjectId
     nota = await db.notas_fiscais.find_one({"_id": ObjectId(resultado["nota"]["id"])})
     
     return {
         "id": str(nota["_id"]),
         "numero_nota": nota["numero_nota"],
-        "data_emissao": nota["data_emissao"],
+        "data_emissao": campos_nota.data_texto(nota["data_emissao"]),
         "codigo_servico_utilizado": nota["codigo_servico_utilizado"],
-        "valor_total": nota["valor_total"],
+        "valor_total": campos_nota.valor_nota(nota),
         "status_auditoria": nota["status_auditoria"],
         "mensagem_erro": nota["mensagem_erro"],
         "chave_validacao": nota.get("chave_validacao"),
         "cnpj_tomador": nota.get("cnpj_tomador"),
-        "data_importacao": nota["data_importacao"]
+        "data_importacao": nota["data_importacao"],
+        "notas_importadas": len(resultado.get("notas", [resultado["nota"]])),
+        "falhas_parciais": resultado.get("falhas_parciais", [])
     }
 
 @app.post("/api/notas/importar-lote/{empresa_id}")
 async def importar_notas_em_lote(
     empresa_id: str,
     files: List[UploadFile] = File(...),
-    current_user: dict = Depends(get_current_user)
+    empresa: dict = Depends(empresa_autorizada)
 ):
     """
     Importa múltiplos arquivos XML de notas fiscais de uma vez.
     Processa todos os arquivos de forma "graceful" - se um falhar, continua os outros.
     """
-    from bson import ObjectId
-    
-    # Verifica se a empresa existe e pertence ao usuário
-    try:
-        empresa = await db.empresas.find_one({"_id": ObjectId(empresa_id)})
-    except:
-        raise HTTPException(status_code=400, detail="ID de empresa inválido")
-    
-    if not empresa:
-        raise HTTPException(status_code=404, detail="Empresa não encontrada")
-    
-    if str(empresa.get("usuario_id")) != str(current_user["_id"]):
-        raise HTTPException(status_code=403, detail="Acesso negado")
-    
     # Valida quantidade de arquivos (máximo 100 por upload)
     if len(files) > 100:
         raise HTTPException(status_code=400, detail="Máximo de 100 arquivos por upload")
     
-    # Processa cada arquivo
+    # Primeiro faz parse e auditoria de todos os arquivos, em paralelo no pool de parsing
+    # (a concorrência é limitada por PARSER_MAX_CONCORRENCIA)
+    tarefas = []
+    for file in files:
+        conteudo = await file.read()
+        tarefas.append(preparar_notas(empresa_id, conteudo, file.filename))
+    por_arquivo = await asyncio.gather(*tarefas)
+    
+    # Depois grava todas as notas válidas de uma vez
+    resultados_notas = iter(await gravar_notas_em_lote(empresa, [p for lista in por_arquivo for p in lista]))
+    
+    # Um resultado por arquivo (um ListaNfse com várias notas conta como um arquivo)
+    resumo = novo_resumo_importacao()
+    resumo["total_arquivos"] = len(files)
     resultados = []
-    sucessos = 0
-    falhas = 0
-    detalhes_falhas = []
+    for file, lista in zip(files, por_arquivo):
+        resultado = combinar_resultados_arquivo(file.filename, [next(resultados_notas) for _ in lista])
+        registrar_resultado_arquivo(resumo, resultado)
+        resultados.append(resultado)
     
-    for idx, file in enumerate(files, 1):
-        # Lê o conteúdo
-        conteudo = await file.read()
+    # Retorna resumo
+    return {**resumo, "resultados": resultados}
+
+@app.post("/api/notas/importar-stream/{empresa_id}")
+async def importar_notas_stream(
+    empresa_id: str,
+    request: Request,
+    empresa: dict = Depends(empresa_autorizada)
+):
+    """
+    Importa um lote de XMLs de qualquer tamanho lendo o corpo da requisição em streaming.
+    Aceita multipart/form-data (XMLs e/ou ZIPs exportados pelo portal da prefeitura)
+    ou um único ZIP enviado como application/zip.
+    Cada XML é auditado assim que chega e as notas são gravadas em blocos de
+    TAMANHO_LOTE_INSERCAO, então o uso de memória não cresce com o tamanho do lote.
+    """
+    resumo = novo_resumo_importacao()
+    em_andamento = {}
+    # (nome do arquivo, notas preparadas do arquivo): um arquivo nunca é dividido entre gravações
+    preparados = []
+    total_preparados = 0
+    
+    async def aguardar_parses(todos: bool):
+        nonlocal total_preparados
+        if not em_andamento:
+            return
+        concluidos, _ = await asyncio.wait(
+            em_andamento,
+            return_when=asyncio.ALL_COMPLETED if todos else asyncio.FIRST_COMPLETED
+        )
+        for tarefa in concluidos:
+            lista = tarefa.result()
+            preparados.append((em_andamento.pop(tarefa), lista))
+            total_preparados += len(lista)
+    
+    async def gravar_preparados():
+        nonlocal total_preparados
+        resultados = iter(await gravar_notas_em_lote(empresa, [p for _, lista in preparados for p in lista]))
+        for nome_arquivo, lista in preparados:
+            registrar_resultado_arquivo(resumo, combinar_resultados_arquivo(nome_arquivo, [next(resultados) for _ in lista]))
+        preparados.clear()
+        total_preparados = 0
+    
+    async for recebido in iterar_arquivos_upload(request):
+        resumo["total_arquivos"] += 1
         
-        # Processa o XML
-        resultado = await processar_xml_nota(empresa_id, empresa, conteudo, file.filename)
+        if recebido.erro:
+            registrar_resultado_arquivo(resumo, {"sucesso": False, "nome_arquivo": recebido.nome_arquivo, "erro": recebido.erro})
+            continue
         
-        if resultado["sucesso"]:
-            sucessos += 1
-        else:
-            falhas += 1
-            detalhes_falhas.append({
-                "arquivo": file.filename,
-                "erro": resultado["erro"]
-            })
+        tarefa = asyncio.create_task(preparar_notas(empresa_id, recebido.conteudo, recebido.nome_arquivo))
+        em_andamento[tarefa] = recebido.nome_arquivo
         
-        resultados.append(resultado)
+        # Janela limitada de parses em paralelo: não lê mais do corpo enquanto ela estiver cheia
+        if len(em_andamento) >= PARSER_MAX_CONCORRENCIA:
+            await aguardar_parses(todos=False)
+        
+        if total_preparados >= TAMANHO_LOTE_INSERCAO:
+            await gravar_preparados()
     
-    # Retorna resumo
-    return {
-        "total_arquivos": len(files),
-        "sucesso": sucessos,
-        "falhas": falhas,
-        "detalhes_falhas": detalhes_falhas,
-        "resultados": resultados
-    }
+    await aguardar_parses(todos=True)
+    await gravar_preparados()
+    
+    if resumo["total_arquivos"] == 0:
+        raise HTTPException(status_code=400, detail="Nenhum arquivo XML encontrado no envio")
+    
+    return resumo
 
-@app.get("/api/notas/{nota_id}/detalhes")
-async def obter_detalhes_nota(nota_id: str, current_user: dict = Depends(get_current_user)):
+# ==================== IMPORTAÇÃO EM SEGUNDO PLANO ====================
+async def processar_lote_job(job: dict, arquivos: list):
     """
-    Retorna todos os detalhes de uma nota fiscal, incluindo XML original.
+    Processa uma rodada de arquivos de um job da fila de importação.
+    Devolve um resultado por arquivo, na mesma ordem.
     """
+    empresa_id = job["empresa_id"]
+    empresa = await obter_empresa_cache(empresa_id)
+    if not empresa:
+        raise Exception("Empresa não encontrada (excluída durante a importação)")
+    
+    por_arquivo = await asyncio.gather(*[
+        preparar_notas(empresa_id, bytes(arquivo["conteudo"]), arquivo["nome_arquivo"])
+        for arquivo in arquivos
+    ])
+    # Com o job_id, refazer uma rodada já gravada (worker caiu antes de registrar) não gera DUPLICADAs
+    resultados = iter(await gravar_notas_em_lote(empresa, [p for lista in por_arquivo for p in lista], str(job["_id"])))
+    # Um resultado por arquivo, como a fila espera
+    return [
+        combinar_resultados_arquivo(arquivo["nome_arquivo"], [next(resultados) for _ in lista])
+        for arquivo, lista in zip(arquivos, por_arquivo)
+    ]
+
+fila_importacao = FilaImportacao(db, processar_lote_job)
+
+async def obter_job_do_usuario(job_id: str, current_user: dict):
     from bson import ObjectId
     
-    # Busca a nota
     try:
-        nota = await db.notas_fiscais.find_one({"_id": ObjectId(nota_id)})
+        job = await db.import_jobs.find_one({"_id": ObjectId(job_id)})
     except:
-        raise HTTPException(status_code=400, detail="ID de nota inválido")
+        raise HTTPException(status_code=400, detail="ID de job inválido")
     
-    if not nota:
-        raise HTTPException(status_code=404, detail="Nota não encontrada")
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    
+    if job.get("usuario_id") != str(current_user["_id"]):
+        raise HTTPException(status_code=403, detail="Acesso negado")
     
-    # Verifica se a empresa da nota pertence ao usuário
-    empresa_id = nota.get("empresa_id")
+    return job
+
+@app.post("/api/import-jobs/{empresa_id}")
+async def criar_job_importacao(
+    empresa_id: str,
+    request: Request,
+    current_user: dict = Depends(get_current_user),
+    empresa: dict = Depends(empresa_autorizada)
+):
+    """
+    Recebe um lote de XMLs (multipart ou ZIP, como em /importar-stream), grava os
+    arquivos na fila e devolve o id do job. O processamento acontece em segundo
+    plano; acompanhe por GET /api/import-jobs/{id} ou pelo stream /eventos.
+    """
+    job_id = await fila_importacao.criar_job(empresa_id, str(current_user["_id"]))
+    
+    total = 0
+    bloco = []
     try:
-        empresa = await db.empresas.find_one({"_id": ObjectId(empresa_id)})
-    except:
-        pass
+        async for recebido in iterar_arquivos_upload(request):
+            bloco.append(recebido)
+            if len(bloco) >= TAMANHO_LOTE_INSERCAO:
+                await fila_importacao.adicionar_arquivos(job_id, bloco, total)
+                total += len(bloco)
+                bloco = []
+        await fila_importacao.adicionar_arquivos(job_id, bloco, total)
+        total += len(bloco)
+    except Exception as e:
+        await fila_importacao.cancelar_recebimento(job_id, f"Falha no recebimento: {str(e)}")
+        raise
     
-    if not empresa or str(empresa.get("usuario_id")) != str(current_user["_id"]):
-        raise HTTPException(status_code=403, detail="Acesso negado")
+    if total == 0:
+        await fila_importacao.cancelar_recebimento(job_id, "Nenhum arquivo XML encontrado no envio")
+        raise HTTPException(status_code=400, detail="Nenhum arquivo XML encontrado no envio")
+    
+    await fila_importacao.liberar_job(job_id)
     
-    # Retorna nota com todos os dados
     return {
-        "id": str(nota["_id"]),
-        "numero_nota": nota.get("numero_nota"),
-        "data_emissao": nota.get("data_emissao"),
-        "chave_validacao": nota.get("chave_validacao"),
-        "cnpj_tomador": nota.get("cnpj_tomador"),
+        "mensagem": "Importação enviada para processamento",
+        "job_id": job_id,
+        "total_arquivos": total
+    }
+
+@app.get("/api/import-jobs/{job_id}")
+async def obter_job_importacao(job_id: str, current_user: dict = Depends(get_current_user)):
+    job = await obter_job_do_usuario(job_id, current_user)
+    
+    detalhes_falhas = []
+    async for arquivo in db.import_job_arquivos.find(
+        {"job_id": job_id, "status": "FALHA"},
+        {"nome_arquivo": 1, "erro": 1}
+    ).sort("seq", 1).limit(500):
+        detalhes_falhas.append({"arquivo": arquivo["nome_arquivo"], "erro": arquivo.get("erro")})
+    
+    return {**formatar_job(job), "detalhes_falhas": detalhes_falhas}
+
+@app.get("/api/import-jobs/{job_id}/eventos")
+async def acompanhar_job_importacao(
+    job_id: str,
+    request: Request,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Stream Server-Sent Events com o progresso do job (eventos `progresso` e `fim`).
+    """
+    from fastapi.responses import StreamingResponse
+    
+    await obter_job_do_usuario(job_id, current_user)
+    
+    return StreamingResponse(
+        fila_importacao.eventos_sse(job_id, request),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/api/notas/{nota_id}/detalhes")
+async def obter_detalhes_nota(nota_id: str, current_user: dict = Depends(get_current_user)):
+    """
+    Retorna todos os detalhes de uma nota fiscal, incluindo XML original.
+    """
+    # Busca a nota e verifica se a empresa dela pertence ao usuário
+    nota, empresa = await obter_nota_autorizada(nota_id, current_user)
+    # O XML fica fora da nota e só é carregado aqui
+    xml_original = await armazem_xml.carregar_xml(db, nota)
+    
+    # Retorna nota com todos os dados
+    return {
+        "id": str(nota["_id"]),
+        "numero_nota": nota.get("numero_nota"),
+        "data_emissao": campos_nota.data_texto(nota.get("data_emissao")),
+        "chave_validacao": nota.get("chave_validacao"),
+        "cnpj_tomador": nota.get("cnpj_tomador"),
         "codigo_servico_utilizado": nota.get("codigo_servico_utilizado"),
-        "valor_total": nota.get("valor_total"),
+        "valor_total": campos_nota.valor_nota(nota),
         "status_auditoria": nota.get("status_auditoria"),
         "mensagem_erro": nota.get("mensagem_erro"),
-        "xml_original": nota.get("xml_original", ''),
+        "xml_original": xml_original,
         "data_importacao": nota.get("data_importacao"),
         "empresa": {
             "razao_social": empresa.get("razao_social"),
@@ -438,26 +1030,125 @@ async def obter_detalhes_nota(nota_id: str, current_user: dict = Depends(get_cur
         }
     }
 
-@app.get("/api/notas/empresa/{empresa_id}")
-async def listar_notas_empresa(empresa_id: str, current_user: dict = Depends(get_current_user)):
+# Campos usados na listagem (o xml_original nunca é lido aqui)
+PROJECAO_LISTAGEM_NOTAS = {
+    "numero_nota": 1,
+    "data_emissao": 1,
+    "codigo_servico_utilizado": 1,
+    "valor_centavos": 1,
+    "valor_total": 1,  # notas ainda não migradas (utils.campos_nota)
+    "status_auditoria": 1,
+    "mensagem_erro": 1,
+    "data_importacao": 1
+}
+
+def codificar_cursor(nota: dict):
+    import base64
+    import json
+    
+    # O tipo da data entra no cursor: notas não migradas ainda têm data_emissao em texto
+    tipo = "data" if isinstance(nota["data_emissao"], datetime) else "texto"
+    bruto = json.dumps([campos_nota.data_texto(nota["data_emissao"]), str(nota["_id"]), tipo])
+    return base64.urlsafe_b64encode(bruto.encode()).decode()
+
+def decodificar_cursor(cursor: str):
+    import base64
+    import json
     from bson import ObjectId
     
-    # Verifica se a empresa pertence ao usuário
     try:
-        empresa = await db.empresas.find_one({"_id": ObjectId(empresa_id)})
-    except:
-        raise HTTPException(status_code=400, detail="ID de empresa inválido")
+        partes = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        data_emissao, nota_id = partes[0], partes[1]
+        # Cursores antigos têm só [data em texto, id]
+        if len(partes) > 2 and partes[2] == "data":
+            data_emissao = campos_nota.para_data(data_emissao)
+        return data_emissao, ObjectId(nota_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Cursor inválido")
+
+@app.get("/api/notas/empresa/{empresa_id}")
+async def listar_notas_empresa(
+    empresa_id: str,
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+    status: Optional[str] = None,
+    data_inicio: Optional[str] = None,
+    data_fim: Optional[str] = None,
+    codigo_servico: Optional[str] = None,
+    ordem: str = "desc",
+    empresa: dict = Depends(empresa_autorizada)
+):
+    """
+    Lista as notas da empresa.
     
-    if not empresa:
-        raise HTTPException(status_code=404, detail="Empresa não encontrada")
+    Com `limit`, responde uma página ordenada por (data_emissao, _id) e o
+    `proximo_cursor` para buscar a seguinte. Sem `limit`, devolve a lista
+    completa (formato antigo). Filtros opcionais: status, período
+    (data_inicio/data_fim no formato YYYY-MM-DD) e código de serviço.
+    """
+    from dateutil.relativedelta import relativedelta
     
-    if str(empresa.get("usuario_id")) != str(current_user["_id"]):
-        raise HTTPException(status_code=403, detail="Acesso negado")
+    if ordem not in ("asc", "desc"):
+        raise HTTPException(status_code=400, detail="Ordem deve ser 'asc' ou 'desc'")
+    
+    if limit is not None and not 1 <= limit <= 500:
+        raise HTTPException(status_code=400, detail="limit deve estar entre 1 e 500")
+    
+    # Filtros
+    filtro = {"empresa_id": empresa_id}
+    if status:
+        filtro["status_auditoria"] = status
+    if codigo_servico:
+        filtro["codigo_servico_utilizado"] = codigo_servico
+    
+    inicio = fim = None
+    try:
+        if data_inicio:
+            inicio = datetime.strptime(data_inicio, '%Y-%m-%d')
+        if data_fim:
+            fim = datetime.strptime(data_fim, '%Y-%m-%d') + relativedelta(days=1)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Datas devem estar no formato YYYY-MM-DD")
+    condicoes = [filtro]
+    if inicio or fim:
+        condicoes.append(campos_nota.filtro_periodo(inicio, fim))
+    
+    # Paginação por chave: continua depois da última nota da página anterior
+    direcao = -1 if ordem == "desc" else 1
+    if cursor:
+        data_cursor, id_cursor = decodificar_cursor(cursor)
+        operador = "$lt" if direcao == -1 else "$gt"
+        depois_do_cursor = [
+            {"data_emissao": {operador: data_cursor}},
+            {"data_emissao": data_cursor, "_id": {operador: id_cursor}}
+        ]
+        # Durante a migração de tipos: o MongoDB ordena texto antes de datas e a
+        # comparação não cruza tipos, então o outro tipo entra quando vem depois do cursor
+        data_no_cursor = isinstance(data_cursor, datetime)
+        if direcao == -1 and data_no_cursor:
+            depois_do_cursor.append({"data_emissao": {"$type": "string"}})
+        elif direcao == 1 and not data_no_cursor:
+            depois_do_cursor.append({"data_emissao": {"$type": "date"}})
+        condicoes.append({"$or": depois_do_cursor})
+    filtro = condicoes[0] if len(condicoes) == 1 else {"$and": condicoes}
+    
+    consulta = db.notas_fiscais.find(filtro, PROJECAO_LISTAGEM_NOTAS).sort(
+        [("data_emissao", direcao), ("_id", direcao)]
+    )
+    if limit is not None:
+        # Um item a mais indica se existe próxima página
+        consulta = consulta.limit(limit + 1)
     
     # Lista as notas com cálculo de imposto estimado
     notas = []
-    async for nota in db.notas_fiscais.find({"empresa_id": empresa_id}):
-        valor_total = nota.get("valor_total", 0)
+    ultima = None
+    tem_mais = False
+    async for nota in consulta:
+        if limit is not None and len(notas) == limit:
+            tem_mais = True
+            break
+        ultima = nota
+        valor_total = campos_nota.valor_nota(nota)
         
         # Cálculo de imposto estimado (Anexo III - 6%)
         imposto_estimado = valor_total * 0.06
@@ -465,7 +1156,7 @@ async def listar_notas_empresa(empresa_id: str, current_user: dict = Depends(get
         notas.append({
             "id": str(nota["_id"]),
             "numero_nota": nota["numero_nota"],
-            "data_emissao": nota["data_emissao"],
+            "data_emissao": campos_nota.data_texto(nota["data_emissao"]),
             "codigo_servico_utilizado": nota["codigo_servico_utilizado"],
             "valor_total": valor_total,
             "imposto_estimado": round(imposto_estimado, 2),  # NOVO
@@ -474,34 +1165,57 @@ async def listar_notas_empresa(empresa_id: str, current_user: dict = Depends(get
             "data_importacao": nota["data_importacao"]
         })
     
-    return notas
+    if limit is None:
+        return notas
+    
+    return {
+        "notas": notas,
+        "proximo_cursor": codificar_cursor(ultima) if tem_mais else None,
+        "tem_mais": tem_mais
+    }
 
 @app.get("/api/notas/estatisticas/{empresa_id}")
-async def obter_estatisticas(empresa_id: str, current_user: dict = Depends(get_current_user)):
-    from bson import ObjectId
-    
-    # Verifica acesso
-    try:
-        empresa = await db.empresas.find_one({"_id": ObjectId(empresa_id)})
-    except:
-        raise HTTPException(status_code=400, detail="ID inválido")
-    
-    if not empresa or str(empresa.get("usuario_id")) != str(current_user["_id"]):
-        raise HTTPException(status_code=403, detail="Acesso negado")
-    
-    # Estatísticas
-    total = await db.notas_fiscais.count_documents({"empresa_id": empresa_id})
-    aprovadas = await db.notas_fiscais.count_documents({"empresa_id": empresa_id, "status_auditoria": "APROVADA"})
-    erros = await db.notas_fiscais.count_documents({"empresa_id": empresa_id, "status_auditoria": {"$ne": "APROVADA"}})
-    
-    # Valor total
+async def obter_estatisticas(empresa_id: str, empresa: dict = Depends(empresa_autorizada)):
+    # Estatísticas em uma única passada pelas notas da empresa
     pipeline = [
         {"$match": {"empresa_id": empresa_id}},
-        {"$group": {"_id": None, "total": {"$sum": "$valor_total"}}}
+        # Só os campos usados, com o valor já em centavos (soma exata em inteiros)
+        {"$project": {"_id": 0, "status_auditoria": 1, "valor_centavos": campos_nota.EXPRESSAO_CENTAVOS, "data_emissao": 1}},
+        {"$facet": {
+            "totais": [
+                {"$group": {
+                    "_id": None,
+                    "total": {"$sum": 1},
+                    "aprovadas": {"$sum": {"$cond": [{"$eq": ["$status_auditoria", "APROVADA"]}, 1, 0]}},
+                    "valor_centavos": {"$sum": "$valor_centavos"}
+                }}
+            ],
+            "por_status": [
+                {"$group": {
+                    "_id": "$status_auditoria",
+                    "quantidade": {"$sum": 1},
+                    "valor_centavos": {"$sum": "$valor_centavos"}
+                }},
+                {"$sort": {"_id": 1}}
+            ],
+            "por_mes": [
+                {"$group": {
+                    "_id": resumo_mensal.EXPRESSAO_MES,
+                    "quantidade": {"$sum": 1},
+                    "valor_centavos": {"$sum": "$valor_centavos"}
+                }},
+                {"$sort": {"_id": 1}}
+            ]
+        }}
     ]
     
-    resultado = await db.notas_fiscais.aggregate(pipeline).to_list(1)
-    valor_total = resultado[0]["total"] if resultado else 0
+    resultado = (await db.notas_fiscais.aggregate(pipeline).to_list(1))[0]
+    totais = resultado["totais"][0] if resultado["totais"] else {"total": 0, "aprovadas": 0, "valor_centavos": 0}
+    
+    total = totais["total"]
+    aprovadas = totais["aprovadas"]
+    erros = total - aprovadas
+    valor_total = campos_nota.para_reais(totais["valor_centavos"])
     
     # Cálculo de imposto estimado total (Anexo III - 6%)
     imposto_estimado_total = valor_total * 0.06
@@ -511,53 +1225,27 @@ async def obter_estatisticas(empresa_id: str, current_user: dict = Depends(get_c
         "aprovadas": aprovadas,
         "com_erros": erros,
         "valor_total": valor_total,
+        "por_status": [
+            {"status": item["_id"], "quantidade": item["quantidade"], "valor_total": campos_nota.para_reais(item["valor_centavos"])}
+            for item in resultado["por_status"]
+        ],
+        "por_mes": [
+            {"mes": item["_id"], "quantidade": item["quantidade"], "valor_total": campos_nota.para_reais(item["valor_centavos"])}
+            for item in resultado["por_mes"]
+        ],
         "imposto_estimado_total": round(imposto_estimado_total, 2)  # NOVO
     }
 
 @app.get("/api/notas/imposto-mes/{empresa_id}")
-async def obter_imposto_mes(empresa_id: str, current_user: dict = Depends(get_current_user)):
+async def obter_imposto_mes(empresa_id: str, empresa: dict = Depends(empresa_autorizada)):
     """
     Retorna o imposto estimado das notas do mês atual.
     Regra: Anexo III do Simples Nacional (6% fixo para MVP).
     """
-    from bson import ObjectId
-    from dateutil.relativedelta import relativedelta
-    
-    # Verifica acesso
-    try:
-        empresa = await db.empresas.find_one({"_id": ObjectId(empresa_id)})
-    except:
-        raise HTTPException(status_code=400, detail="ID inválido")
-    
-    if not empresa or str(empresa.get("usuario_id")) != str(current_user["_id"]):
-        raise HTTPException(status_code=403, detail="Acesso negado")
-    
-    # Define o intervalo do mês atual
+    # Valor do mês atual, lido do resumo mensal
     hoje = datetime.utcnow()
-    primeiro_dia_mes = hoje.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-    proximo_mes = primeiro_dia_mes + relativedelta(months=1)
-    
-    # Agregação para somar valores do mês
-    pipeline = [
-        {
-            "$match": {
-                "empresa_id": empresa_id,
-                "data_emissao": {
-                    "$gte": primeiro_dia_mes.isoformat(),
-                    "$lt": proximo_mes.isoformat()
-                }
-            }
-        },
-        {
-            "$group": {
-                "_id": None,
-                "valor_total_mes": {"$sum": "$valor_total"}
-            }
-        }
-    ]
-    
-    resultado = await db.notas_fiscais.aggregate(pipeline).to_list(1)
-    valor_total_mes = resultado[0]["valor_total_mes"] if resultado else 0.0
+    resumo = await resumo_mensal.somar_meses(db, empresa_id, [resumo_mensal.mes_referencia(hoje)])
+    valor_total_mes = resumo["valor_total"]
     
     # Cálculo do imposto estimado (6% - Anexo III)
     imposto_estimado_mes = valor_total_mes * 0.06
@@ -577,27 +1265,17 @@ async def excluir_nota(nota_id: str, current_user: dict = Depends(get_current_us
     """
     from bson import ObjectId
     
-    # Busca a nota
-    try:
-        nota = await db.notas_fiscais.find_one({"_id": ObjectId(nota_id)})
-    except:
-        raise HTTPException(status_code=400, detail="ID de nota inválido")
-    
-    if not nota:
-        raise HTTPException(status_code=404, detail="Nota não encontrada")
-    
-    # Verifica se a empresa da nota pertence ao usuário
-    empresa_id = nota.get("empresa_id")
-    try:
-        empresa = await db.empresas.find_one({"_id": ObjectId(empresa_id)})
-    except:
-        pass
-    
-    if not empresa or str(empresa.get("usuario_id")) != str(current_user["_id"]):
-        raise HTTPException(status_code=403, detail="Acesso negado")
+    # Busca a nota (sem o XML) e verifica se a empresa dela pertence ao usuário
+    nota, empresa = await obter_nota_autorizada(
+        nota_id, current_user,
+        projecao={"data_emissao": 1, "valor_centavos": 1, "valor_total": 1, "status_auditoria": 1}
+    )
     
-    # Exclui a nota
-    await db.notas_fiscais.delete_one({"_id": ObjectId(nota_id)})
+    # Exclui a nota (o resumo mensal só é ajustado se esta chamada realmente removeu)
+    result = await db.notas_fiscais.delete_one({"_id": ObjectId(nota_id)})
+    if result.deleted_count:
+        await resumo_mensal.registrar_notas(db, [nota], sinal=-1)
+        pdf_notas.invalidar_nota(nota_id)
     
     return {
         "mensagem": "Nota excluída com sucesso",
@@ -608,26 +1286,18 @@ async def excluir_nota(nota_id: str, current_user: dict = Depends(get_current_us
 async def atualizar_empresa(
     empresa_id: str,
     dados: dict,
-    current_user: dict = Depends(get_current_user)
+    background_tasks: BackgroundTasks,
+    empresa: dict = Depends(empresa_autorizada)
 ):
     """
     Atualiza dados de uma empresa. Permite editar razão social, nome fantasia,
     regime tributário e CNAEs permitidos.
+    
+    Se os CNAEs permitidos mudarem, as notas da empresa são reauditadas em
+    segundo plano (resultado em `ultima_reauditoria` da empresa).
     """
     from bson import ObjectId
     
-    # Verifica se a empresa existe e pertence ao usuário
-    try:
-        empresa = await db.empresas.find_one({"_id": ObjectId(empresa_id)})
-    except:
-        raise HTTPException(status_code=400, detail="ID de empresa inválido")
-    
-    if not empresa:
-        raise HTTPException(status_code=404, detail="Empresa não encontrada")
-    
-    if str(empresa.get("usuario_id")) != str(current_user["_id"]):
-        raise HTTPException(status_code=403, detail="Acesso negado")
-    
     # Campos que podem ser atualizados
     campos_permitidos = [
         "razao_social",
@@ -646,11 +1316,22 @@ async def atualizar_empresa(
     if not update_data:
         raise HTTPException(status_code=400, detail="Nenhum campo válido para atualizar")
     
+    reauditar = (
+        "cnaes_permitidos" in update_data
+        and update_data["cnaes_permitidos"] != empresa.get("cnaes_permitidos")
+    )
+    if reauditar:
+        update_data["ultima_reauditoria"] = {"status": "EM_ANDAMENTO", "data_inicio": datetime.utcnow().isoformat()}
+    
     # Atualiza no banco
     await db.empresas.update_one(
         {"_id": ObjectId(empresa_id)},
         {"$set": update_data}
     )
+    invalidar_empresa_cache(empresa_id)
+    
+    if reauditar:
+        background_tasks.add_task(executar_reauditoria, empresa_id)
     
     # Retorna empresa atualizada
     empresa_atualizada = await db.empresas.find_one({"_id": ObjectId(empresa_id)})
@@ -661,33 +1342,60 @@ async def atualizar_empresa(
         "empresa": empresa_atualizada
     }
 
-@app.delete("/api/empresas/{empresa_id}")
-async def excluir_empresa(empresa_id: str, current_user: dict = Depends(get_current_user)):
+async def executar_reauditoria(empresa_id: str):
     """
-    Exclui uma empresa e todas as suas notas fiscais associadas.
+    Reaudita as notas da empresa com os CNAEs atuais e grava o resultado em
+    `ultima_reauditoria` da empresa. Não levanta exceções (roda em segundo plano).
     """
     from bson import ObjectId
+    import time
     
-    # Verifica se a empresa existe e pertence ao usuário
+    inicio = time.perf_counter()
+    data_inicio = datetime.utcnow().isoformat()
     try:
         empresa = await db.empresas.find_one({"_id": ObjectId(empresa_id)})
-    except:
-        raise HTTPException(status_code=400, detail="ID de empresa inválido")
-    
-    if not empresa:
-        raise HTTPException(status_code=404, detail="Empresa não encontrada")
-    
-    if str(empresa.get("usuario_id")) != str(current_user["_id"]):
-        raise HTTPException(status_code=403, detail="Acesso negado")
+        if not empresa:
+            return None
+        resultado = await reauditar_servicos(db, empresa)
+        relatorio = {"status": "CONCLUIDA", **resultado}
+    except Exception as e:
+        logger.error(f"Falha na reauditoria da empresa {empresa_id}: {str(e)}")
+        relatorio = {"status": "FALHOU", "erro": str(e)}
+    
+    relatorio.update({
+        "data_inicio": data_inicio,
+        "data_conclusao": datetime.utcnow().isoformat(),
+        "duracao_segundos": round(time.perf_counter() - inicio, 3)
+    })
+    await db.empresas.update_one({"_id": ObjectId(empresa_id)}, {"$set": {"ultima_reauditoria": relatorio}})
+    invalidar_empresa_cache(empresa_id)
+    logger.info(f"Reauditoria da empresa {empresa_id}: {relatorio}")
+    return relatorio
+
+@app.post("/api/empresas/{empresa_id}/reauditar")
+async def reauditar_empresa(empresa_id: str, empresa: dict = Depends(empresa_autorizada)):
+    """
+    Reaudita as notas da empresa com os CNAEs atuais e devolve quantas mudaram de status.
+    """
+    return await executar_reauditoria(empresa_id)
+
+@app.delete("/api/empresas/{empresa_id}")
+async def excluir_empresa(empresa_id: str, empresa: dict = Depends(empresa_autorizada)):
+    """
+    Exclui uma empresa e todas as suas notas fiscais associadas.
+    """
+    from bson import ObjectId
     
     # Conta quantas notas serão excluídas
     total_notas = await db.notas_fiscais.count_documents({"empresa_id": empresa_id})
     
-    # Exclui todas as notas da empresa
+    # Exclui todas as notas da empresa e o resumo mensal
     await db.notas_fiscais.delete_many({"empresa_id": empresa_id})
+    await resumo_mensal.remover_empresa(db, empresa_id)
     
     # Exclui a empresa
     await db.empresas.delete_one({"_id": ObjectId(empresa_id)})
+    invalidar_empresa_cache(empresa_id)
     
     return {
         "mensagem": "Empresa e suas notas excluídas com sucesso",
@@ -700,358 +1408,263 @@ async def excluir_empresa(empresa_id: str, current_user: dict = Depends(get_curr
 async def gerar_pdf_nota(nota_id: str, current_user: dict = Depends(get_current_user)):
     """
     Gera um PDF formatado da nota fiscal para visualização.
+    O desenho roda no pool de PDFs e o resultado fica em cache (utils.pdf_notas).
     """
-    from bson import ObjectId
-    from reportlab.lib.pagesizes import A4
-    from reportlab.lib import colors
-    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-    from reportlab.lib.units import mm
-    from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
-    from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
-    from io import BytesIO
-    from fastapi.responses import StreamingResponse
-    
-    # Busca a nota
-    try:
-        nota = await db.notas_fiscais.find_one({"_id": ObjectId(nota_id)})
-    except:
-        raise HTTPException(status_code=400, detail="ID de nota inválido")
-    
-    if not nota:
-        raise HTTPException(status_code=404, detail="Nota não encontrada")
-    
-    # Verifica se a empresa da nota pertence ao usuário
-    empresa_id = nota.get("empresa_id")
-    try:
-        empresa = await db.empresas.find_one({"_id": ObjectId(empresa_id)})
-    except:
-        pass
-    
-    if not empresa or str(empresa.get("usuario_id")) != str(current_user["_id"]):
-        raise HTTPException(status_code=403, detail="Acesso negado")
-    
-    # Cria o PDF em memória
-    buffer = BytesIO()
-    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=15*mm, bottomMargin=15*mm)
-    elements = []
-    
-    # Estilos
-    styles = getSampleStyleSheet()
-    title_style = ParagraphStyle(
-        'CustomTitle',
-        parent=styles['Heading1'],
-        fontSize=18,
-        textColor=colors.HexColor('#1e40af'),
-        spaceAfter=20,
-        alignment=TA_CENTER
-    )
+    from fastapi.responses import Response
     
-    header_style = ParagraphStyle(
-        'CustomHeader',
-        parent=styles['Heading2'],
-        fontSize=14,
-        textColor=colors.HexColor('#1f2937'),
-        spaceAfter=10
-    )
-    
-    # Título
-    elements.append(Paragraph("NOTA FISCAL DE SERVIÇOS ELETRÔNICA", title_style))
-    elements.append(Spacer(1, 10*mm))
+    # Busca só os campos do PDF e verifica se a empresa da nota pertence ao usuário
+    nota, empresa = await obter_nota_autorizada(nota_id, current_user, projecao=pdf_notas.PROJECAO_NOTA_PDF)
     
-    # Informações da Empresa Prestadora
-    elements.append(Paragraph("DADOS DA EMPRESA PRESTADORA", header_style))
+    pdf = await pdf_notas.renderizar_pdf(nota, empresa)
     
-    empresa_data = [
-        ['Razão Social:', empresa.get('razao_social', 'N/A')],
-        ['CNPJ:', empresa.get('cnpj', 'N/A')],
-        ['Regime Tributário:', empresa.get('regime_tributario', 'N/A')]
-    ]
-    
-    empresa_table = Table(empresa_data, colWidths=[40*mm, 130*mm])
-    empresa_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f3f4f6')),
-        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-        ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('LEFTPADDING', (0, 0), (-1, -1), 5),
-        ('RIGHTPADDING', (0, 0), (-1, -1), 5),
-        ('TOPPADDING', (0, 0), (-1, -1), 5),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
-    ]))
-    elements.append(empresa_table)
-    elements.append(Spacer(1, 8*mm))
-    
-    # Dados da Nota Fiscal
-    elements.append(Paragraph("DADOS DA NOTA FISCAL", header_style))
-    
-    # Formata data
-    data_emissao = nota.get('data_emissao', '')
-    try:
-        data_obj = datetime.fromisoformat(data_emissao.replace('Z', '+00:00'))
-        data_formatada = data_obj.strftime('%d/%m/%Y às %H:%M')
-    except:
-        data_formatada = data_emissao
-    
-    # Status com cor
-    status = nota.get('status_auditoria', 'N/A')
-    status_color = colors.green if status == 'APROVADA' else colors.red
-    
-    nota_data = [
-        ['Número da Nota:', str(nota.get('numero_nota', 'N/A'))],
-        ['Data de Emissão:', data_formatada],
-        ['Chave de Validação:', nota.get('chave_validacao', 'N/A')],
-        ['Código de Serviço:', nota.get('codigo_servico_utilizado', 'N/A')],
-        ['CNPJ Tomador:', nota.get('cnpj_tomador', 'N/A')],
-        ['Valor Total:', f"R$ {nota.get('valor_total', 0):.2f}"]
-    ]
-    
-    nota_table = Table(nota_data, colWidths=[40*mm, 130*mm])
-    nota_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f3f4f6')),
-        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-        ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('LEFTPADDING', (0, 0), (-1, -1), 5),
-        ('RIGHTPADDING', (0, 0), (-1, -1), 5),
-        ('TOPPADDING', (0, 0), (-1, -1), 5),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
-    ]))
-    elements.append(nota_table)
-    elements.append(Spacer(1, 8*mm))
-    
-    # Status da Auditoria
-    elements.append(Paragraph("RESULTADO DA AUDITORIA", header_style))
-    
-    auditoria_data = [
-        ['Status:', status],
-        ['Resultado:', nota.get('mensagem_erro', 'Nota fiscal em conformidade')]
-    ]
-    
-    auditoria_table = Table(auditoria_data, colWidths=[40*mm, 130*mm])
-    auditoria_table.setStyle(TableStyle([
-        ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f3f4f6')),
-        ('BACKGROUND', (1, 0), (1, 0), colors.HexColor('#dcfce7') if status == 'APROVADA' else colors.HexColor('#fee2e2')),
-        ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
-        ('TEXTCOLOR', (1, 0), (1, 0), status_color),
-        ('ALIGN', (0, 0), (0, -1), 'LEFT'),
-        ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
-        ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
-        ('FONTNAME', (1, 0), (1, 0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0, 0), (-1, -1), 10),
-        ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
-        ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ('LEFTPADDING', (0, 0), (-1, -1), 5),
-        ('RIGHTPADDING', (0, 0), (-1, -1), 5),
-        ('TOPPADDING', (0, 0), (-1, -1), 5),
-        ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
-    ]))
-    elements.append(auditoria_table)
-    elements.append(Spacer(1, 8*mm))
-    
-    # Rodapé
-    footer_style = ParagraphStyle(
-        'Footer',
-        parent=styles['Normal'],
-        fontSize=8,
-        textColor=colors.grey,
-        alignment=TA_CENTER
-    )
-    
-    data_importacao = nota.get('data_importacao', '')
-    try:
-        data_import_obj = datetime.fromisoformat(data_importacao.replace('Z', '+00:00'))
-        data_import_formatada = data_import_obj.strftime('%d/%m/%Y às %H:%M')
-    except:
-        data_import_formatada = data_importacao
-    
-    elements.append(Spacer(1, 15*mm))
-    elements.append(Paragraph(f"Documento gerado em {datetime.utcnow().strftime('%d/%m/%Y às %H:%M')}", footer_style))
-    elements.append(Paragraph(f"Importado em: {data_import_formatada}", footer_style))
-    elements.append(Paragraph("Fiscal Fácil - Sistema de Auditoria Fiscal", footer_style))
-    
-    # Gera o PDF
-    doc.build(elements)
-    buffer.seek(0)
-    
-    # Retorna como streaming response
     filename = f"nota_{nota.get('numero_nota', 'fiscal')}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.pdf"
     
-    return StreamingResponse(
-        buffer,
+    return Response(
+        content=pdf,
         media_type="application/pdf",
         headers={"Content-Disposition": f"inline; filename={filename}"}
     )
 
-@app.get("/api/relatorios/inconsistencias/{empresa_id}")
-async def gerar_relatorio_inconsistencias(empresa_id: str, current_user: dict = Depends(get_current_user)):
+@app.get("/api/relatorios/pdfs/{empresa_id}")
+async def exportar_pdfs_mes(empresa_id: str, mes: str, empresa: dict = Depends(empresa_autorizada)):
     """
-    Gera um relatório Excel com todas as notas que possuem inconsistências/erros.
+    ZIP com o PDF de cada nota emitida no mês (YYYY-MM).
+    Os PDFs são desenhados no pool de PDFs, com no máximo PDF_ZIP_CONCORRENCIA
+    em andamento por exportação, e cada um é enviado assim que fica pronto.
     """
-    from bson import ObjectId
-    from openpyxl import Workbook
-    from openpyxl.styles import Font, PatternFill, Alignment
-    from io import BytesIO
+    from dateutil.relativedelta import relativedelta
     from fastapi.responses import StreamingResponse
-    
-    # Verifica se a empresa pertence ao usuário
+
     try:
-        empresa = await db.empresas.find_one({"_id": ObjectId(empresa_id)})
-    except:
-        raise HTTPException(status_code=400, detail="ID de empresa inválido")
+        inicio = datetime.strptime(mes, '%Y-%m')
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Mês inválido. Use o formato YYYY-MM")
+
+    filtro = {"$and": [
+        {"empresa_id": empresa_id},
+        campos_nota.filtro_periodo(inicio, inicio + relativedelta(months=1))
+    ]}
+
+    # Verificado antes de começar a resposta: depois do primeiro byte não dá para devolver 404
+    if not await db.notas_fiscais.find_one(filtro, {"_id": 1}):
+        raise HTTPException(status_code=404, detail="Nenhuma nota encontrada no mês")
+
+    notas = db.notas_fiscais.find(filtro, pdf_notas.PROJECAO_NOTA_PDF).sort([("data_emissao", 1), ("_id", 1)])
+
+    filename = f"notas_{empresa.get('cnpj', 'empresa')}_{mes}.zip"
+
+    return StreamingResponse(
+        pdf_notas.gerar_zip_pdfs(notas, empresa),
+        media_type="application/zip",
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+def resposta_relatorio_xlsx(caminho: str, filename: str):
+    """
+    Envia o .xlsx gerado em disco, em pedaços, e remove o arquivo ao final.
+    """
+    from fastapi.responses import FileResponse
+    from starlette.background import BackgroundTask
+    
+    return FileResponse(
+        caminho,
+        media_type=relatorios_notas.MEDIA_TYPE_XLSX,
+        filename=filename,
+        background=BackgroundTask(relatorios_notas.remover_arquivo, caminho)
+    )
+
+def resposta_relatorio_csv(conteudo, filename: str):
+    from fastapi.responses import StreamingResponse
     
-    if not empresa:
-        raise HTTPException(status_code=404, detail="Empresa não encontrada")
+    return StreamingResponse(
+        conteudo,
+        media_type=relatorios_notas.MEDIA_TYPE_CSV,
+        headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+def validar_formato_relatorio(formato: str):
+    if formato not in ("xlsx", "csv"):
+        raise HTTPException(status_code=400, detail="Formato deve ser 'xlsx' ou 'csv'")
+
+def filtro_relatorio_notas(empresa_id: str, data_inicio: Optional[str], data_fim: Optional[str], status: Optional[str]):
+    """
+    Filtro das notas de uma empresa no período [data_inicio, data_fim] (YYYY-MM-DD, opcionais).
+    """
+    from dateutil.relativedelta import relativedelta
     
-    if str(empresa.get("usuario_id")) != str(current_user["_id"]):
-        raise HTTPException(status_code=403, detail="Acesso negado")
+    filtro = {"empresa_id": empresa_id}
+    if status:
+        filtro["status_auditoria"] = status
+    try:
+        inicio = datetime.strptime(data_inicio, '%Y-%m-%d') if data_inicio else None
+        fim = datetime.strptime(data_fim, '%Y-%m-%d') + relativedelta(days=1) if data_fim else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Datas devem estar no formato YYYY-MM-DD")
+    if inicio or fim:
+        return {"$and": [filtro, campos_nota.filtro_periodo(inicio, fim)]}
+    return filtro
+
+def cursor_relatorio(filtro: dict, direcao: int = 1):
+    return db.notas_fiscais.find(filtro, relatorios_notas.PROJECAO_RELATORIO).sort(
+        [("data_emissao", direcao), ("_id", direcao)]
+    )
+
+@app.get("/api/relatorios/inconsistencias/{empresa_id}")
+async def gerar_relatorio_inconsistencias(
+    empresa_id: str,
+    formato: str = "xlsx",
+    empresa: dict = Depends(empresa_autorizada)
+):
+    """
+    Gera um relatório Excel (ou CSV) com todas as notas que possuem inconsistências/erros.
+    As notas são lidas do cursor em lotes e escritas no pool de relatórios (utils.relatorios_notas).
+    """
+    validar_formato_relatorio(formato)
     
     # Busca apenas notas com erros
-    notas_com_erro = []
-    async for nota in db.notas_fiscais.find({
+    filtro = {
         "empresa_id": empresa_id,
         "status_auditoria": {"$ne": "APROVADA"}
-    }).sort("data_emissao", -1):
-        notas_com_erro.append(nota)
+    }
+    total = await db.notas_fiscais.count_documents(filtro)
     
-    if not notas_com_erro:
+    if not total:
         raise HTTPException(
             status_code=404, 
             detail="Nenhuma inconsistência encontrada. Todas as notas estão aprovadas!"
         )
     
-    # Cria o Excel
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "Inconsistências"
-    
-    # Cabeçalho do relatório
-    ws.merge_cells('A1:F1')
-    ws['A1'] = f"Relatório de Inconsistências - {empresa.get('razao_social', '')}"
-    ws['A1'].font = Font(size=14, bold=True)
-    ws['A1'].alignment = Alignment(horizontal='center')
-    
-    ws['A2'] = f"CNPJ: {empresa.get('cnpj', '')}"
-    ws['A3'] = f"Data do Relatório: {datetime.utcnow().strftime('%d/%m/%Y %H:%M')}"
-    ws['A4'] = f"Total de Inconsistências: {len(notas_com_erro)}"
-    
-    # Cabeçalhos da tabela
-    headers = ['Número da Nota', 'Data de Emissão', 'Código de Serviço', 'Valor (R$)', 'Status', 'Erro Encontrado']
-    header_row = 6
-    
-    for col, header in enumerate(headers, 1):
-        cell = ws.cell(row=header_row, column=col)
-        cell.value = header
-        cell.font = Font(bold=True, color="FFFFFF")
-        cell.fill = PatternFill(start_color="FF0000", end_color="FF0000", fill_type="solid")
-        cell.alignment = Alignment(horizontal='center')
-    
-    # Dados
-    for row_idx, nota in enumerate(notas_com_erro, header_row + 1):
-        ws.cell(row=row_idx, column=1, value=nota.get('numero_nota'))
-        
-        # Data de emissão formatada
-        data_str = nota.get('data_emissao', '')
-        if data_str:
-            try:
-                data_obj = datetime.fromisoformat(data_str.replace('Z', '+00:00'))
-                ws.cell(row=row_idx, column=2, value=data_obj.strftime('%d/%m/%Y'))
-            except:
-                ws.cell(row=row_idx, column=2, value=data_str)
-        
-        ws.cell(row=row_idx, column=3, value=nota.get('codigo_servico_utilizado'))
-        ws.cell(row=row_idx, column=4, value=nota.get('valor_total'))
-        ws.cell(row=row_idx, column=5, value=nota.get('status_auditoria'))
-        ws.cell(row=row_idx, column=6, value=nota.get('mensagem_erro'))
-        
-        # Destaca linha com erro
-        for col in range(1, 7):
-            cell = ws.cell(row=row_idx, column=col)
-            cell.fill = PatternFill(start_color="FFE6E6", end_color="FFE6E6", fill_type="solid")
-    
-    # Ajusta largura das colunas
-    ws.column_dimensions['A'].width = 15
-    ws.column_dimensions['B'].width = 15
-    ws.column_dimensions['C'].width = 18
-    ws.column_dimensions['D'].width = 12
-    ws.column_dimensions['E'].width = 15
-    ws.column_dimensions['F'].width = 50
-    
-    # Salva em memória
-    output = BytesIO()
-    wb.save(output)
-    output.seek(0)
-    
-    # Retorna como download
-    filename = f"inconsistencias_{empresa.get('cnpj', 'empresa')}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.xlsx"
+    filename = f"inconsistencias_{empresa.get('cnpj', 'empresa')}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.{formato}"
     
-    return StreamingResponse(
-        output,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers={"Content-Disposition": f"attachment; filename={filename}"}
-    )
+    if formato == "csv":
+        conteudo = relatorios_notas.gerar_csv(
+            [{"cursor": cursor_relatorio(filtro, -1)}],
+            relatorios_notas.COLUNAS_INCONSISTENCIAS
+        )
+        return resposta_relatorio_csv(conteudo, filename)
+    
+    caminho = await relatorios_notas.gerar_xlsx([{
+        "titulo": "Inconsistências",
+        "topo": [
+            f"Relatório de Inconsistências - {empresa.get('razao_social', '')}",
+            f"CNPJ: {empresa.get('cnpj', '')}",
+            f"Data do Relatório: {datetime.utcnow().strftime('%d/%m/%Y %H:%M')}",
+            f"Total de Inconsistências: {total}",
+        ],
+        "colunas": relatorios_notas.COLUNAS_INCONSISTENCIAS,
+        "cursor": cursor_relatorio(filtro, -1),
+        "destacar_erros": True,
+    }])
+    return resposta_relatorio_xlsx(caminho, filename)
 
-# ==================== DASHBOARD - MONITOR RBT12 ====================
-@app.get("/api/dashboard/metrics/{empresa_id}")
-async def obter_metricas_rbt12(empresa_id: str, current_user: dict = Depends(get_current_user)):
+@app.get("/api/relatorios/notas/{empresa_id}")
+async def exportar_notas(
+    empresa_id: str,
+    data_inicio: Optional[str] = None,
+    data_fim: Optional[str] = None,
+    status: Optional[str] = None,
+    formato: str = "xlsx",
+    empresa: dict = Depends(empresa_autorizada)
+):
+    """
+    Exporta todas as notas da empresa no período (data_inicio/data_fim no
+    formato YYYY-MM-DD, opcionais) em Excel ou CSV.
+    """
+    validar_formato_relatorio(formato)
+    filtro = filtro_relatorio_notas(empresa_id, data_inicio, data_fim, status)
+    
+    filename = f"notas_{empresa.get('cnpj', 'empresa')}_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.{formato}"
+    
+    if formato == "csv":
+        conteudo = relatorios_notas.gerar_csv([{"cursor": cursor_relatorio(filtro)}], relatorios_notas.COLUNAS_NOTAS)
+        return resposta_relatorio_csv(conteudo, filename)
+    
+    caminho = await relatorios_notas.gerar_xlsx([{
+        "titulo": "Notas",
+        "topo": [
+            f"Notas Fiscais - {empresa.get('razao_social', '')}",
+            f"CNPJ: {empresa.get('cnpj', '')}",
+            f"Período: {data_inicio or 'início'} a {data_fim or 'hoje'}",
+        ],
+        "colunas": relatorios_notas.COLUNAS_NOTAS,
+        "cursor": cursor_relatorio(filtro),
+        "destacar_erros": False,
+    }])
+    return resposta_relatorio_xlsx(caminho, filename)
+
+@app.get("/api/relatorios/notas")
+async def exportar_notas_empresas(
+    empresa_ids: Optional[str] = None,
+    data_inicio: Optional[str] = None,
+    data_fim: Optional[str] = None,
+    status: Optional[str] = None,
+    formato: str = "xlsx",
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Exporta as notas de várias empresas do usuário (`empresa_ids` separados
+    por vírgula; sem ele, todas) num único arquivo: no Excel, uma aba por
+    empresa; no CSV, com as colunas de CNPJ e razão social da empresa.
+    """
     from bson import ObjectId
-    from dateutil.relativedelta import relativedelta
     
-    # Verifica se a empresa pertence ao usuário
-    try:
-        empresa = await db.empresas.find_one({"_id": ObjectId(empresa_id)})
-    except:
-        raise HTTPException(status_code=400, detail="ID de empresa inválido")
+    validar_formato_relatorio(formato)
     
-    if not empresa:
+    filtro_empresas = {"usuario_id": str(current_user["_id"])}
+    if empresa_ids:
+        ids = [empresa_id.strip() for empresa_id in empresa_ids.split(",") if empresa_id.strip()]
+        try:
+            filtro_empresas["_id"] = {"$in": [ObjectId(empresa_id) for empresa_id in ids]}
+        except Exception:
+            raise HTTPException(status_code=400, detail="ID de empresa inválido")
+    
+    empresas = await db.empresas.find(filtro_empresas, {"razao_social": 1, "cnpj": 1}).sort("razao_social", 1).to_list(None)
+    if not empresas:
+        raise HTTPException(status_code=404, detail="Nenhuma empresa encontrada")
+    if empresa_ids and len(empresas) != len(set(ids)):
         raise HTTPException(status_code=404, detail="Empresa não encontrada")
     
-    if str(empresa.get("usuario_id")) != str(current_user["_id"]):
-        raise HTTPException(status_code=403, detail="Acesso negado")
+    # Valida o período uma vez antes de começar a resposta
+    filtro_relatorio_notas("", data_inicio, data_fim, status)
     
-    # Calcula data de 12 meses atrás
-    hoje = datetime.utcnow()
-    doze_meses_atras = hoje - relativedelta(months=12)
+    filename = f"notas_empresas_{datetime.utcnow().strftime('%Y%m%d_%H%M%S')}.{formato}"
     
-    # Pipeline de agregação para somar faturamento dos últimos 12 meses
-    pipeline = [
-        {
-            "$match": {
-                "empresa_id": empresa_id,
-                "data_emissao": {
-                    "$gte": doze_meses_atras.isoformat(),
-                    "$lte": hoje.isoformat()
+    if formato == "csv":
+        conteudo = relatorios_notas.gerar_csv(
+            [
+                {
+                    "cursor": cursor_relatorio(filtro_relatorio_notas(str(empresa["_id"]), data_inicio, data_fim, status)),
+                    "prefixo": [empresa.get("cnpj", ""), empresa.get("razao_social", "")],
                 }
-            }
-        },
+                for empresa in empresas
+            ],
+            relatorios_notas.COLUNAS_NOTAS,
+            colunas_prefixo=["CNPJ Empresa", "Razão Social"]
+        )
+        return resposta_relatorio_csv(conteudo, filename)
+    
+    caminho = await relatorios_notas.gerar_xlsx([
         {
-            "$group": {
-                "_id": None,
-                "faturamento_12_meses": {"$sum": "$valor_total"}
-            }
+            "titulo": empresa.get("razao_social") or empresa.get("cnpj", ""),
+            "topo": [
+                f"Notas Fiscais - {empresa.get('razao_social', '')}",
+                f"CNPJ: {empresa.get('cnpj', '')}",
+                f"Período: {data_inicio or 'início'} a {data_fim or 'hoje'}",
+            ],
+            "colunas": relatorios_notas.COLUNAS_NOTAS,
+            "cursor": cursor_relatorio(filtro_relatorio_notas(str(empresa["_id"]), data_inicio, data_fim, status)),
         }
-    ]
-    
-    resultado = await db.notas_fiscais.aggregate(pipeline).to_list(1)
-    faturamento_atual = resultado[0]["faturamento_12_meses"] if resultado else 0.0
-    
-    # Obtem limite da empresa (padrão MEI: R$ 81.000,00)
-    limite_anual = 81000.00  # Padrão MEI
-    
-    # Se houver limite cadastrado, usa ele
-    if "limite_faturamento_anual" in empresa:
-        limite_anual = float(empresa["limite_faturamento_anual"])
-    elif empresa.get("regime_tributario") == "Simples Nacional":
-        limite_anual = 4800000.00  # Limite Simples Nacional
-    elif empresa.get("regime_tributario") == "Lucro Presumido":
-        limite_anual = 78000000.00  # Limite Lucro Presumido
+        for empresa in empresas
+    ])
+    return resposta_relatorio_xlsx(caminho, filename)
+
+# ==================== DASHBOARD - MONITOR RBT12 ====================
+def calcular_metricas_rbt12(empresa: dict, faturamento_atual: float):
+    """
+    Aplica as regras de limite e status do Monitor RBT12 ao faturamento dos
+    últimos 12 meses de uma empresa.
+    """
+    limite_anual = calcular_limite_anual(empresa)
     
     # Calcula percentual de uso
     percentual_uso = (faturamento_atual / limite_anual * 100) if limite_anual > 0 else 0
@@ -1077,6 +1690,76 @@ async def obter_metricas_rbt12(empresa_id: str, current_user: dict = Depends(get
         "razao_social": empresa.get("razao_social", "")
     }
 
+@app.get("/api/dashboard/metrics/{empresa_id}")
+async def obter_metricas_rbt12(empresa_id: str, empresa: dict = Depends(empresa_autorizada)):
+    # Faturamento dos últimos 12 meses (mês atual e os 11 anteriores), lido do resumo mensal
+    hoje = datetime.utcnow()
+    resumo = await resumo_mensal.somar_meses(db, empresa_id, resumo_mensal.meses_anteriores(hoje, 12))
+    faturamento_atual = resumo["valor_total"]
+    
+    return calcular_metricas_rbt12(empresa, faturamento_atual)
+
+@app.get("/api/dashboard/portfolio")
+async def obter_portfolio_rbt12(
+    limit: int = 50,
+    offset: int = 0,
+    current_user: dict = Depends(get_current_user)
+):
+    """
+    Monitor RBT12 de todas as empresas do usuário em uma única consulta ao
+    resumo mensal, ordenado por risco (maior percentual de uso primeiro).
+    """
+    if not 1 <= limit <= 500 or offset < 0:
+        raise HTTPException(status_code=400, detail="Paginação inválida (limit entre 1 e 500, offset >= 0)")
+    
+    usuario_id = str(current_user["_id"])
+    empresas = await db.empresas.find(
+        {"usuario_id": usuario_id},
+        {"razao_social": 1, "cnpj": 1, "regime_tributario": 1, "limite_faturamento_anual": 1}
+    ).to_list(None)
+    
+    hoje = datetime.utcnow()
+    faturamentos = await resumo_mensal.somar_meses_por_empresa(
+        db,
+        [str(empresa["_id"]) for empresa in empresas],
+        resumo_mensal.meses_anteriores(hoje, 12)
+    )
+    
+    itens = []
+    contagem_status = {"OK": 0, "ALERTA": 0, "ESTOUROU": 0}
+    for empresa in empresas:
+        empresa_id = str(empresa["_id"])
+        metricas = calcular_metricas_rbt12(empresa, faturamentos.get(empresa_id, 0.0))
+        contagem_status[metricas["status"]] += 1
+        itens.append({"empresa_id": empresa_id, "cnpj": empresa.get("cnpj"), **metricas})
+    
+    itens.sort(key=lambda item: item["percentual_uso"], reverse=True)
+    
+    return {
+        "total_empresas": len(itens),
+        "por_status": contagem_status,
+        "limit": limit,
+        "offset": offset,
+        "empresas": itens[offset:offset + limit]
+    }
+
+# ==================== CICLO DE VIDA ====================
+@app.on_event("startup")
+async def iniciar_recursos():
+    # Índices são criados em segundo plano para não atrasar a subida em coleções grandes
+    app.state.tarefa_indices = asyncio.create_task(preparar_indices(db))
+    # Retoma jobs pendentes ou interrompidos por um restart
+    fila_importacao.iniciar()
+
+@app.on_event("shutdown")
+async def encerrar_recursos():
+    await fila_importacao.encerrar()
+    encerrar_executor()
+    pdf_notas.encerrar_pool_pdf()
+    relatorios_notas.encerrar_pool_relatorios()
+    encerrar_executor_hash()
+    await encerrar_cliente_cnpj()
+
 # ==================== ROTA HOME ====================
 @app.get("/")
 async def home():
@@ -1089,6 +1772,14 @@ async def home():
 async def health_check():
     try:
         await db.command("ping")
-        return {"status": "healthy", "database": "connected"}
+        return {
+            "status": "healthy",
+            "database": "connected",
+            "cache_usuarios": cache_usuarios.estatisticas(),
+            "consulta_cnpj": cliente_cnpj.estado(),
+            "cache_cnpj": cache_cnpj.estatisticas(),
+            "cache_pdf": pdf_notas.cache_pdf.estatisticas(),
+            "indice_cnpj_offline": indice_cnpj.disponivel
+        }
     except Exception as e:
         raise HTTPException(status_code=503, detail=f"Database error: {str(e)}")
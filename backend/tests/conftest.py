@@ -0,0 +1,82 @@
+"""
+Fixtures compartilhadas pelos testes que usam o banco.
+
+O banco é o mongomock-motor (em memória), com um banco novo por teste. Os
+pools de parsing e de PDF usam threads, para os testes não criarem processos.
+"""
+import asyncio
+import os
+
+os.environ.setdefault("PARSER_EXECUTOR", "thread")
+os.environ.setdefault("PDF_EXECUTOR", "thread")
+
+import mongomock.aggregate
+import mongomock.collection
+import pytest
+from bson import ObjectId
+from mongomock_motor import AsyncMongoMockClient
+
+# O mongomock não implementa $substrBytes (usado em resumo_mensal.EXPRESSAO_MES);
+# para os textos ASCII dos testes ele equivale a $substr
+_operador_texto = mongomock.aggregate._Parser._handle_string_operator
+
+
+def _operador_texto_com_substr_bytes(self, operator, values):
+    if operator == "$substrBytes":
+        operator = "$substr"
+    return _operador_texto(self, operator, values)
+
+
+mongomock.aggregate._Parser._handle_string_operator = _operador_texto_com_substr_bytes
+
+
+# O create_indexes do mongomock descarta o partialFilterExpression (o create_index
+# respeita); sem ele o índice único de impressao_digital recusaria as notas antigas
+def _create_indexes_com_filtro_parcial(self, indexes, session=None):
+    return [
+        self.create_index(
+            indice.document["key"].items(),
+            session=session,
+            **{opcao: valor for opcao, valor in indice.document.items() if opcao != "key"}
+        )
+        for indice in indexes
+    ]
+
+
+mongomock.collection.Collection.create_indexes = _create_indexes_com_filtro_parcial
+
+
+@pytest.fixture
+def db():
+    return AsyncMongoMockClient()[f"fiscal_facil_{ObjectId()}"]
+
+
+@pytest.fixture
+def servidor(db, monkeypatch):
+    """
+    Módulo server usando o banco do teste, com os índices declarados.
+    """
+    import server
+    from utils.indices import garantir_indices
+
+    monkeypatch.setattr(server, "db", db)
+    server.cache_empresas.limpar()
+    asyncio.run(garantir_indices(db))
+    return server
+
+
+@pytest.fixture
+def empresa(db):
+    """
+    Empresa do Simples Nacional com o serviço 0802 permitido.
+    """
+    documento = {
+        "usuario_id": str(ObjectId()),
+        "cnpj": "11222333000181",
+        "razao_social": "EMPRESA TESTE LTDA",
+        "regime_tributario": "Simples Nacional",
+        "data_abertura": "2020-01-01",
+        "cnaes_permitidos": [{"cnae_codigo": "6201501", "codigo_servico_municipal": "0802"}],
+    }
+    asyncio.run(db.empresas.insert_one(documento))
+    return documento
@@ -0,0 +1,206 @@
+"""
+ClienteCNPJ contra um servidor HTTP local que imita a BrasilAPI e a ReceitaWS.
+
+Rodar a partir da pasta backend:
+
+    python -m pytest tests/test_brasil_api.py
+"""
+import asyncio
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from fastapi import HTTPException
+
+from utils.brasil_api import BaldeTokens, ClienteCNPJ, Provedor, normalizar_brasilapi, normalizar_receitaws
+
+CNPJ = "11222333000181"
+CNPJ_INEXISTENTE = "00000000000191"
+
+
+class Stub:
+    """
+    Comportamento de cada provedor do servidor local: atraso, status de erro
+    e quantas requisições recebeu.
+    """
+
+    def __init__(self):
+        self.atraso = {"brasil": 0.0, "ws": 0.0}
+        self.status = {"brasil": 200, "ws": 200}
+        self.requisicoes = {"brasil": 0, "ws": 0}
+
+    def resposta(self, provedor: str, cnpj: str):
+        self.requisicoes[provedor] += 1
+        time.sleep(self.atraso[provedor])
+        if self.status[provedor] != 200:
+            return self.status[provedor], {"message": "erro"}
+        if cnpj == CNPJ_INEXISTENTE:
+            return 404, {"message": "CNPJ não encontrado"}
+        if provedor == "brasil":
+            return 200, {"razao_social": "EMPRESA BRASILAPI", "cnae_fiscal": 6201501, "cnaes_secundarios": []}
+        return 200, {"nome": "EMPRESA RECEITAWS", "atividade_principal": [{"code": "62.01-5-01"}], "atividades_secundarias": []}
+
+
+@pytest.fixture
+def servidor():
+    stub = Stub()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            _, provedor, cnpj = self.path.split("/")
+            status, corpo = stub.resposta(provedor, cnpj)
+            dados = json.dumps(corpo).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(dados)))
+            self.end_headers()
+            self.wfile.write(dados)
+
+        def log_message(self, *args):
+            pass
+
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    stub.url = f"http://127.0.0.1:{httpd.server_address[1]}"
+    yield stub
+    httpd.shutdown()
+    httpd.server_close()
+
+
+def criar_cliente(stub, hedge_ms=1000, falhas=2, segundos_aberto=0.3, so_brasilapi=False):
+    provedores = [Provedor("BrasilAPI", f"{stub.url}/brasil", 2, normalizar_brasilapi)]
+    if not so_brasilapi:
+        provedores.append(Provedor("ReceitaWS", f"{stub.url}/ws", 2, normalizar_receitaws))
+    for provedor in provedores:
+        provedor.circuito.limite_falhas = falhas
+        provedor.circuito.segundos_aberto = segundos_aberto
+    return ClienteCNPJ(provedores, hedge_ms=hedge_ms)
+
+
+async def consultar(cliente, cnpj=CNPJ):
+    try:
+        return await cliente.consultar(cnpj)
+    finally:
+        await cliente.encerrar()
+
+
+def test_resposta_do_provedor_principal(servidor):
+    dados = asyncio.run(consultar(criar_cliente(servidor)))
+    assert dados["razao_social"] == "EMPRESA BRASILAPI"
+    assert dados["cnae_principal"] == "6201501"
+    assert servidor.requisicoes["ws"] == 0
+
+
+def test_hedge_aciona_reserva_quando_principal_demora(servidor):
+    servidor.atraso["brasil"] = 1.0
+
+    inicio = time.monotonic()
+    dados = asyncio.run(consultar(criar_cliente(servidor, hedge_ms=100)))
+
+    assert dados["razao_social"] == "EMPRESA RECEITAWS"
+    assert time.monotonic() - inicio < 0.8
+    assert servidor.requisicoes == {"brasil": 1, "ws": 1}
+
+
+def test_falha_rapida_do_principal_aciona_reserva_sem_esperar_hedge(servidor):
+    servidor.status["brasil"] = 500
+
+    inicio = time.monotonic()
+    dados = asyncio.run(consultar(criar_cliente(servidor, hedge_ms=2000)))
+
+    assert dados["razao_social"] == "EMPRESA RECEITAWS"
+    assert time.monotonic() - inicio < 1.5
+
+
+def test_404_e_cnpj_nao_encontrado_sem_contar_falha(servidor):
+    cliente = criar_cliente(servidor)
+
+    with pytest.raises(HTTPException) as erro:
+        asyncio.run(consultar(cliente, CNPJ_INEXISTENTE))
+
+    assert erro.value.status_code == 404
+    assert cliente.provedores[0].circuito.falhas == 0
+    assert servidor.requisicoes["ws"] == 0
+
+
+def test_circuito_abre_e_fecha_depois_do_teste_semiaberto(servidor):
+    servidor.status["brasil"] = 500
+    cliente = criar_cliente(servidor, falhas=2, segundos_aberto=0.3, so_brasilapi=True)
+    circuito = cliente.provedores[0].circuito
+
+    async def cenario():
+        for _ in range(2):
+            with pytest.raises(Exception):
+                await cliente.consultar(CNPJ)
+        assert circuito.estado == "ABERTO"
+
+        # Aberto: nem chega ao servidor
+        with pytest.raises(HTTPException) as erro:
+            await cliente.consultar(CNPJ)
+        assert erro.value.status_code == 503
+        assert servidor.requisicoes["brasil"] == 2
+
+        # Semiaberto com falha: uma única chamada de teste e o circuito abre de novo
+        await asyncio.sleep(0.35)
+        assert circuito.estado == "SEMIABERTO"
+        with pytest.raises(Exception):
+            await cliente.consultar(CNPJ)
+        assert servidor.requisicoes["brasil"] == 3
+        assert circuito.estado == "ABERTO"
+
+        # Semiaberto com sucesso: fecha
+        await asyncio.sleep(0.35)
+        servidor.status["brasil"] = 200
+        dados = await cliente.consultar(CNPJ)
+        assert dados["razao_social"] == "EMPRESA BRASILAPI"
+        assert circuito.estado == "FECHADO"
+        assert circuito.falhas == 0
+
+        await cliente.encerrar()
+
+    asyncio.run(cenario())
+
+
+def test_semiaberto_libera_uma_chamada_de_teste_por_vez(servidor):
+    servidor.status["brasil"] = 500
+    cliente = criar_cliente(servidor, falhas=1, segundos_aberto=0.2, so_brasilapi=True)
+
+    async def cenario():
+        with pytest.raises(Exception):
+            await cliente.consultar(CNPJ)
+        await asyncio.sleep(0.25)
+
+        servidor.status["brasil"] = 200
+        servidor.atraso["brasil"] = 0.2
+        resultados = await asyncio.gather(
+            cliente.consultar(CNPJ), cliente.consultar(CNPJ), return_exceptions=True
+        )
+        await cliente.encerrar()
+        return resultados
+
+    resultados = asyncio.run(cenario())
+
+    assert sum(isinstance(r, dict) for r in resultados) == 1
+    assert [r.status_code for r in resultados if isinstance(r, HTTPException)] == [503]
+    assert servidor.requisicoes["brasil"] == 2
+
+
+def test_balde_de_tokens_libera_rajada_e_depois_limita_a_taxa():
+    balde = BaldeTokens(taxa=20, capacidade=3)
+
+    async def cenario():
+        instantes = []
+        inicio = time.monotonic()
+        for _ in range(7):
+            await balde.adquirir()
+            instantes.append(time.monotonic() - inicio)
+        return instantes
+
+    instantes = asyncio.run(cenario())
+
+    # 3 de uma vez (rajada) e as outras 4 a 20 por segundo
+    assert instantes[2] < 0.05
+    assert instantes[-1] >= 4 / 20 - 0.02
+    assert instantes[-1] < 0.6
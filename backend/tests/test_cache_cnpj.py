@@ -0,0 +1,82 @@
+"""
+CacheCNPJ: camadas de memória e banco e consultas simultâneas (single-flight).
+
+Rodar a partir da pasta backend:
+
+    python -m pytest tests/test_cache_cnpj.py
+"""
+import asyncio
+from types import SimpleNamespace
+
+from utils.cache_cnpj import CacheCNPJ
+
+CNPJ = "11222333000181"
+
+
+class ColecaoCache:
+    """Coleção cache_cnpj em memória, só com o que o CacheCNPJ usa."""
+
+    def __init__(self):
+        self.docs = {}
+
+    async def find_one(self, filtro):
+        doc = self.docs.get(filtro["_id"])
+        if doc and doc["expira_em"] > filtro["expira_em"]["$gt"]:
+            return dict(doc)
+        return None
+
+    async def update_one(self, filtro, atualizacao, upsert=False):
+        self.docs.setdefault(filtro["_id"], {"_id": filtro["_id"]}).update(atualizacao["$set"])
+
+
+def criar_cache():
+    chamadas = []
+
+    async def upstream(cnpj):
+        chamadas.append(cnpj)
+        await asyncio.sleep(0.05)
+        return {"cnpj": cnpj, "razao_social": f"VERSAO {len(chamadas)}"}
+
+    return CacheCNPJ(SimpleNamespace(cache_cnpj=ColecaoCache()), upstream), chamadas
+
+
+def test_consultas_simultaneas_compartilham_a_ida_aos_provedores():
+    cache, chamadas = criar_cache()
+
+    async def cenario():
+        return await asyncio.gather(*[cache.consultar(CNPJ) for _ in range(5)])
+
+    resultados = asyncio.run(cenario())
+
+    assert chamadas == [CNPJ]
+    assert {r["razao_social"] for r in resultados} == {"VERSAO 1"}
+
+
+def test_segunda_consulta_vem_da_memoria():
+    cache, chamadas = criar_cache()
+
+    async def cenario():
+        await cache.consultar(CNPJ)
+        return await cache.consultar("11.222.333/0001-81")
+
+    assert asyncio.run(cenario())["razao_social"] == "VERSAO 1"
+    assert len(chamadas) == 1
+
+
+def test_atualizar_durante_consulta_comum_vai_aos_provedores():
+    cache, chamadas = criar_cache()
+
+    async def cenario():
+        await cache.consultar(CNPJ)
+        cache.memoria.invalidar(CNPJ)
+        # A consulta comum lê do banco; a forçada não pode pegar carona nela
+        comum = asyncio.ensure_future(cache.consultar(CNPJ))
+        await asyncio.sleep(0)
+        forcada = await cache.consultar(CNPJ, atualizar=True)
+        return await comum, forcada
+
+    comum, forcada = asyncio.run(cenario())
+
+    assert comum["razao_social"] == "VERSAO 1"
+    assert forcada["razao_social"] == "VERSAO 2"
+    assert len(chamadas) == 2
@@ -0,0 +1,182 @@
+"""
+Gravação em lote das notas importadas (server.gravar_notas_em_lote).
+
+Rodar a partir da pasta backend:
+
+    python -m pytest tests/test_importacao.py
+"""
+import asyncio
+
+import pytest
+from pymongo.errors import BulkWriteError
+
+
+def xml_nota(numero: int, codigo: str = "0802", valor: str = "100.50", chave: str = None):
+    chave = f"<ChaveValidacao>{chave}</ChaveValidacao>" if chave else ""
+    return (
+        '<?xml version="1.0" encoding="utf-8"?><tbnfd><nfdok><NewDataSet><NOTA_FISCAL>'
+        f"<NumeroNota>{numero}</NumeroNota><DataEmissao>2026-09-10T10:00:00</DataEmissao>"
+        f"<Cae>{codigo}</Cae><ValorTotalNota>{valor}</ValorTotalNota>{chave}"
+        "<ClienteCNPJCPF>11222333000181</ClienteCNPJCPF></NOTA_FISCAL></NewDataSet></nfdok></tbnfd>"
+    ).encode()
+
+
+def importar(servidor, empresa, arquivos, job_id=None):
+    """
+    Prepara e grava (nome, conteúdo) como a importação em lote; um resultado por nota.
+    """
+    async def executar():
+        preparados = []
+        for nome, conteudo in arquivos:
+            preparados += await servidor.preparar_notas(str(empresa["_id"]), conteudo, nome)
+        return await servidor.gravar_notas_em_lote(empresa, preparados, job_id)
+
+    return asyncio.run(executar())
+
+
+@pytest.fixture
+def insert_many_com_erros(db, monkeypatch):
+    """
+    Faz o insert_many de notas_fiscais falhar nas posições pedidas, como um
+    BulkWriteError não ordenado: as demais posições são gravadas.
+    """
+    classe = type(db.notas_fiscais)
+    original = classe.insert_many
+    erros = {}
+
+    async def insert_many(self, documentos, ordered=True, **kwargs):
+        if self.name != "notas_fiscais" or not erros:
+            return await original(self, documentos, ordered=ordered, **kwargs)
+        gravar = [doc for i, doc in enumerate(documentos) if i not in erros]
+        if gravar:
+            await original(self, gravar, ordered=ordered, **kwargs)
+        raise BulkWriteError({
+            "writeErrors": [{"index": i, **erro} for i, erro in sorted(erros.items())],
+            "nInserted": len(gravar),
+        })
+
+    monkeypatch.setattr(classe, "insert_many", insert_many)
+    return erros
+
+
+def test_lote_grava_todas_as_notas(servidor, empresa, db):
+    resultados = importar(servidor, empresa, [(f"{n}.xml", xml_nota(n)) for n in range(1, 4)])
+
+    assert [r["sucesso"] for r in resultados] == [True, True, True]
+    assert [r["nota"]["numero_nota"] for r in resultados] == [1, 2, 3]
+    assert asyncio.run(db.notas_fiscais.count_documents({})) == 3
+
+
+def test_erro_de_escrita_volta_para_o_arquivo_de_origem(servidor, empresa, db, insert_many_com_erros):
+    insert_many_com_erros[1] = {"code": 121, "errmsg": "Document failed validation"}
+
+    resultados = importar(servidor, empresa, [(f"{n}.xml", xml_nota(n)) for n in range(1, 4)])
+
+    assert [r["sucesso"] for r in resultados] == [True, False, True]
+    assert resultados[1]["nome_arquivo"] == "2.xml"
+    assert resultados[1]["erro"] == "Erro ao gravar: Document failed validation"
+    assert not resultados[1].get("duplicada")
+    numeros = sorted(n["numero_nota"] for n in asyncio.run(db.notas_fiscais.find({}).to_list(None)))
+    assert numeros == [1, 3]
+    # Só as gravadas entram no resumo mensal
+    resumo = asyncio.run(db.resumo_mensal.find_one({"empresa_id": str(empresa["_id"])}))
+    assert resumo["quantidade"] == 2
+
+
+def test_chave_duplicada_no_insert_vira_duplicada(servidor, empresa, insert_many_com_erros):
+    # Outra importação gravou a nota entre a consulta das impressões e o insert
+    insert_many_com_erros[0] = {"code": 11000, "errmsg": "E11000 duplicate key error"}
+
+    resultados = importar(servidor, empresa, [("1.xml", xml_nota(1)), ("2.xml", xml_nota(2))])
+
+    assert resultados[0]["duplicada"] is True
+    assert resultados[0]["status"] == "DUPLICADA"
+    assert resultados[1]["sucesso"] is True
+
+
+def test_falha_geral_do_insert_marca_o_bloco_inteiro(servidor, empresa, db, monkeypatch):
+    async def insert_many(self, documentos, ordered=True, **kwargs):
+        raise ConnectionError("conexão perdida")
+
+    monkeypatch.setattr(type(db.notas_fiscais), "insert_many", insert_many)
+
+    resultados = importar(servidor, empresa, [("1.xml", xml_nota(1)), ("2.xml", xml_nota(2))])
+
+    assert [r["erro"] for r in resultados] == ["Erro ao gravar: conexão perdida"] * 2
+    assert asyncio.run(db.resumo_mensal.count_documents({})) == 0
+
+
+def test_erro_de_parse_nao_impede_o_restante_do_lote(servidor, empresa):
+    resultados = importar(servidor, empresa, [("1.xml", xml_nota(1)), ("ruim.xml", b"<outro/>"), ("3.xml", xml_nota(3))])
+
+    assert [r["sucesso"] for r in resultados] == [True, False, True]
+    assert "Layout de XML desconhecido" in resultados[1]["erro"]
+
+
+def test_nota_repetida_no_mesmo_lote_e_duplicada(servidor, empresa, db):
+    resultados = importar(servidor, empresa, [("a.xml", xml_nota(1)), ("b.xml", xml_nota(1))])
+
+    assert resultados[0]["sucesso"] is True
+    assert resultados[1]["status"] == "DUPLICADA"
+    assert asyncio.run(db.notas_fiscais.count_documents({})) == 1
+
+
+def test_nota_ja_gravada_e_duplicada(servidor, empresa, db):
+    importar(servidor, empresa, [("1.xml", xml_nota(1, chave="CH1"))])
+
+    # Mesma chave de validação, mesmo com o arquivo diferente
+    resultados = importar(servidor, empresa, [("1-copia.xml", xml_nota(1, valor="200.00", chave="CH1")), ("2.xml", xml_nota(2))])
+
+    assert resultados[0]["status"] == "DUPLICADA"
+    assert resultados[0]["erro"] == "DUPLICADA: nota 1 já foi importada para esta empresa"
+    assert resultados[1]["sucesso"] is True
+    assert asyncio.run(db.notas_fiscais.count_documents({})) == 2
+
+
+def test_sem_chave_mesmo_numero_com_arquivo_diferente_nao_e_duplicada(servidor, empresa, db):
+    resultados = importar(servidor, empresa, [("a.xml", xml_nota(1)), ("b.xml", xml_nota(1, valor="200.00"))])
+
+    assert [r["sucesso"] for r in resultados] == [True, True]
+
+
+def test_mesma_nota_em_outra_empresa_nao_e_duplicada(servidor, empresa, db):
+    outra = {**empresa, "cnpj": "99888777000166"}
+    del outra["_id"]
+    asyncio.run(db.empresas.insert_one(outra))
+
+    importar(servidor, empresa, [("1.xml", xml_nota(1, chave="CH1"))])
+    resultados = importar(servidor, outra, [("1.xml", xml_nota(1, chave="CH1"))])
+
+    assert resultados[0]["sucesso"] is True
+
+
+def test_job_refeito_conta_as_notas_ja_gravadas_por_ele(servidor, empresa):
+    arquivos = [("1.xml", xml_nota(1)), ("2.xml", xml_nota(2))]
+    importar(servidor, empresa, arquivos[:1], job_id="job-1")
+
+    refeito = importar(servidor, empresa, arquivos, job_id="job-1")
+    outro_job = importar(servidor, empresa, arquivos[:1], job_id="job-2")
+
+    assert [r["sucesso"] for r in refeito] == [True, True]
+    assert outro_job[0]["status"] == "DUPLICADA"
+
+
+def test_notas_antigas_recebem_impressao_e_passam_a_ser_duplicadas(servidor, empresa, db):
+    from utils.campos_nota import preencher_impressoes
+
+    conteudo = xml_nota(1)
+    antiga = {"empresa_id": str(empresa["_id"]), "numero_nota": 1, "xml_original": conteudo.decode("utf-8")}
+    asyncio.run(db.notas_fiscais.insert_many([
+        {**antiga},
+        {**antiga},  # importada duas vezes antes da detecção
+        {"empresa_id": str(empresa["_id"]), "numero_nota": 2, "chave_validacao": "CH2"},
+        {"empresa_id": str(empresa["_id"]), "numero_nota": 3},  # sem XML nem chave
+    ]))
+
+    totais = asyncio.run(preencher_impressoes(db))
+
+    assert totais == {"preenchidas": 2, "repetidas": 1, "sem_dados": 1}
+    resultados = importar(servidor, empresa, [("1.xml", conteudo), ("2.xml", xml_nota(2, chave="CH2"))])
+    assert [r.get("status") for r in resultados] == ["DUPLICADA", "DUPLICADA"]
+    # Uma segunda execução não encontra mais nada a preencher
+    assert asyncio.run(preencher_impressoes(db))["preenchidas"] == 0
@@ -0,0 +1,100 @@
+"""
+Índice offline de CNPJ montado a partir do dump de exemplo (--gerar-exemplo).
+
+Rodar a partir da pasta backend:
+
+    python -m pytest tests/test_indice_cnpj.py
+"""
+import os
+import zipfile
+
+import pytest
+
+from utils.indice_cnpj import IndiceCNPJ, gerar_exemplo, importar
+
+QUANTIDADE = 200
+
+
+@pytest.fixture
+def dump(tmp_path):
+    diretorio = tmp_path / "dump"
+    cnpjs = gerar_exemplo(str(diretorio), QUANTIDADE)
+    return diretorio, cnpjs
+
+
+@pytest.fixture
+def indice(dump, tmp_path):
+    diretorio, cnpjs = dump
+    caminho = str(tmp_path / "cnpj.sqlite")
+    totais = importar(str(diretorio), caminho)
+    indice = IndiceCNPJ(caminho)
+    yield indice, cnpjs, totais
+    indice.fechar()
+
+
+def test_importacao_conta_as_linhas_do_dump(indice):
+    _, cnpjs, totais = indice
+    assert totais["estabelecimentos"] == len(cnpjs) == QUANTIDADE
+    assert totais["empresas"] == QUANTIDADE
+    assert totais["municipios"] == 3
+
+
+def test_busca_cnpj_do_dump(indice):
+    indice, cnpjs, _ = indice
+
+    dados = indice.buscar(cnpjs[0])
+
+    assert dados["cnpj"] == cnpjs[0]
+    assert dados["razao_social"] == "EMPRESA EXEMPLO 0 LTDA"
+    assert dados["nome_fantasia"] == "EXEMPLO 0"
+    assert dados["logradouro"] == "RUA DAS FLORES 0, 0"
+    # Código do município trocado pelo nome da tabela de municípios
+    assert dados["municipio"] in ("SAO PAULO", "RIO DE JANEIRO", "BELO HORIZONTE")
+    assert dados["uf"] in ("SP", "RJ", "MG")
+    assert len(dados["cnae_principal"]) == 7
+    assert len(dados["cnaes_secundarios"]) == 2
+
+
+def test_busca_aceita_cnpj_formatado(indice):
+    indice, cnpjs, _ = indice
+    cnpj = cnpjs[-1]
+    formatado = f"{cnpj[:2]}.{cnpj[2:5]}.{cnpj[5:8]}/{cnpj[8:12]}-{cnpj[12:]}"
+
+    assert indice.buscar(formatado)["cnpj"] == cnpj
+
+
+def test_cnpj_fora_do_dump_devolve_none(indice):
+    indice, cnpjs, _ = indice
+    ausente = next(c for c in ("11222333000181", "11444777000161") if c not in cnpjs)
+
+    assert indice.buscar(ausente) is None
+    assert indice.buscar("123") is None
+
+
+def test_sem_arquivo_de_indice(tmp_path):
+    indice = IndiceCNPJ(str(tmp_path / "inexistente.sqlite"))
+
+    assert not indice.disponivel
+    assert indice.buscar("11222333000181") is None
+
+
+def test_dump_compactado_e_reimportacao_trocam_o_indice(dump, tmp_path):
+    diretorio, cnpjs = dump
+    caminho = str(tmp_path / "cnpj.sqlite")
+    importar(str(diretorio), caminho)
+    indice = IndiceCNPJ(caminho)
+    assert indice.buscar(cnpjs[0]) is not None
+
+    # Novo dump, distribuído em .zip como no portal da Receita
+    novo = tmp_path / "novo"
+    novos_cnpjs = gerar_exemplo(str(novo), 10, semente=7)
+    for nome in os.listdir(novo):
+        with zipfile.ZipFile(novo / f"{nome}.zip", "w") as arquivo_zip:
+            arquivo_zip.write(novo / nome, nome)
+        os.remove(novo / nome)
+    importar(str(novo), caminho)
+
+    # A conexão aberta é trocada pelo arquivo novo sem reiniciar
+    assert indice.buscar(novos_cnpjs[0])["razao_social"] == "EMPRESA EXEMPLO 0 LTDA"
+    assert indice.buscar(cnpjs[1]) is None
+    indice.fechar()
@@ -0,0 +1,97 @@
+"""
+Paginação por chave da listagem de notas (server.listar_notas_empresa), com
+data_emissao em texto (notas não migradas) e em data na mesma empresa.
+
+Rodar a partir da pasta backend:
+
+    python -m pytest tests/test_paginacao.py
+"""
+import asyncio
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+from fastapi import HTTPException
+
+
+# Datas repetidas, para o desempate por _id entrar nas páginas
+DATAS = [
+    datetime(2026, 9, 1), datetime(2026, 9, 1), datetime(2026, 9, 2), datetime(2026, 9, 3),
+    "2026-08-01T00:00:00", "2026-08-01T00:00:00", "2026-08-15T00:00:00",
+]
+
+
+@pytest.fixture
+def notas(db, empresa):
+    documentos = [
+        {
+            "empresa_id": str(empresa["_id"]),
+            "numero_nota": numero,
+            "data_emissao": data,
+            "codigo_servico_utilizado": "0802",
+            "valor_centavos": 10000,
+            "status_auditoria": "APROVADA",
+            "data_importacao": "2026-09-10T00:00:00",
+        }
+        for numero, data in enumerate(DATAS, start=1)
+    ]
+    asyncio.run(db.notas_fiscais.insert_many(documentos))
+    return documentos
+
+
+def paginar(servidor, empresa, ordem: str, limit: int):
+    async def executar():
+        numeros, cursor = [], None
+        while True:
+            pagina = await servidor.listar_notas_empresa(
+                str(empresa["_id"]), limit=limit, cursor=cursor, status=None, data_inicio=None,
+                data_fim=None, codigo_servico=None, ordem=ordem, empresa=empresa
+            )
+            numeros += [nota["numero_nota"] for nota in pagina["notas"]]
+            if not pagina["tem_mais"]:
+                return numeros
+            cursor = pagina["proximo_cursor"]
+
+    return asyncio.run(executar())
+
+
+def test_cursor_guarda_o_tipo_da_data(servidor):
+    nota_id = ObjectId()
+
+    assert servidor.decodificar_cursor(servidor.codificar_cursor({"_id": nota_id, "data_emissao": datetime(2026, 9, 1)})) \
+        == (datetime(2026, 9, 1), nota_id)
+    assert servidor.decodificar_cursor(servidor.codificar_cursor({"_id": nota_id, "data_emissao": "2026-08-01T00:00:00"})) \
+        == ("2026-08-01T00:00:00", nota_id)
+
+
+def test_cursor_invalido(servidor):
+    with pytest.raises(HTTPException) as erro:
+        servidor.decodificar_cursor("nao-e-cursor")
+
+    assert erro.value.status_code == 400
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3])
+def test_desc_percorre_datas_e_depois_textos(servidor, empresa, notas, limit):
+    numeros = paginar(servidor, empresa, "desc", limit)
+
+    # Cada nota aparece uma única vez; em ordem decrescente o MongoDB põe as datas antes dos textos
+    assert sorted(numeros) == list(range(1, len(DATAS) + 1))
+    assert numeros == [4, 3, 2, 1, 7, 6, 5]
+
+
+@pytest.mark.parametrize("limit", [1, 2, 3])
+def test_asc_percorre_textos_e_depois_datas(servidor, empresa, notas, limit):
+    numeros = paginar(servidor, empresa, "asc", limit)
+
+    assert numeros == [5, 6, 7, 1, 2, 3, 4]
+
+
+def test_pagina_sem_limit_devolve_a_lista_completa(servidor, empresa, notas):
+    resposta = asyncio.run(servidor.listar_notas_empresa(
+        str(empresa["_id"]), limit=None, cursor=None, status=None, data_inicio=None,
+        data_fim=None, codigo_servico=None, ordem="desc", empresa=empresa
+    ))
+
+    assert isinstance(resposta, list)
+    assert len(resposta) == len(DATAS)
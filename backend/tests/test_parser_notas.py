@@ -0,0 +1,61 @@
+"""
+Parser de XML de notas (utils.parser_notas).
+
+Rodar a partir da pasta backend:
+
+    python -m pytest tests/test_parser_notas.py
+"""
+from decimal import Decimal
+
+import pytest
+
+from utils import parser_notas
+from utils.parser_notas import detectar_layout, parse_xml_notas
+
+
+def xml_municipal(quantidade: int, valor: str = "100.50"):
+    notas = "".join(
+        f"<NOTA_FISCAL><NumeroNota>{n}</NumeroNota><DataEmissao>2026-09-10T10:00:00</DataEmissao>"
+        f"<Cae>0802</Cae><ValorTotalNota>{valor}</ValorTotalNota><ChaveValidacao>CH{n}</ChaveValidacao>"
+        f"<ClienteCNPJCPF>11222333000181</ClienteCNPJCPF></NOTA_FISCAL>"
+        for n in range(1, quantidade + 1)
+    )
+    return f'<?xml version="1.0" encoding="utf-8"?><tbnfd><nfdok><NewDataSet>{notas}</NewDataSet></nfdok></tbnfd>'.encode()
+
+
+def test_nota_municipal():
+    resultado = parse_xml_notas(xml_municipal(1))
+
+    assert resultado["layout"] == "municipal"
+    assert resultado["notas"] == [{
+        "numero_nota": 1,
+        "data_emissao": "2026-09-10T00:00:00",
+        "codigo_servico": "0802",
+        "valor_total": Decimal("100.50"),
+        "chave_validacao": "CH1",
+        "cnpj_tomador": "11222333000181",
+    }]
+
+
+def test_valor_total_e_decimal_exato():
+    valor = parse_xml_notas(xml_municipal(1, "0.29"))["notas"][0]["valor_total"]
+
+    assert isinstance(valor, Decimal)
+    assert valor * 100 == 29
+
+
+@pytest.mark.skipif(not parser_notas.LXML_DISPONIVEL, reason="poda dos elementos só com lxml")
+def test_notas_ja_lidas_sao_removidas_da_arvore():
+    layout = detectar_layout(xml_municipal(1))
+    anteriores = []
+
+    for elemento in parser_notas._iterar_notas(xml_municipal(2000), layout):
+        anteriores.append(sum(1 for _ in elemento.itersiblings(preceding=True)))
+
+    assert len(anteriores) == 2000
+    # NewDataSet só mantém a nota anterior (já esvaziada), não as 2000 já lidas
+    assert max(anteriores) <= 1
+
+
+def test_layout_desconhecido():
+    assert parse_xml_notas(b"<?xml version='1.0'?><outro><a/></outro>") == {"erro": parser_notas.ERRO_LAYOUT}
@@ -0,0 +1,131 @@
+"""
+Reauditoria do código de serviço depois de uma mudança nos CNAEs da empresa
+(utils.regras_auditoria.reauditar_servicos).
+
+Rodar a partir da pasta backend:
+
+    python -m pytest tests/test_reauditoria.py
+"""
+import asyncio
+from datetime import datetime
+
+from utils import resumo_mensal
+from utils.regras_auditoria import (
+    ALERTA, APROVADA, ERRO_CNAE, MENSAGEM_APROVADA, auditar_notas, reauditar_servicos,
+)
+
+ALERTA_TOMADOR = "CPF/CNPJ do tomador inválido: 123"
+
+
+def nota(empresa: dict, codigo: str, tomador: str = "11222333000181", data_emissao=datetime(2026, 8, 10)):
+    return {
+        "empresa_id": str(empresa["_id"]),
+        "numero_nota": 0,
+        "codigo_servico_utilizado": codigo,
+        "data_emissao": data_emissao,
+        "valor_centavos": 10000,
+        "cnpj_tomador": tomador,
+    }
+
+
+def gravar(db, empresa: dict, notas: list):
+    """
+    Audita e grava as notas como a importação (resumo mensal incluído).
+    """
+    async def executar():
+        await auditar_notas(db, empresa, notas)
+        await db.notas_fiscais.insert_many(notas)
+        await resumo_mensal.registrar_notas(db, notas)
+
+    asyncio.run(executar())
+
+
+def notas_por_codigo(db, empresa: dict):
+    async def ler():
+        notas = {}
+        async for item in db.notas_fiscais.find({"empresa_id": str(empresa["_id"])}).sort("_id", 1):
+            notas.setdefault(item["codigo_servico_utilizado"], []).append(
+                (item["status_auditoria"], item["mensagem_erro"])
+            )
+        return notas
+
+    return asyncio.run(ler())
+
+
+def por_status(db, empresa: dict, mes: str = "2026-08"):
+    resumo = asyncio.run(db.resumo_mensal.find_one({"empresa_id": str(empresa["_id"]), "mes": mes}))
+    return {status: quantidade for status, quantidade in resumo["por_status"].items() if quantidade}
+
+
+def reauditar(db, empresa: dict, codigos: list):
+    empresa["cnaes_permitidos"] = [
+        {"cnae_codigo": "6201501", "codigo_servico_municipal": codigo} for codigo in codigos
+    ]
+    return asyncio.run(reauditar_servicos(db, empresa))
+
+
+def test_codigo_liberado_volta_ao_resultado_das_outras_regras(db, empresa):
+    gravar(db, empresa, [nota(empresa, "0107"), nota(empresa, "0107", tomador="123"), nota(empresa, "0802")])
+    assert por_status(db, empresa) == {ERRO_CNAE: 2, APROVADA: 1}
+
+    resultado = reauditar(db, empresa, ["0802", "0107"])
+
+    assert resultado == {"notas_alteradas": 2, "por_codigo": {"permitidos": 2}}
+    assert notas_por_codigo(db, empresa)["0107"] == [(APROVADA, MENSAGEM_APROVADA), (ALERTA, ALERTA_TOMADOR)]
+    assert por_status(db, empresa) == {APROVADA: 2, ALERTA: 1}
+
+
+def test_codigo_removido_vira_erro_cnae_mantendo_as_outras_mensagens(db, empresa):
+    gravar(db, empresa, [
+        nota(empresa, "0802"),
+        nota(empresa, "0802", tomador="123"),
+        nota(empresa, "0802", data_emissao=datetime(2026, 9, 1)),
+        nota(empresa, "0107"),
+    ])
+
+    # Troca o 0802 pelo 0107
+    resultado = reauditar(db, empresa, ["0107"])
+
+    assert resultado == {"notas_alteradas": 4, "por_codigo": {"permitidos": 1, "0802": 3}}
+    mensagem_cnae = "Código de serviço '0802' não autorizado para este CNPJ"
+    assert notas_por_codigo(db, empresa) == {
+        "0802": [
+            (ERRO_CNAE, mensagem_cnae),
+            (ERRO_CNAE, f"{mensagem_cnae}; {ALERTA_TOMADOR}"),
+            (ERRO_CNAE, mensagem_cnae),
+        ],
+        "0107": [(APROVADA, MENSAGEM_APROVADA)],
+    }
+    # Cada mês do resumo recebe só as notas dele
+    assert por_status(db, empresa) == {ERRO_CNAE: 2, APROVADA: 1}
+    assert por_status(db, empresa, "2026-09") == {ERRO_CNAE: 1}
+
+
+def test_nada_muda_quando_os_codigos_continuam_iguais(db, empresa):
+    gravar(db, empresa, [nota(empresa, "0802"), nota(empresa, "0107")])
+
+    assert reauditar(db, empresa, ["0802"]) == {"notas_alteradas": 0, "por_codigo": {}}
+
+
+def test_notas_anteriores_ao_motor_de_regras(db, empresa):
+    # Sem status_regras/mensagem_regras: liberadas, ficam aprovadas
+    antiga = {**nota(empresa, "0107"), "status_auditoria": ERRO_CNAE, "mensagem_erro": "CNAE não permitido"}
+    asyncio.run(db.notas_fiscais.insert_one(antiga))
+    asyncio.run(resumo_mensal.registrar_notas(db, [antiga]))
+
+    resultado = reauditar(db, empresa, ["0107"])
+
+    assert resultado["notas_alteradas"] == 1
+    assert notas_por_codigo(db, empresa)["0107"] == [(APROVADA, MENSAGEM_APROVADA)]
+    assert por_status(db, empresa) == {APROVADA: 1}
+
+
+def test_outras_empresas_nao_sao_alteradas(db, empresa):
+    outra = {**empresa, "_id": "outra-empresa"}
+    gravar(db, empresa, [nota(empresa, "0802")])
+    gravar(db, outra, [nota(outra, "0802")])
+
+    reauditar(db, empresa, ["0107"])
+
+    assert notas_por_codigo(db, outra)["0802"] == [(APROVADA, MENSAGEM_APROVADA)]
+    assert por_status(db, outra) == {APROVADA: 1}
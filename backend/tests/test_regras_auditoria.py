@@ -0,0 +1,169 @@
+"""
+Motor de regras da auditoria (utils.regras_auditoria): regras de cada regime,
+combinação dos achados e cache das regras compiladas.
+
+Rodar a partir da pasta backend:
+
+    python -m pytest tests/test_regras_auditoria.py
+"""
+import asyncio
+from datetime import datetime
+
+import pytest
+from bson import ObjectId
+
+from utils import regras_auditoria
+from utils.regras_auditoria import (
+    ALERTA, APROVADA, ERRO_CNAE, ERRO_IMPOSTO, MENSAGEM_APROVADA,
+    RegrasEmpresa, auditar_notas, avaliar_lote, carregar_contexto, obter_regras,
+)
+from utils.resumo_mensal import meses_anteriores
+
+CNPJ_VALIDO = "11222333000181"
+
+
+def empresa(regime: str = "Simples Nacional", **campos):
+    return {
+        "_id": ObjectId(),
+        "regime_tributario": regime,
+        "data_abertura": "2020-01-01",
+        "cnaes_permitidos": [{"cnae_codigo": "6201501", "codigo_servico_municipal": "0802"}],
+        **campos,
+    }
+
+
+def nota(centavos: int = 10000, codigo: str = "0802", data_emissao=datetime(2026, 9, 10), tomador: str = CNPJ_VALIDO):
+    return {
+        "codigo_servico_utilizado": codigo,
+        "data_emissao": data_emissao,
+        "valor_centavos": centavos,
+        "cnpj_tomador": tomador,
+    }
+
+
+def contexto(faturamento_mes: dict = None, ticket_medio: float = None):
+    """
+    Contexto como o de carregar_contexto, para notas de setembro de 2026.
+    """
+    return {
+        "hoje": "2026-10-18",
+        "faturamento_mes": faturamento_mes or {},
+        "janela_rbt12": {"2026-09": meses_anteriores(datetime(2026, 9, 1), 12)},
+        "ticket_medio": ticket_medio,
+    }
+
+
+def avaliar(dados_empresa: dict, notas: list, ctx: dict = None):
+    return avaliar_lote(RegrasEmpresa(dados_empresa), notas, ctx or contexto())
+
+
+def test_nota_em_conformidade():
+    assert avaliar(empresa(), [nota()]) == [{
+        "status_auditoria": APROVADA,
+        "mensagem_erro": MENSAGEM_APROVADA,
+        "status_regras": APROVADA,
+        "mensagem_regras": MENSAGEM_APROVADA,
+    }]
+
+
+def test_rbt12_do_mei_acumula_as_notas_do_lote():
+    # R$ 60.000 já faturados em agosto; limite do MEI R$ 81.000, alerta a partir de 80%
+    ctx = contexto({"2026-08": 6_000_000})
+
+    resultado = avaliar(empresa("MEI"), [nota(100_000), nota(500_000), nota(1_600_000)], ctx)
+
+    assert [r["status_auditoria"] for r in resultado] == [APROVADA, ALERTA, ERRO_IMPOSTO]
+    assert "R$ 66000.00" in resultado[1]["mensagem_erro"]
+    assert resultado[2]["mensagem_erro"].startswith("Faturamento dos últimos 12 meses (R$ 82000.00) ultrapassa")
+
+
+def test_rbt12_ignora_meses_fora_da_janela():
+    # Setembro de 2025 está fora da janela de 12 meses de setembro de 2026
+    ctx = contexto({"2025-09": 10_000_000})
+
+    assert avaliar(empresa("MEI"), [nota()], ctx)[0]["status_auditoria"] == APROVADA
+
+
+def test_rbt12_do_simples_nacional_usa_o_limite_do_regime():
+    ctx = contexto({"2026-08": 6_000_000})
+
+    assert avaliar(empresa("Simples Nacional"), [nota(2_500_000)], ctx)[0]["status_auditoria"] == APROVADA
+    assert avaliar(empresa("Simples Nacional"), [nota(480_000_000)], ctx)[0]["status_auditoria"] == ERRO_IMPOSTO
+
+
+@pytest.mark.parametrize("regime", ["Lucro Presumido", "Lucro Real", None])
+def test_regimes_sem_regra_de_rbt12(regime):
+    dados = empresa(regime, limite_faturamento_anual=1000)
+
+    assert RegrasEmpresa(dados).regras is regras_auditoria.REGRAS_PADRAO
+    assert avaliar(dados, [nota()], contexto({"2026-08": 10_000_000}))[0]["status_auditoria"] == APROVADA
+
+
+@pytest.mark.parametrize("regime", ["MEI", "Simples Nacional", "Lucro Presumido", "Lucro Real"])
+def test_codigo_de_servico_nao_autorizado_em_todos_os_regimes(regime):
+    resultado = avaliar(empresa(regime), [nota(codigo="0107")])[0]
+
+    assert resultado["status_auditoria"] == ERRO_CNAE
+    assert resultado["mensagem_erro"] == "Código de serviço '0107' não autorizado para este CNPJ"
+    # Sem a regra de CNAE a nota estaria aprovada
+    assert resultado["status_regras"] == APROVADA
+
+
+def test_alertas_de_tomador_data_e_valor():
+    notas = [
+        nota(tomador="11222333000180"),
+        nota(tomador=None),
+        nota(data_emissao=datetime(2019, 12, 31)),
+        nota(data_emissao="2026-10-19T00:00:00"),
+        nota(centavos=0),
+        nota(centavos=500_000),
+    ]
+
+    resultado = avaliar(empresa("Lucro Presumido"), notas, contexto(ticket_medio=100.0))
+
+    assert [r["status_auditoria"] for r in resultado] == [ALERTA, APROVADA, ALERTA, ALERTA, ALERTA, ALERTA]
+    assert resultado[0]["mensagem_erro"] == "CPF/CNPJ do tomador inválido: 11222333000180"
+    assert resultado[2]["mensagem_erro"] == "Data de emissão anterior à abertura da empresa (2020-01-01)"
+    assert resultado[3]["mensagem_erro"] == "Data de emissão no futuro"
+    assert resultado[4]["mensagem_erro"] == "Nota com valor zerado ou negativo"
+    assert resultado[5]["mensagem_erro"].startswith("Valor R$ 5000.00 muito acima do ticket médio")
+
+
+def test_status_e_o_mais_grave_e_mensagens_sao_mantidas():
+    resultado = avaliar(empresa("MEI"), [nota(9_000_000, codigo="0107", tomador="123")])[0]
+
+    assert resultado["status_auditoria"] == ERRO_CNAE
+    mensagens = resultado["mensagem_erro"].split("; ")
+    assert mensagens[0].startswith("Código de serviço '0107'")
+    assert mensagens[1].startswith("Faturamento dos últimos 12 meses")
+    assert mensagens[2] == "CPF/CNPJ do tomador inválido: 123"
+    assert resultado["status_regras"] == ERRO_IMPOSTO
+    assert resultado["mensagem_regras"] == "; ".join(mensagens[1:])
+
+
+def test_regras_em_cache_ate_a_empresa_mudar():
+    dados = empresa()
+    regras_auditoria.invalidar_regras(dados["_id"])
+
+    regras = obter_regras(dados)
+    assert obter_regras({**dados, "razao_social": "OUTRO NOME"}) is regras
+
+    alterada = {**dados, "cnaes_permitidos": [{"cnae_codigo": "6201501", "codigo_servico_municipal": "0107"}]}
+    assert set(obter_regras(alterada).servicos_permitidos) == {"0107"}
+
+
+def test_contexto_e_auditoria_a_partir_do_resumo_mensal(db):
+    dados = empresa("MEI")
+    # 10 notas nos últimos 12 meses (mínimo para o ticket médio) somando R$ 70.000
+    asyncio.run(db.resumo_mensal.insert_one({
+        "empresa_id": str(dados["_id"]), "mes": meses_anteriores(datetime.utcnow(), 1)[0],
+        "valor_centavos": 7_000_000, "quantidade": 10,
+    }))
+    notas = [nota(100_000, data_emissao=datetime.utcnow())]
+
+    ctx = asyncio.run(carregar_contexto(db, obter_regras(dados), notas))
+    asyncio.run(auditar_notas(db, dados, notas))
+
+    assert ctx["ticket_medio"] == 7000.0
+    assert notas[0]["status_auditoria"] == ALERTA
+    assert notas[0]["mensagem_erro"].startswith("Faturamento dos últimos 12 meses (R$ 71000.00)")
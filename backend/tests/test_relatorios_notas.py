@@ -0,0 +1,103 @@
+"""
+Relatórios .xlsx e CSV (utils.relatorios_notas) a partir de cursores em memória.
+
+Rodar a partir da pasta backend:
+
+    python -m pytest tests/test_relatorios_notas.py
+"""
+import asyncio
+import os
+import tempfile
+from datetime import datetime
+
+import pytest
+from openpyxl import load_workbook
+
+from utils import relatorios_notas
+from utils.relatorios_notas import COLUNAS_NOTAS, gerar_csv, gerar_xlsx
+
+
+def nota(numero: int, centavos: int = 10050):
+    return {
+        "numero_nota": numero,
+        "data_emissao": datetime(2026, 9, 10),
+        "codigo_servico_utilizado": "0802",
+        "cnpj_tomador": "11222333000181",
+        "valor_centavos": centavos,
+        "status_auditoria": "APROVADA",
+        "chave_validacao": f"CH{numero}",
+    }
+
+
+async def cursor(notas, atraso=0.0, falhar_em=None):
+    for indice, item in enumerate(notas):
+        if indice == falhar_em:
+            raise RuntimeError("conexão perdida")
+        await asyncio.sleep(atraso)
+        yield item
+
+
+def aba(cursor_notas):
+    return {"titulo": "Notas", "topo": ["Notas Fiscais"], "colunas": COLUNAS_NOTAS, "cursor": cursor_notas}
+
+
+@pytest.fixture
+def temporarios(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    monkeypatch.setattr(relatorios_notas, "RELATORIO_TAMANHO_LOTE", 2)
+    yield tmp_path
+    relatorios_notas.encerrar_pool_relatorios()
+
+
+def test_xlsx_com_as_notas_do_cursor(temporarios):
+    caminho = asyncio.run(gerar_xlsx([aba(cursor([nota(1), nota(2), nota(3)]))]))
+
+    linhas = list(load_workbook(caminho).active.values)
+    # topo, linha em branco, cabeçalho e as três notas
+    assert linhas[2][0] == "Número da Nota"
+    assert [linha[0] for linha in linhas[3:]] == [1, 2, 3]
+    assert linhas[3][4] == 100.5
+    os.remove(caminho)
+    assert os.listdir(temporarios) == []
+
+
+def test_falha_na_geracao_apaga_os_temporarios(temporarios):
+    with pytest.raises(RuntimeError):
+        asyncio.run(gerar_xlsx([aba(cursor([nota(n) for n in range(10)], falhar_em=5))]))
+
+    assert os.listdir(temporarios) == []
+
+
+def test_limite_vale_pelo_relatorio_inteiro(temporarios, monkeypatch):
+    monkeypatch.setattr(relatorios_notas, "RELATORIO_MAX_CONCORRENCIA", 1)
+    relatorios_notas.encerrar_pool_relatorios()
+    em_andamento = {"atual": 0, "maximo": 0}
+
+    async def contando(notas):
+        em_andamento["atual"] += 1
+        em_andamento["maximo"] = max(em_andamento["maximo"], em_andamento["atual"])
+        async for item in cursor(notas, atraso=0.01):
+            yield item
+        em_andamento["atual"] -= 1
+
+    async def cenario():
+        return await asyncio.gather(*[
+            gerar_xlsx([aba(contando([nota(n) for n in range(6)]))]) for _ in range(3)
+        ])
+
+    caminhos = asyncio.run(cenario())
+
+    assert em_andamento["maximo"] == 1
+    for caminho in caminhos:
+        os.remove(caminho)
+
+
+def test_csv_com_virgula_decimal_e_valores_negativos(temporarios):
+    async def ler():
+        return b"".join([parte async for parte in gerar_csv([{"cursor": cursor([nota(1), nota(2, -150), nota(3, -5)])}], COLUNAS_NOTAS)])
+
+    linhas = asyncio.run(ler()).decode("utf-8-sig").splitlines()
+
+    assert linhas[0].startswith("Número da Nota;Data de Emissão")
+    assert [linha.split(";")[4] for linha in linhas[1:]] == ["100,50", "-1,50", "-0,05"]
+    assert linhas[1].split(";")[1] == "10/09/2026"
@@ -0,0 +1,120 @@
+"""
+Resumo mensal das notas (utils.resumo_mensal), mantido com $inc na gravação e
+na exclusão.
+
+Rodar a partir da pasta backend:
+
+    python -m pytest tests/test_resumo_mensal.py
+"""
+import asyncio
+from datetime import datetime
+
+from utils import resumo_mensal
+
+EMPRESA_ID = "empresa-1"
+
+
+def nota(data_emissao, centavos: int, status: str = "APROVADA", empresa_id: str = EMPRESA_ID):
+    return {
+        "empresa_id": empresa_id,
+        "data_emissao": data_emissao,
+        "valor_centavos": centavos,
+        "status_auditoria": status,
+    }
+
+
+def resumos(db):
+    async def ler():
+        return {
+            (resumo["empresa_id"], resumo["mes"]): resumo
+            async for resumo in db.resumo_mensal.find({}, {"_id": 0})
+        }
+
+    return asyncio.run(ler())
+
+
+def test_registrar_agrupa_por_empresa_e_mes(db):
+    asyncio.run(resumo_mensal.registrar_notas(db, [
+        nota(datetime(2026, 8, 5), 10050),
+        nota(datetime(2026, 8, 20), 2000, "ALERTA"),
+        # Notas não migradas têm a data em texto
+        nota("2026-09-01T00:00:00", 700),
+        nota(datetime(2026, 8, 5), 100, empresa_id="empresa-2"),
+    ]))
+
+    gravados = resumos(db)
+    assert gravados[(EMPRESA_ID, "2026-08")] == {
+        "empresa_id": EMPRESA_ID, "mes": "2026-08", "quantidade": 2, "valor_centavos": 12050,
+        "por_status": {"APROVADA": 1, "ALERTA": 1},
+    }
+    assert gravados[(EMPRESA_ID, "2026-09")]["valor_centavos"] == 700
+    assert gravados[("empresa-2", "2026-08")]["quantidade"] == 1
+
+
+def test_incrementos_se_acumulam_e_exclusao_desconta(db):
+    primeira, segunda = nota(datetime(2026, 8, 5), 10050), nota(datetime(2026, 8, 6), 2000, "ERRO_CNAE")
+    asyncio.run(resumo_mensal.registrar_notas(db, [primeira]))
+    asyncio.run(resumo_mensal.registrar_notas(db, [segunda]))
+
+    asyncio.run(resumo_mensal.registrar_notas(db, [primeira], sinal=-1))
+
+    resumo = resumos(db)[(EMPRESA_ID, "2026-08")]
+    assert resumo["quantidade"] == 1
+    assert resumo["valor_centavos"] == 2000
+    assert resumo["por_status"] == {"APROVADA": 0, "ERRO_CNAE": 1}
+
+
+def test_nota_antiga_em_reais_entra_em_centavos(db):
+    antiga = {"empresa_id": EMPRESA_ID, "data_emissao": datetime(2026, 8, 5), "valor_total": 0.29, "status_auditoria": "APROVADA"}
+
+    asyncio.run(resumo_mensal.registrar_notas(db, [antiga]))
+
+    assert resumos(db)[(EMPRESA_ID, "2026-08")]["valor_centavos"] == 29
+
+
+def test_somar_meses_com_resumo_antigo_em_reais(db):
+    asyncio.run(resumo_mensal.registrar_notas(db, [nota(datetime(2026, 8, 5), 10050)]))
+    # Resumo de antes dos centavos, ainda não convertido
+    asyncio.run(db.resumo_mensal.insert_one({"empresa_id": EMPRESA_ID, "mes": "2026-07", "valor_total": 10.1, "quantidade": 1}))
+
+    soma = asyncio.run(resumo_mensal.somar_meses(db, EMPRESA_ID, ["2026-06", "2026-07", "2026-08"]))
+
+    assert soma == {"valor_centavos": 11060, "valor_total": 110.6, "quantidade": 2}
+
+
+def test_mover_status(db):
+    asyncio.run(resumo_mensal.registrar_notas(db, [nota(datetime(2026, 8, 5), 100, "ERRO_CNAE")] * 3))
+
+    asyncio.run(resumo_mensal.mover_status(db, EMPRESA_ID, [
+        {"mes": "2026-08", "de": "ERRO_CNAE", "para": "APROVADA", "quantidade": 2},
+        {"mes": "2026-08", "de": "APROVADA", "para": "APROVADA", "quantidade": 5},
+    ]))
+
+    resumo = resumos(db)[(EMPRESA_ID, "2026-08")]
+    assert resumo["por_status"] == {"ERRO_CNAE": 1, "APROVADA": 2}
+    assert resumo["quantidade"] == 3
+
+
+def test_meses_anteriores_atravessa_o_ano():
+    assert resumo_mensal.meses_anteriores(datetime(2026, 2, 15), 3) == ["2025-12", "2026-01", "2026-02"]
+
+
+def test_excluir_nota_desconta_do_resumo_uma_vez(servidor, empresa, db, monkeypatch):
+    gravada = nota(datetime(2026, 8, 5), 10050, empresa_id=str(empresa["_id"]))
+    asyncio.run(db.notas_fiscais.insert_one(gravada))
+    asyncio.run(resumo_mensal.registrar_notas(db, [gravada]))
+
+    # O mongomock não executa o $lookup com pipeline de obter_nota_autorizada;
+    # a nota lida antes da exclusão é devolvida também na exclusão repetida
+    async def obter_nota(nota_id, current_user, projecao=None):
+        return gravada, empresa
+
+    monkeypatch.setattr(servidor, "obter_nota_autorizada", obter_nota)
+    usuario = {"id": empresa["usuario_id"]}
+    asyncio.run(servidor.excluir_nota(str(gravada["_id"]), usuario))
+    # Exclusão repetida (ex.: dois cliques) que leu a nota antes da primeira remover
+    asyncio.run(servidor.excluir_nota(str(gravada["_id"]), usuario))
+
+    resumo = resumos(db)[(str(empresa["_id"]), "2026-08")]
+    assert resumo["quantidade"] == 0
+    assert resumo["valor_centavos"] == 0
@@ -0,0 +1,217 @@
+"""
+Armazenamento dos XMLs originais das notas (coleção `xml_blobs`).
+
+Cada XML é guardado uma única vez, compactado, com o SHA-256 dos bytes
+recebidos como _id; a nota guarda só esse hash em `xml_hash`. Assim os
+documentos de `notas_fiscais` ficam pequenos e as listagens/agregações não
+arrastam o XML, que só é lido (e descompactado) em obter_detalhes_nota.
+
+Notas antigas ainda têm o XML em `xml_original`; carregar_xml aceita os dois
+formatos. Para mover as antigas e remover XMLs sem nota (a partir da pasta backend):
+
+    python -m utils.armazem_xml --migrar
+    python -m utils.armazem_xml --limpar-orfaos [--carencia-horas 24]
+"""
+import argparse
+import asyncio
+import gzip
+import hashlib
+import os
+import logging
+from datetime import datetime, timedelta
+from pymongo import UpdateOne
+from dotenv import load_dotenv
+from utils.parser_notas import parse_xml_notas
+
+try:
+    import zstandard
+except ImportError:  # zstd é opcional; sem ele os XMLs são gravados com gzip
+    zstandard = None
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# "zstd" (se o pacote zstandard estiver instalado) ou "gzip"
+XML_COMPRESSAO = os.getenv("XML_COMPRESSAO", "zstd" if zstandard else "gzip").lower()
+XML_COMPRESSAO_NIVEL = int(os.getenv("XML_COMPRESSAO_NIVEL", "6"))
+# Notas lidas por rodada na migração
+TAMANHO_LOTE_MIGRACAO = int(os.getenv("TAMANHO_LOTE_MIGRACAO", "500"))
+
+
+def compactar(conteudo: bytes):
+    """
+    Documento de `xml_blobs` para os bytes de um XML.
+    """
+    if XML_COMPRESSAO == "zstd" and zstandard is not None:
+        compactado = zstandard.ZstdCompressor(level=XML_COMPRESSAO_NIVEL).compress(conteudo)
+        compressao = "zstd"
+    else:
+        compactado = gzip.compress(conteudo, compresslevel=XML_COMPRESSAO_NIVEL)
+        compressao = "gzip"
+    return {
+        "_id": hashlib.sha256(conteudo).hexdigest(),
+        "compressao": compressao,
+        "tamanho": len(conteudo),
+        "conteudo": compactado,
+    }
+
+
+def descompactar(blob: dict):
+    if blob["compressao"] == "zstd":
+        if zstandard is None:
+            raise RuntimeError("XML gravado com zstd, mas o pacote zstandard não está instalado")
+        return zstandard.ZstdDecompressor().decompress(blob["conteudo"], max_output_size=blob["tamanho"])
+    return gzip.decompress(blob["conteudo"])
+
+
+def decodificar(conteudo: bytes):
+    try:
+        return conteudo.decode("utf-8")
+    except UnicodeDecodeError:
+        return conteudo.decode("iso-8859-1")
+
+
+def ler_e_compactar(conteudo: bytes):
+    """
+    Parse e compactação de um arquivo, para rodar no pool de parsing.
+    Em caso de sucesso o resultado traz também o documento do XML em "xml_blob".
+    """
+    dados = parse_xml_notas(conteudo)
+    if "erro" not in dados:
+        dados["xml_blob"] = compactar(conteudo)
+    return dados
+
+
+async def guardar_blobs(db, blobs: list):
+    """
+    Grava os XMLs que ainda não existem (um bulk_write para todos). XMLs já
+    guardados só têm `ultimo_uso` atualizado, o que os protege da limpeza de órfãos.
+    """
+    agora = datetime.utcnow()
+    unicos = {blob["_id"]: blob for blob in blobs}
+    if not unicos:
+        return
+    operacoes = [
+        UpdateOne(
+            {"_id": blob_id},
+            {"$setOnInsert": {
+                "compressao": blob["compressao"],
+                "tamanho": blob["tamanho"],
+                "conteudo": blob["conteudo"],
+                "criado_em": agora,
+            }, "$set": {"ultimo_uso": agora}},
+            upsert=True
+        )
+        for blob_id, blob in unicos.items()
+    ]
+    await db.xml_blobs.bulk_write(operacoes, ordered=False)
+
+
+async def carregar_xml(db, nota: dict):
+    """
+    XML original de uma nota, decodificado. Vazio se a nota não tiver XML.
+    """
+    if nota.get("xml_original"):
+        return nota["xml_original"]
+    if not nota.get("xml_hash"):
+        return ""
+
+    blob = await db.xml_blobs.find_one({"_id": nota["xml_hash"]})
+    if not blob:
+        logger.warning(f"XML {nota['xml_hash']} da nota {nota.get('_id')} não encontrado")
+        return ""
+    # Descompactar é rápido perto da ida ao banco; não vale mandar para o pool
+    return decodificar(descompactar(blob))
+
+
+async def migrar(db):
+    """
+    Move o `xml_original` das notas antigas para `xml_blobs`, em lotes. Pode
+    ser interrompida e executada de novo. Retorna a quantidade de notas migradas.
+    """
+    total = 0
+    while True:
+        notas = await db.notas_fiscais.find(
+            {"xml_original": {"$exists": True}},
+            {"xml_original": 1}
+        ).limit(TAMANHO_LOTE_MIGRACAO).to_list(TAMANHO_LOTE_MIGRACAO)
+        if not notas:
+            return total
+
+        blobs = []
+        operacoes = []
+        for nota in notas:
+            xml = nota.get("xml_original") or ""
+            if not xml:
+                operacoes.append(UpdateOne({"_id": nota["_id"]}, {"$unset": {"xml_original": ""}}))
+                continue
+            # O texto foi decodificado na importação; volta para bytes em UTF-8
+            blob = compactar(xml.encode("utf-8"))
+            blobs.append(blob)
+            operacoes.append(UpdateOne(
+                {"_id": nota["_id"]},
+                {"$set": {"xml_hash": blob["_id"]}, "$unset": {"xml_original": ""}}
+            ))
+
+        # Blobs antes das notas: uma interrupção no meio não deixa nota sem XML
+        await guardar_blobs(db, blobs)
+        await db.notas_fiscais.bulk_write(operacoes, ordered=False)
+        total += len(operacoes)
+        logger.info(f"{total} notas migradas")
+
+
+async def limpar_orfaos(db, carencia_horas: float = 24):
+    """
+    Remove XMLs que nenhuma nota referencia (notas excluídas). Só considera os
+    não usados há `carencia_horas`, para não apagar o XML de uma importação em
+    andamento. Retorna a quantidade removida.
+    """
+    limite = datetime.utcnow() - timedelta(hours=carencia_horas)
+    candidatos = db.xml_blobs.find({"ultimo_uso": {"$lt": limite}}, {"_id": 1})
+    removidos = 0
+
+    async def remover(ids: list):
+        usados = set(await db.notas_fiscais.distinct("xml_hash", {"xml_hash": {"$in": ids}}))
+        orfaos = [i for i in ids if i not in usados]
+        if orfaos:
+            resultado = await db.xml_blobs.delete_many({"_id": {"$in": orfaos}, "ultimo_uso": {"$lt": limite}})
+            return resultado.deleted_count
+        return 0
+
+    bloco = []
+    async for blob in candidatos:
+        bloco.append(blob["_id"])
+        if len(bloco) >= TAMANHO_LOTE_MIGRACAO:
+            removidos += await remover(bloco)
+            bloco = []
+    if bloco:
+        removidos += await remover(bloco)
+    return removidos
+
+
+async def _main():
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Mantém a coleção xml_blobs")
+    parser.add_argument("--migrar", action="store_true", help="Move o xml_original das notas antigas para xml_blobs")
+    parser.add_argument("--limpar-orfaos", action="store_true", help="Remove XMLs sem nota")
+    parser.add_argument("--carencia-horas", type=float, default=24)
+    args = parser.parse_args()
+
+    if not args.migrar and not args.limpar_orfaos:
+        parser.print_help()
+        return
+
+    client = AsyncIOMotorClient(os.getenv("MONGO_URL", "mongodb://localhost:27017"))
+    db = client.fiscal_facil
+    if args.migrar:
+        print(f"{await migrar(db)} notas migradas.")
+    if args.limpar_orfaos:
+        print(f"{await limpar_orfaos(db, args.carencia_horas)} XMLs órfãos removidos.")
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
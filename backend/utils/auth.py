@@ -1,3 +1,5 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
@@ -10,8 +12,23 @@ load_dotenv()
 SECRET_KEY = os.getenv("JWT_SECRET", "sua_chave_secreta_super_segura")
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+# Quando ativo, nome/email/telefone vão assinados no token e a API não consulta o usuário no banco a cada requisição
+TOKEN_COM_DADOS_USUARIO = os.getenv("TOKEN_COM_DADOS_USUARIO", "false").lower() == "true"
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Custo do bcrypt (log2 das iterações). Hashes com custo diferente são refeitos no próximo login.
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# Threads dedicadas ao bcrypt: limita quantos hashes rodam ao mesmo tempo sem ocupar o event loop
+HASH_WORKERS = int(os.getenv("HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+_executor_hash = ThreadPoolExecutor(max_workers=HASH_WORKERS, thread_name_prefix="bcrypt")
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
@@ -19,6 +36,25 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
 def get_password_hash(password: str) -> str:
     return pwd_context.hash(password)
 
+async def gerar_hash_senha(password: str) -> str:
+    """
+    get_password_hash fora do event loop (o bcrypt libera o GIL enquanto calcula).
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor_hash, get_password_hash, password)
+
+async def verificar_senha(plain_password: str, hashed_password: str):
+    """
+    Verifica a senha fora do event loop. Retorna (valida, novo_hash): novo_hash
+    vem preenchido quando o hash salvo usa um custo diferente de BCRYPT_ROUNDS
+    e deve ser regravado.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor_hash, pwd_context.verify_and_update, plain_password, hashed_password)
+
+def encerrar_executor_hash():
+    _executor_hash.shutdown(wait=False, cancel_futures=True)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -29,6 +65,16 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+def dados_token_usuario(usuario_id: str, usuario: dict):
+    dados = {"sub": usuario_id}
+    if TOKEN_COM_DADOS_USUARIO:
+        dados.update({
+            "nome": usuario.get("nome"),
+            "email": usuario.get("email"),
+            "telefone": usuario.get("telefone")
+        })
+    return dados
+
 def decode_token(token: str):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
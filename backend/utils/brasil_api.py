@@ -1,43 +1,281 @@
-import requests
-from fastapi import HTTPException
+import asyncio
+import os
+import time
 import logging
+import httpx
+from fastapi import HTTPException
+from dotenv import load_dotenv
+from utils.indice_cnpj import IndiceCNPJ
+
+load_dotenv()
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-def consultar_cnpj(cnpj: str):
-    cnpj_limpo = "".join([n for n in cnpj if n.isdigit()])
-    
-    try:
-        logger.info(f"Consultando CNPJ {cnpj_limpo} na BrasilAPI...")
-        url = f"https://brasilapi.com.br/api/cnpj/v1/{cnpj_limpo}"
-        response = requests.get(url, timeout=10)
-        
-        if response.status_code == 200:
-            dados = response.json()
-            cnae_principal = dados.get("cnae_fiscal_principal")
-            cnae_codigo = cnae_principal.get("codigo") if cnae_principal else None
-            
-            cnaes_sec = []
-            for c in dados.get("cnaes_secundarios", []):
-                if isinstance(c, dict):
-                    cnaes_sec.append(c.get("codigo", ""))
-            
-            return {
-                "cnpj": cnpj_limpo,
-                "razao_social": dados.get("razao_social"),
-                "nome_fantasia": dados.get("nome_fantasia"),
-                "logradouro": f"{dados.get('logradouro')}, {dados.get('numero')}",
-                "bairro": dados.get("bairro"),
-                "municipio": dados.get("municipio"),
-                "uf": dados.get("uf"),
-                "cnae_principal": cnae_codigo,
-                "cnaes_secundarios": cnaes_sec
-            }
-        else:
-            logger.warning(f"BrasilAPI retornou status {response.status_code}")
-            raise HTTPException(status_code=404, detail="CNPJ não encontrado")
-            
-    except requests.exceptions.RequestException as e:
-        logger.error(f"Erro ao consultar CNPJ: {str(e)}")
-        raise HTTPException(status_code=503, detail="Serviço de consulta indisponível")
\ No newline at end of file
+# URLs base dos provedores (configuráveis para apontar para um servidor local de testes)
+BRASILAPI_URL = os.getenv("BRASILAPI_URL", "https://brasilapi.com.br/api/cnpj/v1")
+RECEITAWS_URL = os.getenv("RECEITAWS_URL", "https://www.receitaws.com.br/v1/cnpj")
+# Timeout total de cada provedor, em segundos
+BRASILAPI_TIMEOUT = float(os.getenv("BRASILAPI_TIMEOUT", "5"))
+RECEITAWS_TIMEOUT = float(os.getenv("RECEITAWS_TIMEOUT", "10"))
+# Se o provedor anterior não respondeu nesse tempo, o próximo é acionado em paralelo
+CNPJ_HEDGE_MS = int(os.getenv("CNPJ_HEDGE_MS", "800"))
+# Falhas seguidas que abrem o circuito de um provedor, e por quanto tempo ele fica aberto
+CNPJ_CIRCUITO_FALHAS = int(os.getenv("CNPJ_CIRCUITO_FALHAS", "5"))
+CNPJ_CIRCUITO_SEGUNDOS = float(os.getenv("CNPJ_CIRCUITO_SEGUNDOS", "30"))
+CNPJ_MAX_CONEXOES = int(os.getenv("CNPJ_MAX_CONEXOES", "20"))
+# Consultas por segundo enviadas aos provedores (média) e rajada máxima permitida
+CNPJ_TAXA_POR_SEGUNDO = float(os.getenv("CNPJ_TAXA_POR_SEGUNDO", "3"))
+CNPJ_RAJADA = int(os.getenv("CNPJ_RAJADA", "5"))
+
+
+class CnpjNaoEncontrado(Exception):
+    """
+    Resposta definitiva do provedor: o CNPJ não existe. Não conta como falha no circuito.
+    """
+
+
+class Circuito:
+    """
+    Circuit breaker por provedor: depois de `limite_falhas` falhas seguidas o
+    provedor fica fora por `segundos_aberto`. Passado esse tempo, uma única
+    chamada de teste é liberada; se ela falhar, o circuito abre de novo.
+    """
+
+    def __init__(self, limite_falhas: int, segundos_aberto: float):
+        self.limite_falhas = limite_falhas
+        self.segundos_aberto = segundos_aberto
+        self.falhas = 0
+        self.aberto_ate = 0.0
+        self._em_teste = False
+
+    @property
+    def estado(self):
+        if self.falhas < self.limite_falhas:
+            return "FECHADO"
+        if time.monotonic() < self.aberto_ate:
+            return "ABERTO"
+        return "SEMIABERTO"
+
+    def permitir(self):
+        estado = self.estado
+        if estado == "FECHADO":
+            return True
+        if estado == "SEMIABERTO" and not self._em_teste:
+            self._em_teste = True
+            return True
+        return False
+
+    def registrar_sucesso(self):
+        self.falhas = 0
+        self._em_teste = False
+
+    def liberar_teste(self):
+        # Chamada de teste cancelada sem resposta (outro provedor respondeu antes)
+        self._em_teste = False
+
+    def registrar_falha(self):
+        self.falhas += 1
+        self._em_teste = False
+        if self.falhas >= self.limite_falhas:
+            self.aberto_ate = time.monotonic() + self.segundos_aberto
+
+
+def normalizar_brasilapi(cnpj_limpo: str, dados: dict):
+    cnae_principal = dados.get("cnae_fiscal_principal")
+    if isinstance(cnae_principal, dict):
+        cnae_codigo = cnae_principal.get("codigo")
+    else:
+        cnae_codigo = dados.get("cnae_fiscal")
+
+    cnaes_sec = []
+    for c in dados.get("cnaes_secundarios", []) or []:
+        if isinstance(c, dict) and c.get("codigo"):
+            cnaes_sec.append(str(c["codigo"]))
+
+    return {
+        "cnpj": cnpj_limpo,
+        "razao_social": dados.get("razao_social"),
+        "nome_fantasia": dados.get("nome_fantasia"),
+        "logradouro": f"{dados.get('logradouro')}, {dados.get('numero')}",
+        "bairro": dados.get("bairro"),
+        "municipio": dados.get("municipio"),
+        "uf": dados.get("uf"),
+        "cnae_principal": str(cnae_codigo) if cnae_codigo else None,
+        "cnaes_secundarios": cnaes_sec
+    }
+
+
+def normalizar_receitaws(cnpj_limpo: str, dados: dict):
+    if dados.get("status") == "ERROR":
+        raise CnpjNaoEncontrado(dados.get("message") or "CNPJ não encontrado")
+
+    # A ReceitaWS formata os CNAEs com pontos e traços
+    def limpar(codigo):
+        return (codigo or "").replace(".", "").replace("-", "")
+
+    atividades = dados.get("atividade_principal") or [{}]
+    return {
+        "cnpj": cnpj_limpo,
+        "razao_social": dados.get("nome"),
+        "nome_fantasia": dados.get("fantasia"),
+        "logradouro": f"{dados.get('logradouro')}, {dados.get('numero')}",
+        "bairro": dados.get("bairro"),
+        "municipio": dados.get("municipio"),
+        "uf": dados.get("uf"),
+        "cnae_principal": limpar(atividades[0].get("code")) or None,
+        "cnaes_secundarios": [limpar(c.get("code")) for c in dados.get("atividades_secundarias", [])]
+    }
+
+
+class BaldeTokens:
+    """
+    Token bucket: libera até `capacidade` chamadas de uma vez e repõe `taxa`
+    tokens por segundo. `adquirir` espera (sem bloquear o event loop) até
+    haver um token, na ordem de chegada.
+    """
+
+    def __init__(self, taxa: float, capacidade: int):
+        self.taxa = taxa
+        self.capacidade = capacidade
+        self.tokens = float(capacidade)
+        self.atualizado_em = time.monotonic()
+        self._trava = asyncio.Lock()
+
+    def _repor(self):
+        agora = time.monotonic()
+        self.tokens = min(self.capacidade, self.tokens + (agora - self.atualizado_em) * self.taxa)
+        self.atualizado_em = agora
+
+    async def adquirir(self):
+        async with self._trava:
+            self._repor()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.taxa)
+                self._repor()
+            self.tokens -= 1
+
+
+class Provedor:
+    def __init__(self, nome: str, url_base: str, timeout: float, normalizar):
+        self.nome = nome
+        self.url_base = url_base.rstrip("/")
+        self.timeout = timeout
+        self.normalizar = normalizar
+        self.circuito = Circuito(CNPJ_CIRCUITO_FALHAS, CNPJ_CIRCUITO_SEGUNDOS)
+
+
+class ClienteCNPJ:
+    """
+    Consulta de CNPJ assíncrona com pool de conexões compartilhado.
+
+    Os provedores são acionados em ordem de preferência: se o atual não
+    responder em `hedge_ms` (ou falhar antes disso), o próximo é disparado em
+    paralelo e vale a primeira resposta válida. "CNPJ não encontrado" é uma
+    resposta válida; erros, timeouts e status inesperados contam como falha
+    no circuito do provedor.
+    """
+
+    def __init__(self, provedores: list, hedge_ms: int = CNPJ_HEDGE_MS, max_conexoes: int = CNPJ_MAX_CONEXOES):
+        self.provedores = provedores
+        self.hedge_ms = hedge_ms
+        self.max_conexoes = max_conexoes
+        self._client = None
+
+    def _obter_client(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                limits=httpx.Limits(max_connections=self.max_conexoes, max_keepalive_connections=self.max_conexoes),
+                headers={"Accept": "application/json"},
+            )
+        return self._client
+
+    async def _consultar_provedor(self, provedor: Provedor, cnpj_limpo: str):
+        try:
+            response = await self._obter_client().get(f"{provedor.url_base}/{cnpj_limpo}", timeout=provedor.timeout)
+            if response.status_code == 404:
+                raise CnpjNaoEncontrado("CNPJ não encontrado")
+            response.raise_for_status()
+            resultado = provedor.normalizar(cnpj_limpo, response.json())
+        except CnpjNaoEncontrado:
+            provedor.circuito.registrar_sucesso()
+            raise
+        except asyncio.CancelledError:
+            provedor.circuito.liberar_teste()
+            raise
+        except Exception as e:
+            provedor.circuito.registrar_falha()
+            logger.warning(f"{provedor.nome} falhou para {cnpj_limpo}: {type(e).__name__} {str(e)}")
+            raise
+        provedor.circuito.registrar_sucesso()
+        return resultado
+
+    async def consultar(self, cnpj: str):
+        cnpj_limpo = "".join([n for n in cnpj if n.isdigit()])
+        # O circuito é consultado só na hora de acionar o provedor, para que a
+        # chamada de teste de um circuito semiaberto não seja reservada à toa
+        restantes = list(self.provedores)
+        pendentes = set()
+        try:
+            while True:
+                while restantes:
+                    provedor = restantes.pop(0)
+                    if provedor.circuito.permitir():
+                        logger.info(f"Consultando CNPJ {cnpj_limpo} em {provedor.nome}...")
+                        pendentes.add(asyncio.create_task(self._consultar_provedor(provedor, cnpj_limpo)))
+                        break
+
+                if not pendentes:
+                    raise HTTPException(status_code=503, detail="Serviço de consulta indisponível")
+
+                # Espera o hedge só se ainda houver provedor para acionar
+                espera = self.hedge_ms / 1000 if restantes else None
+                concluidas, pendentes = await asyncio.wait(pendentes, timeout=espera, return_when=asyncio.FIRST_COMPLETED)
+
+                for tarefa in concluidas:
+                    erro = tarefa.exception()
+                    if erro is None:
+                        return tarefa.result()
+                    if isinstance(erro, CnpjNaoEncontrado):
+                        raise HTTPException(status_code=404, detail="CNPJ não encontrado")
+        finally:
+            for tarefa in pendentes:
+                tarefa.cancel()
+
+    def estado(self):
+        return {p.nome: {"circuito": p.circuito.estado, "falhas": p.circuito.falhas} for p in self.provedores}
+
+    async def encerrar(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+# Dumps da Receita (python -m utils.indice_cnpj --importar); sem o arquivo, só os provedores são usados
+indice_cnpj = IndiceCNPJ()
+
+# Compartilhado por todas as consultas do processo (individuais e em lote)
+limitador_cnpj = BaldeTokens(CNPJ_TAXA_POR_SEGUNDO, CNPJ_RAJADA)
+
+cliente_cnpj = ClienteCNPJ([
+    Provedor("BrasilAPI", BRASILAPI_URL, BRASILAPI_TIMEOUT, normalizar_brasilapi),
+    Provedor("ReceitaWS", RECEITAWS_URL, RECEITAWS_TIMEOUT, normalizar_receitaws),
+])
+
+
+async def consultar_cnpj(cnpj: str):
+    """
+    Procura primeiro no índice offline; os provedores são a reserva para CNPJs
+    que não estão no último dump importado.
+    """
+    dados = indice_cnpj.buscar(cnpj)
+    if dados is not None:
+        return dados
+
+    await limitador_cnpj.adquirir()
+    return await cliente_cnpj.consultar(cnpj)
+
+
+async def encerrar_cliente_cnpj():
+    await cliente_cnpj.encerrar()
+    indice_cnpj.fechar()
@@ -0,0 +1,63 @@
+import time
+from collections import OrderedDict
+
+
+class CacheTTL:
+    """
+    Cache LRU em memória com expiração por item.
+
+    Pensado para o event loop (sem locks): cada processo da API tem o seu.
+    Guarda contadores de acertos/erros para monitoramento.
+    """
+
+    def __init__(self, tamanho_maximo: int, ttl_segundos: float):
+        self.tamanho_maximo = tamanho_maximo
+        self.ttl_segundos = ttl_segundos
+        self._itens = OrderedDict()
+        self.acertos = 0
+        self.erros = 0
+
+    def obter(self, chave, padrao=None):
+        item = self._itens.get(chave)
+        if item is None:
+            self.erros += 1
+            return padrao
+
+        valor, expira_em = item
+        if expira_em < time.monotonic():
+            del self._itens[chave]
+            self.erros += 1
+            return padrao
+
+        self._itens.move_to_end(chave)
+        self.acertos += 1
+        return valor
+
+    def definir(self, chave, valor, ttl_segundos: float = None):
+        ttl = self.ttl_segundos if ttl_segundos is None else ttl_segundos
+        self._itens[chave] = (valor, time.monotonic() + ttl)
+        self._itens.move_to_end(chave)
+        while len(self._itens) > self.tamanho_maximo:
+            self._itens.popitem(last=False)
+
+    def invalidar(self, chave):
+        self._itens.pop(chave, None)
+
+    def invalidar_se(self, condicao):
+        """
+        Remove os itens para os quais `condicao(chave, valor)` é verdadeira.
+        """
+        for chave in [c for c, (valor, _) in self._itens.items() if condicao(c, valor)]:
+            del self._itens[chave]
+
+    def limpar(self):
+        self._itens.clear()
+
+    def estatisticas(self):
+        total = self.acertos + self.erros
+        return {
+            "itens": len(self._itens),
+            "acertos": self.acertos,
+            "erros": self.erros,
+            "taxa_acerto": round(self.acertos / total, 4) if total else 0.0,
+        }
@@ -0,0 +1,108 @@
+import asyncio
+import os
+import logging
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from dotenv import load_dotenv
+from utils.cache import CacheTTL
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Validade de uma consulta bem-sucedida no banco (coleção cache_cnpj, com índice TTL)
+CNPJ_CACHE_DIAS = int(os.getenv("CNPJ_CACHE_DIAS", "30"))
+# Validade de um "CNPJ não encontrado"; curta para não esconder empresas recém-abertas
+CNPJ_CACHE_NEGATIVO_SEGUNDOS = int(os.getenv("CNPJ_CACHE_NEGATIVO_SEGUNDOS", "600"))
+# Camada em memória (por processo) na frente do banco
+CNPJ_CACHE_MEMORIA_SEGUNDOS = int(os.getenv("CNPJ_CACHE_MEMORIA_SEGUNDOS", "300"))
+CNPJ_CACHE_MEMORIA_TAMANHO = int(os.getenv("CNPJ_CACHE_MEMORIA_TAMANHO", "5000"))
+
+
+class CacheCNPJ:
+    """
+    Cache de duas camadas para a consulta de CNPJ: LRU em memória na frente da
+    coleção `cache_cnpj` (expiração pelo índice TTL em `expira_em`).
+
+    Consultas simultâneas do mesmo CNPJ compartilham uma única ida ao banco e
+    aos provedores (single-flight). "Não encontrado" também é guardado, por
+    pouco tempo; indisponibilidade dos provedores não é guardada.
+
+    `consultar_upstream(cnpj)` é a consulta aos provedores: devolve os dados ou
+    levanta HTTPException (404 para CNPJ inexistente).
+    """
+
+    def __init__(self, db, consultar_upstream):
+        self.db = db
+        self.consultar_upstream = consultar_upstream
+        self.memoria = CacheTTL(CNPJ_CACHE_MEMORIA_TAMANHO, CNPJ_CACHE_MEMORIA_SEGUNDOS)
+        self._em_andamento = {}
+
+    async def consultar(self, cnpj: str, atualizar: bool = False):
+        """
+        Dados do CNPJ. Com `atualizar=True` ignora as duas camadas e consulta os provedores.
+        """
+        cnpj_limpo = "".join([n for n in cnpj if n.isdigit()])
+
+        if not atualizar:
+            item = self.memoria.obter(cnpj_limpo)
+            if item is not None:
+                return self._resposta(item)
+
+        # Uma atualização forçada não aproveita uma consulta comum em andamento,
+        # que devolveria a cópia do banco em vez dos dados dos provedores
+        chave = (cnpj_limpo, atualizar)
+        tarefa = self._em_andamento.get(chave)
+        if tarefa is None:
+            tarefa = asyncio.ensure_future(self._carregar(cnpj_limpo, atualizar))
+            self._em_andamento[chave] = tarefa
+            tarefa.add_done_callback(lambda _: self._em_andamento.pop(chave, None))
+
+        # shield: uma requisição cancelada não cancela a consulta das outras que esperam por ela
+        item = await asyncio.shield(tarefa)
+        return self._resposta(item)
+
+    def _resposta(self, item: dict):
+        if not item["encontrado"]:
+            raise HTTPException(status_code=404, detail="CNPJ não encontrado")
+        return dict(item["dados"])
+
+    async def _carregar(self, cnpj_limpo: str, atualizar: bool):
+        agora = datetime.utcnow()
+
+        if not atualizar:
+            try:
+                doc = await self.db.cache_cnpj.find_one({"_id": cnpj_limpo, "expira_em": {"$gt": agora}})
+            except Exception as e:
+                logger.warning(f"Falha ao ler cache de CNPJ: {str(e)}")
+                doc = None
+            if doc:
+                item = {"encontrado": doc["encontrado"], "dados": doc.get("dados")}
+                restante = (doc["expira_em"] - agora).total_seconds()
+                self.memoria.definir(cnpj_limpo, item, min(restante, CNPJ_CACHE_MEMORIA_SEGUNDOS))
+                return item
+
+        try:
+            item = {"encontrado": True, "dados": await self.consultar_upstream(cnpj_limpo)}
+            validade = timedelta(days=CNPJ_CACHE_DIAS)
+        except HTTPException as e:
+            if e.status_code != 404:
+                raise
+            item = {"encontrado": False, "dados": None}
+            validade = timedelta(seconds=CNPJ_CACHE_NEGATIVO_SEGUNDOS)
+
+        try:
+            await self.db.cache_cnpj.update_one(
+                {"_id": cnpj_limpo},
+                {"$set": {**item, "atualizado_em": agora, "expira_em": agora + validade}},
+                upsert=True
+            )
+        except Exception as e:
+            logger.warning(f"Falha ao gravar cache de CNPJ: {str(e)}")
+
+        self.memoria.definir(cnpj_limpo, item, min(validade.total_seconds(), CNPJ_CACHE_MEMORIA_SEGUNDOS))
+        return item
+
+    def estatisticas(self):
+        return {**self.memoria.estatisticas(), "em_andamento": len(self._em_andamento)}
@@ -0,0 +1,286 @@
+"""
+Tipos da data de emissão e do valor das notas, e a impressão digital usada
+para detectar reimportações.
+
+`data_emissao` é gravada como data do BSON (datetime) e o valor como centavos
+inteiros em `valor_centavos`, para os filtros por período usarem o índice e as
+somas serem exatas. Notas gravadas antes disso têm `data_emissao` em texto ISO
+e `valor_total` em float; as funções abaixo aceitam os dois formatos, e a API
+continua respondendo `data_emissao` em texto ISO e `valor_total` em reais.
+
+Notas gravadas antes da detecção de reimportação não têm `impressao_digital`
+e ficam fora do índice único; a migração também calcula a delas.
+
+Migração das notas antigas, em lotes e com a API no ar (a partir da pasta backend):
+
+    python -m utils.campos_nota --migrar
+"""
+import argparse
+import asyncio
+import hashlib
+import os
+import logging
+from datetime import datetime
+from decimal import Decimal, ROUND_HALF_UP
+from pymongo import UpdateOne
+from pymongo.errors import BulkWriteError
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+TAMANHO_LOTE_MIGRACAO = int(os.getenv("TAMANHO_LOTE_MIGRACAO", "500"))
+
+# Centavos de uma nota dentro de agregações (notas antigas: float em reais).
+# Mesmo arredondamento de para_centavos: o double vira decimal (15 dígitos, como
+# str() do float), soma ±0,5 conforme o sinal e $toLong trunca em direção ao zero
+EXPRESSAO_CENTAVOS = {"$ifNull": [
+    "$valor_centavos",
+    {"$let": {
+        "vars": {"centavos": {"$multiply": [{"$toDecimal": {"$ifNull": ["$valor_total", 0]}}, 100]}},
+        "in": {"$toLong": {"$add": [
+            "$$centavos", {"$cond": [{"$lt": ["$$centavos", 0]}, -0.5, 0.5]}
+        ]}}
+    }}
+]}
+
+
+def para_centavos(valor):
+    """
+    Centavos inteiros de um valor em reais (str, Decimal, float ou int).
+    """
+    if valor is None or valor == "":
+        return 0
+    # str() de um float devolve a representação decimal mais curta (ex.: 0.29, não 0.28999...)
+    reais = Decimal(str(valor)).quantize(Decimal("0.01"), rounding=ROUND_HALF_UP)
+    return int(reais * 100)
+
+
+def para_reais(centavos: int):
+    return centavos / 100
+
+
+def centavos_nota(nota: dict):
+    if nota.get("valor_centavos") is not None:
+        return nota["valor_centavos"]
+    return para_centavos(nota.get("valor_total"))
+
+
+def valor_nota(nota: dict):
+    """
+    valor_total em reais, como a API sempre respondeu.
+    """
+    return para_reais(centavos_nota(nota))
+
+
+def para_data(valor):
+    """
+    datetime da data de emissão (gravada como datetime ou texto "YYYY-MM-DD...").
+    """
+    if valor is None or isinstance(valor, datetime):
+        return valor
+    return datetime.strptime(str(valor)[:10], "%Y-%m-%d")
+
+
+def data_texto(valor):
+    """
+    data_emissao no formato da API ("YYYY-MM-DDT00:00:00").
+    """
+    if isinstance(valor, datetime):
+        return valor.isoformat()
+    return valor
+
+
+def filtro_periodo(inicio: datetime = None, fim: datetime = None):
+    """
+    Condição de data_emissao em [inicio, fim). Notas ainda não migradas
+    (texto ISO) só casam com a comparação em texto, então as duas entram no $or.
+    """
+    datas = {}
+    textos = {}
+    if inicio:
+        datas["$gte"], textos["$gte"] = inicio, inicio.isoformat()
+    if fim:
+        datas["$lt"], textos["$lt"] = fim, fim.isoformat()
+    if not datas:
+        return {}
+    return {"$or": [{"data_emissao": datas}, {"data_emissao": textos}]}
+
+
+def impressao_digital(empresa_id: str, chave_validacao, numero_nota, hash_xml: str):
+    """
+    Identifica uma nota dentro da empresa para detectar reimportações: usa a
+    chave de validação quando existe e, sem ela, número da nota + SHA-256 do
+    arquivo (`hash_xml`).
+    """
+    if chave_validacao:
+        base = f"{empresa_id}|chave|{chave_validacao}"
+    else:
+        base = f"{empresa_id}|{numero_nota}|{hash_xml}"
+    return hashlib.sha256(base.encode()).hexdigest()
+
+
+def impressao_nota_gravada(nota: dict):
+    """
+    impressao_digital de uma nota já gravada (None se faltar o XML e a chave).
+    O hash do arquivo é o xml_hash; notas com o XML ainda em xml_original usam
+    o texto em UTF-8, o mesmo que utils.armazem_xml grava na migração.
+    """
+    chave = nota.get("chave_validacao")
+    if chave:
+        return impressao_digital(nota["empresa_id"], chave, None, None)
+    if nota.get("xml_hash"):
+        hash_xml = nota["xml_hash"]
+    elif nota.get("xml_original"):
+        hash_xml = hashlib.sha256(nota["xml_original"].encode("utf-8")).hexdigest()
+    else:
+        return None
+    return impressao_digital(nota["empresa_id"], None, nota.get("numero_nota"), hash_xml)
+
+
+async def preencher_impressoes(db):
+    """
+    Calcula a impressao_digital das notas gravadas sem ela, em lotes. Se a
+    mesma nota foi importada mais de uma vez antes da detecção, só a primeira
+    (menor _id) recebe a impressão; as outras ficam sem e são contadas em
+    "repetidas" (o índice único não aceitaria). Pode ser interrompida e
+    executada de novo. Retorna {"preenchidas", "repetidas", "sem_dados"}.
+    """
+    totais = {"preenchidas": 0, "repetidas": 0, "sem_dados": 0}
+    filtro = {"impressao_digital": {"$exists": False}}
+    ultimo_id = None
+    while True:
+        filtro_lote = {**filtro, "_id": {"$gt": ultimo_id}} if ultimo_id else filtro
+        notas = await db.notas_fiscais.find(
+            filtro_lote,
+            {"empresa_id": 1, "numero_nota": 1, "chave_validacao": 1, "xml_hash": 1, "xml_original": 1}
+        ).sort("_id", 1).limit(TAMANHO_LOTE_MIGRACAO).to_list(TAMANHO_LOTE_MIGRACAO)
+        if not notas:
+            break
+        ultimo_id = notas[-1]["_id"]
+
+        # impressão -> _id da primeira nota do lote com ela
+        calculadas = {}
+        for nota in notas:
+            impressao = impressao_nota_gravada(nota)
+            if impressao is None:
+                totais["sem_dados"] += 1
+            elif impressao in calculadas:
+                totais["repetidas"] += 1
+            else:
+                calculadas[impressao] = nota["_id"]
+
+        async for existente in db.notas_fiscais.find(
+            {"impressao_digital": {"$in": list(calculadas)}}, {"impressao_digital": 1, "_id": 0}
+        ):
+            calculadas.pop(existente["impressao_digital"], None)
+            totais["repetidas"] += 1
+
+        operacoes = [
+            UpdateOne({"_id": nota_id, "impressao_digital": {"$exists": False}}, {"$set": {"impressao_digital": impressao}})
+            for impressao, nota_id in calculadas.items()
+        ]
+        if operacoes:
+            try:
+                resultado = await db.notas_fiscais.bulk_write(operacoes, ordered=False)
+                totais["preenchidas"] += resultado.modified_count
+            except BulkWriteError as e:
+                # Importada de novo entre a consulta e o update: o índice único recusa
+                erros = e.details.get("writeErrors", [])
+                if any(erro.get("code") != 11000 for erro in erros):
+                    raise
+                totais["repetidas"] += len(erros)
+                totais["preenchidas"] += e.details.get("nModified", 0)
+        logger.info(f"Impressões digitais: {totais}")
+
+    return totais
+
+
+def campos_migrados(nota: dict):
+    """
+    $set/$unset que levam uma nota antiga para os tipos novos (None se já migrada).
+    """
+    definir = {}
+    remover = {}
+    if isinstance(nota.get("data_emissao"), str):
+        definir["data_emissao"] = para_data(nota["data_emissao"])
+    if "valor_total" in nota:
+        if nota.get("valor_centavos") is None:
+            definir["valor_centavos"] = para_centavos(nota["valor_total"])
+        remover["valor_total"] = ""
+    if not definir and not remover:
+        return None
+    atualizacao = {}
+    if definir:
+        atualizacao["$set"] = definir
+    if remover:
+        atualizacao["$unset"] = remover
+    return atualizacao
+
+
+async def migrar(db):
+    """
+    Converte as notas antigas em lotes, depois os resumos mensais antigos
+    para centavos, e por fim preenche a impressão digital das notas sem ela
+    (preencher_impressoes). A conversão de cada nota é idempotente e a API aceita os
+    dois formatos, então a migração roda com a API no ar e pode ser
+    interrompida e executada de novo. O resumo não é reconstruído: mês e
+    centavos de uma nota não mudam com a conversão, e só o `valor_total` dos
+    resumos é convertido, com updates atômicos (resumo_mensal.converter_centavos).
+    Retorna a quantidade de notas convertidas.
+    """
+    from utils import resumo_mensal
+
+    filtro = {"$or": [{"data_emissao": {"$type": "string"}}, {"valor_total": {"$exists": True}}]}
+    total = 0
+    ultimo_id = None
+    while True:
+        filtro_lote = {"$and": [filtro, {"_id": {"$gt": ultimo_id}}]} if ultimo_id else filtro
+        notas = await db.notas_fiscais.find(
+            filtro_lote,
+            {"data_emissao": 1, "valor_total": 1, "valor_centavos": 1}
+        ).sort("_id", 1).limit(TAMANHO_LOTE_MIGRACAO).to_list(TAMANHO_LOTE_MIGRACAO)
+        if not notas:
+            break
+        ultimo_id = notas[-1]["_id"]
+
+        operacoes = []
+        for nota in notas:
+            atualizacao = campos_migrados(nota)
+            if atualizacao:
+                operacoes.append(UpdateOne({"_id": nota["_id"]}, atualizacao))
+        if operacoes:
+            resultado = await db.notas_fiscais.bulk_write(operacoes, ordered=False)
+            total += resultado.modified_count
+        logger.info(f"{total} notas convertidas")
+
+    convertidos = await resumo_mensal.converter_centavos(db)
+    logger.info(f"{convertidos} resumos mensais convertidos para centavos")
+
+    impressoes = await preencher_impressoes(db)
+    if impressoes["repetidas"]:
+        logger.warning(f"{impressoes['repetidas']} notas antigas repetem outra já gravada e ficaram sem impressão digital")
+    return total
+
+
+async def _main():
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Converte data_emissao e valor das notas antigas")
+    parser.add_argument("--migrar", action="store_true", help="Converte as notas e os resumos mensais e preenche as impressões digitais")
+    args = parser.parse_args()
+
+    if not args.migrar:
+        parser.print_help()
+        return
+
+    client = AsyncIOMotorClient(os.getenv("MONGO_URL", "mongodb://localhost:27017"))
+    total = await migrar(client.fiscal_facil)
+    print(f"{total} notas convertidas.")
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
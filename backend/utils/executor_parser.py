@@ -0,0 +1,26 @@
+import os
+from dotenv import load_dotenv
+from utils.armazem_xml import ler_e_compactar
+from utils.pool_execucao import PoolExecucao
+
+load_dotenv()
+
+# "process" (padrão) usa todos os núcleos; "thread" serve para ambientes sem fork/multiprocessing
+PARSER_EXECUTOR = os.getenv("PARSER_EXECUTOR", "process").lower()
+PARSER_WORKERS = int(os.getenv("PARSER_WORKERS", str(os.cpu_count() or 2)))
+# Máximo de parses em andamento ao mesmo tempo (por processo da API)
+PARSER_MAX_CONCORRENCIA = int(os.getenv("PARSER_MAX_CONCORRENCIA", str(PARSER_WORKERS * 2)))
+
+pool_parser = PoolExecucao("parser-xml", PARSER_EXECUTOR, PARSER_WORKERS, PARSER_MAX_CONCORRENCIA)
+
+async def executar_no_pool(funcao, *args):
+    """
+    Executa `funcao(*args)` no pool de parsing sem bloquear o event loop.
+    """
+    return await pool_parser.executar(funcao, *args)
+
+async def ler_xml_notas_async(conteudo_arquivo: bytes):
+    return await executar_no_pool(ler_e_compactar, conteudo_arquivo)
+
+def encerrar_executor():
+    pool_parser.encerrar()
@@ -0,0 +1,373 @@
+import asyncio
+import json
+import os
+import socket
+import uuid
+import logging
+from datetime import datetime, timedelta
+from bson import ObjectId, Binary
+from pymongo import UpdateOne, ReturnDocument
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Quantidade de workers (tasks asyncio) consumindo a fila neste processo
+IMPORT_WORKERS = int(os.getenv("IMPORT_WORKERS", "2"))
+# Arquivos processados por rodada de um job (um insert_many por rodada)
+IMPORT_LOTE_JOB = int(os.getenv("IMPORT_LOTE_JOB", "200"))
+# Tempo sem renovação após o qual um job em processamento é considerado abandonado (ex.: restart)
+IMPORT_LEASE_SEGUNDOS = int(os.getenv("IMPORT_LEASE_SEGUNDOS", "60"))
+IMPORT_POLL_SEGUNDOS = float(os.getenv("IMPORT_POLL_SEGUNDOS", "1"))
+# Upload (status RECEBENDO) sem novos arquivos há esse tempo é dado como abandonado e removido
+IMPORT_RECEBENDO_SEGUNDOS = int(os.getenv("IMPORT_RECEBENDO_SEGUNDOS", "900"))
+
+# Status do job
+RECEBENDO = "RECEBENDO"      # upload ainda em andamento, workers não pegam
+PENDENTE = "PENDENTE"
+PROCESSANDO = "PROCESSANDO"
+CONCLUIDO = "CONCLUIDO"
+FALHOU = "FALHOU"
+
+# Status de cada arquivo do job
+ARQUIVO_PENDENTE = "PENDENTE"
+ARQUIVO_OK = "OK"
+ARQUIVO_FALHA = "FALHA"
+
+
+def formatar_job(job: dict):
+    return {
+        "id": str(job["_id"]),
+        "empresa_id": job["empresa_id"],
+        "status": job["status"],
+        "total_arquivos": job.get("total_arquivos", 0),
+        "processados": job.get("processados", 0),
+        "sucesso": job.get("sucesso", 0),
+        "falhas": job.get("falhas", 0),
+        "erro": job.get("erro"),
+        "data_criacao": job.get("data_criacao"),
+        "data_conclusao": job.get("data_conclusao"),
+    }
+
+
+class FilaImportacao:
+    """
+    Fila de importação persistida no MongoDB.
+
+    - `import_jobs` guarda o estado e os contadores de cada job;
+    - `import_job_arquivos` guarda os XMLs recebidos, um documento por arquivo.
+
+    Os workers reivindicam um job com find_one_and_update, gravando em `worker`
+    um identificador único da reivindicação, e mantêm o lease renovado por um
+    heartbeat enquanto a rodada roda. Toda atualização do job filtra por esse
+    `worker`: se o processo cair, o lease expira, outro worker (ou o mesmo
+    processo após o restart) retoma o job a partir dos arquivos que ainda
+    estão PENDENTES, e o dono antigo não altera mais o job.
+
+    Uploads interrompidos (job em RECEBENDO sem arquivos novos há
+    IMPORT_RECEBENDO_SEGUNDOS) são marcados como FALHOU e têm os arquivos removidos.
+
+    `processar_lote(job, arquivos)` é fornecido pela API: recebe os documentos
+    de arquivo de uma rodada e devolve, na mesma ordem, um resultado por arquivo
+    no formato de `processar_xml_nota` (sucesso/erro/nota).
+    """
+
+    def __init__(self, db, processar_lote):
+        self.db = db
+        self.processar_lote = processar_lote
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._tarefas = []
+        self._parar = asyncio.Event()
+
+    # ---------- Criação ----------
+    async def criar_job(self, empresa_id: str, usuario_id: str):
+        job = {
+            "empresa_id": empresa_id,
+            "usuario_id": usuario_id,
+            "status": RECEBENDO,
+            "total_arquivos": 0,
+            "processados": 0,
+            "sucesso": 0,
+            "falhas": 0,
+            "rodadas": 0,
+            "data_criacao": datetime.utcnow().isoformat(),
+            "ultimo_recebimento": datetime.utcnow().isoformat(),
+        }
+        result = await self.db.import_jobs.insert_one(job)
+        return str(result.inserted_id)
+
+    async def adicionar_arquivos(self, job_id: str, arquivos: list, seq_inicial: int):
+        """
+        Grava um bloco de ArquivoRecebido. Arquivos recusados no upload
+        (ex.: tamanho) já entram como FALHA.
+        """
+        if not arquivos:
+            return
+        documentos = []
+        falhas = 0
+        for seq, arquivo in enumerate(arquivos, seq_inicial):
+            doc = {
+                "job_id": job_id,
+                "seq": seq,
+                "nome_arquivo": arquivo.nome_arquivo,
+                "status": ARQUIVO_PENDENTE,
+            }
+            if arquivo.erro:
+                doc["status"] = ARQUIVO_FALHA
+                doc["erro"] = arquivo.erro
+                doc["rodada"] = 0
+                falhas += 1
+            else:
+                doc["conteudo"] = Binary(arquivo.conteudo)
+            documentos.append(doc)
+
+        await self.db.import_job_arquivos.insert_many(documentos, ordered=False)
+        resultado = await self.db.import_jobs.update_one(
+            {"_id": ObjectId(job_id), "status": RECEBENDO},
+            {"$inc": {"total_arquivos": len(documentos), "processados": falhas, "falhas": falhas},
+             "$set": {"ultimo_recebimento": datetime.utcnow().isoformat()}}
+        )
+        if resultado.matched_count == 0:
+            # Dado como abandonado pela varredura enquanto o upload ainda chegava
+            await self.db.import_job_arquivos.delete_many({"job_id": job_id})
+            raise Exception("Upload cancelado por inatividade")
+
+    async def liberar_job(self, job_id: str):
+        """
+        Fim do upload: o job passa a ser visível para os workers.
+        """
+        await self.db.import_jobs.update_one(
+            {"_id": ObjectId(job_id), "status": RECEBENDO},
+            {"$set": {"status": PENDENTE}}
+        )
+
+    async def cancelar_recebimento(self, job_id: str, erro: str):
+        await self.db.import_jobs.update_one(
+            {"_id": ObjectId(job_id)},
+            {"$set": {"status": FALHOU, "erro": erro, "data_conclusao": datetime.utcnow().isoformat()}}
+        )
+        await self.db.import_job_arquivos.delete_many({"job_id": job_id})
+
+    async def limpar_recebimentos_abandonados(self):
+        """
+        Falha os jobs em RECEBENDO cujo upload parou (ex.: a API caiu no meio do
+        envio) e remove os arquivos deles. Retorna a quantidade de jobs.
+        """
+        limite = (datetime.utcnow() - timedelta(seconds=IMPORT_RECEBENDO_SEGUNDOS)).isoformat()
+        total = 0
+        while True:
+            # Um job por vez com find_one_and_update: vários processos podem varrer ao mesmo tempo
+            job = await self.db.import_jobs.find_one_and_update(
+                {"status": RECEBENDO, "$or": [
+                    {"ultimo_recebimento": {"$lt": limite}},
+                    {"ultimo_recebimento": {"$exists": False}, "data_criacao": {"$lt": limite}},
+                ]},
+                {"$set": {"status": FALHOU, "erro": "Upload interrompido antes do fim",
+                          "data_conclusao": datetime.utcnow().isoformat()}},
+                projection={"_id": 1}
+            )
+            if job is None:
+                return total
+            await self.db.import_job_arquivos.delete_many({"job_id": str(job["_id"])})
+            logger.warning(f"Job de importação {job['_id']} removido: upload interrompido")
+            total += 1
+
+    # ---------- Workers ----------
+    def iniciar(self):
+        self._parar.clear()
+        for n in range(IMPORT_WORKERS):
+            self._tarefas.append(asyncio.create_task(self._worker(n)))
+        self._tarefas.append(asyncio.create_task(self._varredura()))
+        logger.info(f"Fila de importação iniciada com {IMPORT_WORKERS} workers ({self.worker_id})")
+
+    async def encerrar(self):
+        self._parar.set()
+        for tarefa in self._tarefas:
+            tarefa.cancel()
+        await asyncio.gather(*self._tarefas, return_exceptions=True)
+        self._tarefas = []
+
+    async def _worker(self, n: int):
+        while not self._parar.is_set():
+            try:
+                job = await self._reivindicar_job()
+                if job is None:
+                    await asyncio.sleep(IMPORT_POLL_SEGUNDOS)
+                    continue
+                await self._executar_job(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Worker de importação {n} falhou: {str(e)}")
+                await asyncio.sleep(IMPORT_POLL_SEGUNDOS)
+
+    async def _varredura(self):
+        while not self._parar.is_set():
+            try:
+                await self.limpar_recebimentos_abandonados()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Falha ao limpar uploads abandonados: {str(e)}")
+            await asyncio.sleep(max(IMPORT_RECEBENDO_SEGUNDOS / 4, IMPORT_POLL_SEGUNDOS))
+
+    def _novo_lease(self):
+        return (datetime.utcnow() + timedelta(seconds=IMPORT_LEASE_SEGUNDOS)).isoformat()
+
+    async def _reivindicar_job(self):
+        agora = datetime.utcnow().isoformat()
+        # Único por reivindicação: distingue também duas tasks do mesmo processo
+        dono = f"{self.worker_id}:{uuid.uuid4().hex[:12]}"
+        return await self.db.import_jobs.find_one_and_update(
+            {"$or": [
+                {"status": PENDENTE},
+                # Job abandonado por um worker que parou (restart/crash)
+                {"status": PROCESSANDO, "lease_ate": {"$lt": agora}},
+            ]},
+            {"$set": {"status": PROCESSANDO, "worker": dono, "lease_ate": self._novo_lease()}},
+            sort=[("data_criacao", 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _renovar_lease(self, job: dict):
+        """
+        Renova o lease se o job ainda for deste worker. Retorna False se outro worker o assumiu.
+        """
+        resultado = await self.db.import_jobs.update_one(
+            {"_id": job["_id"], "worker": job["worker"]},
+            {"$set": {"lease_ate": self._novo_lease()}}
+        )
+        return resultado.matched_count == 1
+
+    async def _heartbeat(self, job: dict, perdido: asyncio.Event):
+        # Renova bem antes de expirar; uma rodada lenta não libera o job para outro worker
+        while True:
+            await asyncio.sleep(IMPORT_LEASE_SEGUNDOS / 3)
+            if not await self._renovar_lease(job):
+                perdido.set()
+                return
+
+    async def _processar_rodada(self, job: dict, arquivos: list):
+        """
+        processar_lote com o lease renovado em paralelo. Retorna None se o job
+        deixou de ser deste worker durante a rodada.
+        """
+        perdido = asyncio.Event()
+        heartbeat = asyncio.create_task(self._heartbeat(job, perdido))
+        try:
+            resultados = await self.processar_lote(job, arquivos)
+        finally:
+            heartbeat.cancel()
+            await asyncio.gather(heartbeat, return_exceptions=True)
+        if perdido.is_set() or not await self._renovar_lease(job):
+            return None
+        return resultados
+
+    async def _executar_job(self, job: dict):
+        job_id = str(job["_id"])
+        logger.info(f"Processando job de importação {job_id}")
+
+        while not self._parar.is_set():
+            arquivos = await self.db.import_job_arquivos.find(
+                {"job_id": job_id, "status": ARQUIVO_PENDENTE}
+            ).sort("seq", 1).limit(IMPORT_LOTE_JOB).to_list(IMPORT_LOTE_JOB)
+
+            if not arquivos:
+                await self.db.import_jobs.update_one(
+                    {"_id": job["_id"], "worker": job["worker"]},
+                    {"$set": {"status": CONCLUIDO, "data_conclusao": datetime.utcnow().isoformat()},
+                     "$unset": {"lease_ate": ""}}
+                )
+                logger.info(f"Job de importação {job_id} concluído")
+                return
+
+            try:
+                resultados = await self._processar_rodada(job, arquivos)
+            except Exception as e:
+                logger.error(f"Job de importação {job_id} falhou: {str(e)}")
+                await self.db.import_jobs.update_one(
+                    {"_id": job["_id"], "worker": job["worker"]},
+                    {"$set": {"status": FALHOU, "erro": str(e), "data_conclusao": datetime.utcnow().isoformat()},
+                     "$unset": {"lease_ate": ""}}
+                )
+                return
+
+            if resultados is None or not await self._registrar_resultados(job, arquivos, resultados):
+                logger.warning(f"Job de importação {job_id} assumido por outro worker; rodada descartada")
+                return
+
+    async def _registrar_resultados(self, job: dict, arquivos: list, resultados: list):
+        """
+        Grava o resultado da rodada. Retorna False (sem contar a rodada) se o job não é mais deste worker.
+        """
+        # Os arquivos são marcados com o número da rodada antes de o job ser
+        # incrementado, assim quem lê `rodadas` do job encontra todos os arquivos dela
+        rodada = job.get("rodadas", 0) + 1
+        operacoes = []
+        sucesso = 0
+        for arquivo, resultado in zip(arquivos, resultados):
+            if resultado["sucesso"]:
+                sucesso += 1
+                novo = {"status": ARQUIVO_OK, "nota_id": resultado["nota"]["id"]}
+            else:
+                novo = {"status": ARQUIVO_FALHA, "erro": resultado["erro"], "rodada": rodada}
+            # O conteúdo não é mais necessário depois de processado
+            # Só arquivos ainda pendentes: um worker que assumiu o job não é sobrescrito
+            operacoes.append(UpdateOne(
+                {"_id": arquivo["_id"], "status": ARQUIVO_PENDENTE},
+                {"$set": novo, "$unset": {"conteudo": ""}}
+            ))
+
+        await self.db.import_job_arquivos.bulk_write(operacoes, ordered=False)
+        resultado = await self.db.import_jobs.update_one(
+            {"_id": job["_id"], "worker": job["worker"]},
+            {"$inc": {"processados": len(arquivos), "sucesso": sucesso, "falhas": len(arquivos) - sucesso},
+             "$set": {"lease_ate": self._novo_lease(), "rodadas": rodada}}
+        )
+        if resultado.matched_count == 0:
+            return False
+        job["rodadas"] = rodada
+        return True
+
+    # ---------- Acompanhamento ----------
+    async def eventos_sse(self, job_id: str, request=None):
+        """
+        Gera eventos Server-Sent Events com o progresso do job até ele terminar.
+        Cada evento `progresso` traz os contadores e as falhas novas desde o anterior.
+        """
+        ultima_rodada = -1
+        ultimo_estado = None
+
+        while True:
+            if request is not None and await request.is_disconnected():
+                return
+
+            job = await self.db.import_jobs.find_one({"_id": ObjectId(job_id)})
+            if not job:
+                return
+
+            # Só rodadas já fechadas no job, para não emitir uma rodada pela metade
+            rodada_atual = job.get("rodadas", 0)
+            novas_falhas = []
+            async for arquivo in self.db.import_job_arquivos.find(
+                {"job_id": job_id, "status": ARQUIVO_FALHA,
+                 "rodada": {"$gt": ultima_rodada, "$lte": rodada_atual}},
+                {"seq": 1, "nome_arquivo": 1, "erro": 1}
+            ).sort("seq", 1):
+                novas_falhas.append({"arquivo": arquivo["nome_arquivo"], "erro": arquivo.get("erro")})
+
+            ultima_rodada = rodada_atual
+
+            estado = formatar_job(job)
+            if estado != ultimo_estado or novas_falhas:
+                ultimo_estado = estado
+                dados = {**estado, "novas_falhas": novas_falhas}
+                yield f"event: progresso\ndata: {json.dumps(dados)}\n\n"
+
+            if job["status"] in (CONCLUIDO, FALHOU):
+                yield f"event: fim\ndata: {json.dumps(estado)}\n\n"
+                return
+
+            await asyncio.sleep(IMPORT_POLL_SEGUNDOS)
@@ -0,0 +1,304 @@
+"""
+Índice offline de CNPJs montado a partir dos dados abertos da Receita Federal.
+
+Os arquivos CSV públicos (Empresas*, Estabelecimentos*, Municipios; separador
+";", latin-1, sem cabeçalho, soltos ou dentro dos .zip como são distribuídos)
+são carregados em um SQLite somente leitura, com o CNPJ como chave primária.
+`consultar_cnpj` procura primeiro aqui e só vai à BrasilAPI/ReceitaWS quando
+o CNPJ não está no índice (ex.: empresa aberta depois do último dump).
+
+Uso (a partir da pasta backend):
+
+    python -m utils.indice_cnpj --importar /caminho/dos/dumps
+    python -m utils.indice_cnpj --gerar-exemplo /tmp/dump --quantidade 1000
+    python -m utils.indice_cnpj --consultar 11222333000181
+"""
+import argparse
+import csv
+import io
+import os
+import random
+import sqlite3
+import time
+import zipfile
+import logging
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+CNPJ_INDICE_PATH = os.getenv(
+    "CNPJ_INDICE_PATH",
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "dados", "cnpj.sqlite")
+)
+
+# Linhas inseridas por transação durante a importação
+LOTE_IMPORTACAO = 50000
+
+ESQUEMA = """
+CREATE TABLE empresas (
+    cnpj_basico TEXT PRIMARY KEY,
+    razao_social TEXT
+) WITHOUT ROWID;
+CREATE TABLE estabelecimentos (
+    cnpj TEXT PRIMARY KEY,
+    nome_fantasia TEXT,
+    situacao TEXT,
+    data_inicio TEXT,
+    cnae_principal TEXT,
+    cnaes_secundarios TEXT,
+    logradouro TEXT,
+    numero TEXT,
+    bairro TEXT,
+    uf TEXT,
+    municipio TEXT
+) WITHOUT ROWID;
+CREATE TABLE municipios (
+    codigo TEXT PRIMARY KEY,
+    nome TEXT
+) WITHOUT ROWID;
+"""
+
+
+# ---------- Consulta ----------
+class IndiceCNPJ:
+    """
+    Consulta ao índice. A conexão é aberta sob demanda e reaberta quando o
+    arquivo é substituído por uma nova importação. Sem arquivo, `buscar`
+    devolve None e a consulta segue para os provedores.
+    """
+
+    def __init__(self, caminho: str = CNPJ_INDICE_PATH):
+        self.caminho = caminho
+        self._conexao = None
+        self._versao = None
+
+    def _obter_conexao(self):
+        try:
+            versao = os.stat(self.caminho).st_mtime_ns
+        except FileNotFoundError:
+            self.fechar()
+            return None
+
+        if self._conexao is None or versao != self._versao:
+            self.fechar()
+            self._conexao = sqlite3.connect(f"file:{self.caminho}?mode=ro", uri=True, check_same_thread=False)
+            self._versao = versao
+        return self._conexao
+
+    @property
+    def disponivel(self):
+        return self._obter_conexao() is not None
+
+    def buscar(self, cnpj: str):
+        """
+        Dados do CNPJ no mesmo formato de `consultar_cnpj`, ou None se não estiver no índice.
+        """
+        cnpj_limpo = "".join([n for n in cnpj if n.isdigit()])
+        conexao = self._obter_conexao()
+        if conexao is None or len(cnpj_limpo) != 14:
+            return None
+
+        linha = conexao.execute(
+            """
+            SELECT emp.razao_social, est.nome_fantasia, est.logradouro, est.numero, est.bairro,
+                   COALESCE(mun.nome, est.municipio), est.uf, est.cnae_principal, est.cnaes_secundarios
+            FROM estabelecimentos est
+            LEFT JOIN empresas emp ON emp.cnpj_basico = substr(est.cnpj, 1, 8)
+            LEFT JOIN municipios mun ON mun.codigo = est.municipio
+            WHERE est.cnpj = ?
+            """,
+            (cnpj_limpo,)
+        ).fetchone()
+        if linha is None:
+            return None
+
+        razao_social, nome_fantasia, logradouro, numero, bairro, municipio, uf, cnae_principal, cnaes_sec = linha
+        return {
+            "cnpj": cnpj_limpo,
+            "razao_social": razao_social,
+            "nome_fantasia": nome_fantasia or None,
+            "logradouro": f"{logradouro}, {numero}",
+            "bairro": bairro,
+            "municipio": municipio,
+            "uf": uf,
+            "cnae_principal": cnae_principal or None,
+            "cnaes_secundarios": [c for c in (cnaes_sec or "").split(",") if c]
+        }
+
+    def fechar(self):
+        if self._conexao is not None:
+            self._conexao.close()
+            self._conexao = None
+            self._versao = None
+
+
+# ---------- Importação ----------
+def _abrir_csvs(diretorio: str, marcador: str):
+    """
+    Gera um csv.reader para cada arquivo do tipo `marcador` (EMPRE, ESTABELE,
+    MUNIC), esteja ele solto no diretório ou dentro de um .zip.
+    """
+    for nome in sorted(os.listdir(diretorio)):
+        caminho = os.path.join(diretorio, nome)
+        if not os.path.isfile(caminho) or marcador not in nome.upper():
+            continue
+        if nome.lower().endswith(".zip"):
+            with zipfile.ZipFile(caminho) as zf:
+                for interno in zf.namelist():
+                    with zf.open(interno) as bruto:
+                        yield csv.reader(io.TextIOWrapper(bruto, encoding="latin-1", newline=""), delimiter=";")
+        else:
+            with open(caminho, encoding="latin-1", newline="") as arquivo:
+                yield csv.reader(arquivo, delimiter=";")
+
+
+def _inserir_em_lotes(conexao, sql: str, linhas):
+    total = 0
+    lote = []
+    for linha in linhas:
+        lote.append(linha)
+        if len(lote) >= LOTE_IMPORTACAO:
+            conexao.executemany(sql, lote)
+            total += len(lote)
+            lote = []
+    if lote:
+        conexao.executemany(sql, lote)
+        total += len(lote)
+    conexao.commit()
+    return total
+
+
+def _linhas_empresas(diretorio):
+    for leitor in _abrir_csvs(diretorio, "EMPRE"):
+        for campos in leitor:
+            if len(campos) >= 2:
+                yield campos[0], campos[1]
+
+
+def _linhas_estabelecimentos(diretorio):
+    for leitor in _abrir_csvs(diretorio, "ESTABELE"):
+        for c in leitor:
+            if len(c) < 21:
+                continue
+            logradouro = f"{c[13]} {c[14]}".strip()
+            yield (c[0] + c[1] + c[2], c[4], c[5], c[10], c[11], c[12], logradouro, c[15], c[17], c[19], c[20])
+
+
+def _linhas_municipios(diretorio):
+    for leitor in _abrir_csvs(diretorio, "MUNIC"):
+        for campos in leitor:
+            if len(campos) >= 2:
+                yield campos[0], campos[1]
+
+
+def importar(diretorio: str, destino: str = CNPJ_INDICE_PATH):
+    """
+    Monta o índice a partir dos dumps em `diretorio`. O arquivo é gerado ao lado
+    do destino e só substitui o índice atual no final, então a API continua
+    consultando o índice antigo durante a importação.
+    """
+    os.makedirs(os.path.dirname(os.path.abspath(destino)), exist_ok=True)
+    temporario = f"{destino}.importando"
+    if os.path.exists(temporario):
+        os.remove(temporario)
+
+    conexao = sqlite3.connect(temporario)
+    # Arquivo descartável até o os.replace: dispensa journal e fsync
+    conexao.execute("PRAGMA journal_mode = OFF")
+    conexao.execute("PRAGMA synchronous = OFF")
+    conexao.executescript(ESQUEMA)
+
+    inicio = time.perf_counter()
+    totais = {
+        "empresas": _inserir_em_lotes(
+            conexao, "INSERT OR REPLACE INTO empresas VALUES (?, ?)", _linhas_empresas(diretorio)),
+        "estabelecimentos": _inserir_em_lotes(
+            conexao, "INSERT OR REPLACE INTO estabelecimentos VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            _linhas_estabelecimentos(diretorio)),
+        "municipios": _inserir_em_lotes(
+            conexao, "INSERT OR REPLACE INTO municipios VALUES (?, ?)", _linhas_municipios(diretorio)),
+    }
+    conexao.execute("VACUUM")
+    conexao.close()
+
+    os.replace(temporario, destino)
+    logger.info(f"Índice de CNPJ gravado em {destino} em {time.perf_counter() - inicio:.1f}s: {totais}")
+    return totais
+
+
+# ---------- Dump de exemplo ----------
+def _dv_cnpj(base12: str):
+    digitos = base12
+    for pesos in ([5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2], [6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]):
+        soma = sum(int(d) * p for d, p in zip(digitos, pesos))
+        resto = soma % 11
+        digitos += "0" if resto < 2 else str(11 - resto)
+    return digitos[12:]
+
+
+def gerar_exemplo(diretorio: str, quantidade: int = 1000, semente: int = 42):
+    """
+    Gera um dump pequeno no layout da Receita (testes e desenvolvimento offline).
+    Retorna a lista de CNPJs gerados.
+    """
+    aleatorio = random.Random(semente)
+    os.makedirs(diretorio, exist_ok=True)
+    cnaes = ["6201501", "6202300", "6204000", "7020400", "6920601", "4751201"]
+    municipios = [("7107", "SAO PAULO", "SP"), ("6001", "RIO DE JANEIRO", "RJ"), ("4123", "BELO HORIZONTE", "MG")]
+    cnpjs = []
+
+    with open(os.path.join(diretorio, "K3241.EMPRECSV"), "w", encoding="latin-1", newline="") as empresas, \
+            open(os.path.join(diretorio, "K3241.ESTABELE"), "w", encoding="latin-1", newline="") as estabelecimentos:
+        esc_emp = csv.writer(empresas, delimiter=";", quoting=csv.QUOTE_ALL)
+        esc_est = csv.writer(estabelecimentos, delimiter=";", quoting=csv.QUOTE_ALL)
+        for n in range(quantidade):
+            basico = f"{aleatorio.randrange(10 ** 8):08d}"
+            ordem = "0001"
+            dv = _dv_cnpj(basico + ordem)
+            cnpjs.append(basico + ordem + dv)
+            codigo, _, uf = aleatorio.choice(municipios)
+            esc_emp.writerow([basico, f"EMPRESA EXEMPLO {n} LTDA", "2062", "49", "10000,00", "01", ""])
+            esc_est.writerow([
+                basico, ordem, dv, "1", f"EXEMPLO {n}", "02", "20200101", "00", "", "",
+                "20200101", aleatorio.choice(cnaes), ",".join(aleatorio.sample(cnaes, 2)),
+                "RUA", f"DAS FLORES {n}", str(n), "", "CENTRO", "01001000", uf, codigo,
+                "11", "99999999", "", "", "", "", "", "", ""
+            ])
+
+    with open(os.path.join(diretorio, "F.K03200$Z.D40213.MUNICCSV"), "w", encoding="latin-1", newline="") as arquivo:
+        escritor = csv.writer(arquivo, delimiter=";", quoting=csv.QUOTE_ALL)
+        for codigo, nome, _ in municipios:
+            escritor.writerow([codigo, nome])
+
+    return cnpjs
+
+
+def _main():
+    parser = argparse.ArgumentParser(description="Índice offline de CNPJs (dados abertos da Receita)")
+    parser.add_argument("--importar", metavar="DIR", help="Monta o índice a partir dos CSV/ZIP da Receita")
+    parser.add_argument("--gerar-exemplo", metavar="DIR", help="Gera um dump pequeno no layout da Receita")
+    parser.add_argument("--quantidade", type=int, default=1000, help="Estabelecimentos do dump de exemplo")
+    parser.add_argument("--consultar", metavar="CNPJ", help="Consulta um CNPJ no índice")
+    parser.add_argument("--destino", default=CNPJ_INDICE_PATH, help="Arquivo do índice")
+    args = parser.parse_args()
+
+    if args.gerar_exemplo:
+        cnpjs = gerar_exemplo(args.gerar_exemplo, args.quantidade)
+        print(f"{len(cnpjs)} estabelecimentos gerados em {args.gerar_exemplo} (ex.: {cnpjs[0]})")
+    if args.importar:
+        print(importar(args.importar, args.destino))
+    if args.consultar:
+        indice = IndiceCNPJ(args.destino)
+        inicio = time.perf_counter()
+        dados = indice.buscar(args.consultar)
+        print(dados or "CNPJ não encontrado no índice")
+        print(f"{(time.perf_counter() - inicio) * 1000:.3f} ms")
+    if not (args.gerar_exemplo or args.importar or args.consultar):
+        parser.print_help()
+
+
+if __name__ == "__main__":
+    _main()
@@ -0,0 +1,213 @@
+"""
+Gerenciador de índices do MongoDB.
+
+Os índices de cada coleção são declarados em INDICES. Na subida da API os
+índices que faltam são criados (operação idempotente), os substituídos por
+outro (INDICES_OBSOLETOS) são removidos e qualquer divergência entre o
+declarado e o que existe no banco é registrada no log.
+
+Uso pela linha de comando (a partir da pasta backend):
+
+    python -m utils.indices --verificar   # só mostra as divergências
+    python -m utils.indices --criar       # cria os índices que faltam e remove os obsoletos
+"""
+import argparse
+import asyncio
+import os
+import logging
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import OperationFailure
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# coleção -> lista de (nome, chaves, opções)
+INDICES = {
+    "usuarios": [
+        ("email_unico", [("email", ASCENDING)], {"unique": True}),
+    ],
+    "empresas": [
+        ("cnpj_unico", [("cnpj", ASCENDING)], {"unique": True}),
+        ("usuario", [("usuario_id", ASCENDING)], {}),
+    ],
+    "notas_fiscais": [
+        # Inclui _id para a paginação por chave (data_emissao, _id) não precisar ordenar em memória
+        ("empresa_data_emissao_id", [("empresa_id", ASCENDING), ("data_emissao", DESCENDING), ("_id", DESCENDING)], {}),
+        ("empresa_status", [("empresa_id", ASCENDING), ("status_auditoria", ASCENDING)], {}),
+        # Reauditoria por código de serviço (distinct e update_many por código)
+        ("empresa_servico_status", [("empresa_id", ASCENDING), ("codigo_servico_utilizado", ASCENDING), ("status_auditoria", ASCENDING)], {}),
+        # Notas antigas (sem impressão digital) ficam fora do índice único
+        ("impressao_digital_unica", [("impressao_digital", ASCENDING)],
+         {"unique": True, "partialFilterExpression": {"impressao_digital": {"$exists": True}}}),
+        # Limpeza de XMLs órfãos (utils.armazem_xml); notas antigas sem xml_hash ficam fora
+        ("xml_hash", [("xml_hash", ASCENDING)], {"partialFilterExpression": {"xml_hash": {"$exists": True}}}),
+    ],
+    "xml_blobs": [
+        ("ultimo_uso", [("ultimo_uso", ASCENDING)], {}),
+    ],
+    "resumo_mensal": [
+        ("empresa_mes_unico", [("empresa_id", ASCENDING), ("mes", ASCENDING)], {"unique": True}),
+    ],
+    "cache_cnpj": [
+        # Remove as consultas vencidas (expira_em já traz a data de expiração)
+        ("expiracao_ttl", [("expira_em", ASCENDING)], {"expireAfterSeconds": 0}),
+    ],
+    "import_jobs": [
+        ("status_criacao", [("status", ASCENDING), ("data_criacao", ASCENDING)], {}),
+    ],
+    "import_job_arquivos": [
+        ("job_status_seq", [("job_id", ASCENDING), ("status", ASCENDING), ("seq", ASCENDING)], {}),
+        ("job_status_rodada", [("job_id", ASCENDING), ("status", ASCENDING), ("rodada", ASCENDING)], {}),
+    ],
+}
+
+# coleção -> {índice antigo: índice declarado que o substitui}. O antigo só é
+# removido depois que o substituto existe, para as consultas não ficarem sem índice
+INDICES_OBSOLETOS = {
+    "notas_fiscais": {
+        # Ganhou _id nas chaves para a paginação por chave
+        "empresa_data_emissao": "empresa_data_emissao_id",
+    },
+}
+
+# Opções comparadas na verificação de divergências
+OPCOES_RELEVANTES = ("unique", "sparse", "partialFilterExpression", "expireAfterSeconds")
+
+
+def _normalizar_chaves(chaves):
+    return [(campo, int(direcao) if isinstance(direcao, (int, float)) else direcao) for campo, direcao in chaves]
+
+
+async def verificar_indices(db):
+    """
+    Compara os índices declarados com os existentes.
+    Retorna uma lista de divergências: dicts com colecao, indice e problema
+    ("ausente", "diferente", "obsoleto" ou "nao_declarado").
+    """
+    divergencias = []
+
+    for colecao, declarados in INDICES.items():
+        existentes = await db[colecao].index_information()
+        nomes_declarados = set()
+
+        for nome, chaves, opcoes in declarados:
+            nomes_declarados.add(nome)
+            atual = existentes.get(nome)
+            if atual is None:
+                divergencias.append({"colecao": colecao, "indice": nome, "problema": "ausente"})
+                continue
+
+            mesmas_chaves = _normalizar_chaves(atual["key"]) == _normalizar_chaves(chaves)
+            mesmas_opcoes = all(atual.get(op) == opcoes.get(op) for op in OPCOES_RELEVANTES)
+            if not (mesmas_chaves and mesmas_opcoes):
+                divergencias.append({
+                    "colecao": colecao,
+                    "indice": nome,
+                    "problema": "diferente",
+                    "esperado": {"key": chaves, **opcoes},
+                    "atual": {"key": atual["key"], **{op: atual[op] for op in OPCOES_RELEVANTES if op in atual}},
+                })
+
+        obsoletos = INDICES_OBSOLETOS.get(colecao, {})
+        for nome in existentes:
+            if nome != "_id_" and nome not in nomes_declarados:
+                problema = "obsoleto" if nome in obsoletos else "nao_declarado"
+                divergencias.append({"colecao": colecao, "indice": nome, "problema": problema})
+
+    return divergencias
+
+
+async def garantir_indices(db, background: bool = False):
+    """
+    Cria os índices declarados que ainda não existem. Índices já existentes com
+    a mesma definição são ignorados pelo servidor, então a chamada é idempotente.
+    Falhas (ex.: duplicatas impedindo um índice único) são registradas e não
+    interrompem as demais coleções. Retorna {colecao: [nomes criados ou erro]}.
+    """
+    relatorio = {}
+
+    for colecao, declarados in INDICES.items():
+        modelos = [
+            IndexModel(chaves, name=nome, background=background, **opcoes)
+            for nome, chaves, opcoes in declarados
+        ]
+        try:
+            relatorio[colecao] = await db[colecao].create_indexes(modelos)
+        except OperationFailure as e:
+            # Cria um a um para que um índice com problema não impeça os outros
+            logger.warning(f"Falha ao criar os índices de {colecao} em lote, criando um a um: {str(e)}")
+            relatorio[colecao] = []
+            for modelo in modelos:
+                try:
+                    relatorio[colecao] += await db[colecao].create_indexes([modelo])
+                except OperationFailure as erro_indice:
+                    nome = modelo.document["name"]
+                    logger.error(f"Não foi possível criar o índice {colecao}.{nome}: {str(erro_indice)}")
+                    relatorio[colecao].append(f"ERRO {nome}: {str(erro_indice)}")
+
+    await remover_obsoletos(db, relatorio)
+    return relatorio
+
+
+async def remover_obsoletos(db, relatorio: dict = None):
+    """
+    Remove os índices de INDICES_OBSOLETOS cujo substituto já existe. Com
+    `relatorio`, registra as remoções nele ("REMOVIDO nome").
+    """
+    for colecao, obsoletos in INDICES_OBSOLETOS.items():
+        existentes = await db[colecao].index_information()
+        for antigo, substituto in obsoletos.items():
+            if antigo not in existentes or substituto not in existentes:
+                continue
+            try:
+                await db[colecao].drop_index(antigo)
+            except OperationFailure as erro:
+                logger.error(f"Não foi possível remover o índice obsoleto {colecao}.{antigo}: {str(erro)}")
+                continue
+            logger.info(f"Índice obsoleto {colecao}.{antigo} removido (substituído por {substituto})")
+            if relatorio is not None:
+                relatorio.setdefault(colecao, []).append(f"REMOVIDO {antigo}")
+
+
+async def preparar_indices(db):
+    """
+    Rotina de subida da API: cria os índices que faltam e registra divergências.
+    """
+    try:
+        await garantir_indices(db, background=True)
+        for divergencia in await verificar_indices(db):
+            logger.warning(f"Divergência de índice: {divergencia}")
+    except Exception as e:
+        logger.error(f"Falha ao preparar índices: {str(e)}")
+
+
+async def _main():
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Gerencia os índices do MongoDB do Fiscal Fácil")
+    parser.add_argument("--verificar", action="store_true", help="Lista divergências sem alterar o banco")
+    parser.add_argument("--criar", action="store_true", help="Cria os índices ausentes (em background) e remove os obsoletos")
+    args = parser.parse_args()
+
+    client = AsyncIOMotorClient(os.getenv("MONGO_URL", "mongodb://localhost:27017"))
+    db = client.fiscal_facil
+
+    if args.criar:
+        relatorio = await garantir_indices(db, background=True)
+        for colecao, nomes in relatorio.items():
+            print(f"{colecao}: {', '.join(nomes) if nomes else '-'}")
+
+    divergencias = await verificar_indices(db)
+    if not divergencias:
+        print("Nenhuma divergência de índices.")
+    for divergencia in divergencias:
+        print(f"[{divergencia['problema']}] {divergencia['colecao']}.{divergencia['indice']}")
+
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -0,0 +1,171 @@
+import asyncio
+import os
+import zipfile
+import logging
+from tempfile import SpooledTemporaryFile
+from python_multipart.multipart import MultipartParser, parse_options_header
+from fastapi import HTTPException
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+# Tamanho máximo de um XML individual (em bytes). Arquivos maiores são recusados sem serem lidos inteiros.
+MAX_TAMANHO_XML = int(os.getenv("MAX_TAMANHO_XML", str(5 * 1024 * 1024)))
+# Até este tamanho o ZIP fica em memória; acima disso o arquivo compactado vai para um temporário em disco
+ZIP_SPOOL_MEMORIA = int(os.getenv("ZIP_SPOOL_MEMORIA", str(8 * 1024 * 1024)))
+
+TIPOS_ZIP = {"application/zip", "application/x-zip-compressed", "application/x-zip"}
+
+
+class ArquivoRecebido:
+    """
+    Um XML extraído do upload. `erro` vem preenchido quando o arquivo não pode
+    ser lido (ex.: tamanho acima do limite), e nesse caso `conteudo` é vazio.
+    """
+    def __init__(self, nome_arquivo: str, conteudo: bytes = b"", erro: str = None):
+        self.nome_arquivo = nome_arquivo
+        self.conteudo = conteudo
+        self.erro = erro
+
+
+def _eh_zip(nome_arquivo: str, content_type: str):
+    return (nome_arquivo or "").lower().endswith(".zip") or (content_type or "").lower() in TIPOS_ZIP
+
+
+def _listar_xmls_zip(arquivo_zip):
+    with zipfile.ZipFile(arquivo_zip) as zf:
+        return [
+            info for info in zf.infolist()
+            if not info.is_dir() and info.filename.lower().endswith(".xml")
+        ]
+
+
+def _ler_grupo_zip(arquivo_zip, nome_zip: str, infos: list):
+    recebidos = []
+    with zipfile.ZipFile(arquivo_zip) as zf:
+        for info in infos:
+            nome = f"{nome_zip}/{info.filename}"
+            if info.file_size > MAX_TAMANHO_XML:
+                recebidos.append(ArquivoRecebido(nome, erro="Arquivo excede o tamanho máximo permitido"))
+                continue
+            with zf.open(info) as entrada:
+                recebidos.append(ArquivoRecebido(nome, entrada.read()))
+    return recebidos
+
+
+async def expandir_zip(arquivo_zip, nome_zip: str, tamanho_grupo: int = 50):
+    """
+    Percorre um ZIP já recebido (arquivo temporário) entrada por entrada, lendo
+    em threads pequenos grupos de XMLs para que só um grupo fique em memória.
+    """
+    arquivo_zip.seek(0)
+    try:
+        infos = await asyncio.to_thread(_listar_xmls_zip, arquivo_zip)
+    except zipfile.BadZipFile:
+        yield ArquivoRecebido(nome_zip, erro="Arquivo ZIP inválido ou corrompido")
+        return
+
+    for inicio in range(0, len(infos), tamanho_grupo):
+        grupo = infos[inicio:inicio + tamanho_grupo]
+        for recebido in await asyncio.to_thread(_ler_grupo_zip, arquivo_zip, nome_zip, grupo):
+            yield recebido
+
+
+async def iterar_arquivos_upload(request):
+    """
+    Lê o corpo da requisição de forma incremental e gera um ArquivoRecebido
+    para cada XML encontrado.
+
+    Aceita:
+    - multipart/form-data com qualquer quantidade de partes (XMLs e/ou ZIPs);
+    - corpo application/zip com um único ZIP.
+
+    Só o XML em leitura fica em memória; ZIPs são acumulados em um arquivo
+    temporário (em memória até ZIP_SPOOL_MEMORIA) e depois lidos entrada por entrada.
+    """
+    content_type, params = parse_options_header(request.headers.get("content-type", ""))
+    content_type = content_type.decode("latin-1").lower()
+
+    if content_type in TIPOS_ZIP:
+        with SpooledTemporaryFile(max_size=ZIP_SPOOL_MEMORIA) as spool:
+            async for chunk in request.stream():
+                spool.write(chunk)
+            async for recebido in expandir_zip(spool, "upload.zip"):
+                yield recebido
+        return
+
+    if content_type != "multipart/form-data" or b"boundary" not in params:
+        raise HTTPException(status_code=400, detail="Envie multipart/form-data com arquivos XML ou um arquivo application/zip")
+
+    # Estado da parte em leitura, alimentado pelos callbacks síncronos do parser
+    parte = {}
+    cabecalho = {"campo": b"", "valor": b""}
+    concluidas = []
+
+    def on_part_begin():
+        parte.clear()
+        parte.update({"headers": {}, "buffer": bytearray(), "spool": None, "excedeu": False})
+
+    def on_header_field(data, start, end):
+        cabecalho["campo"] += data[start:end]
+
+    def on_header_value(data, start, end):
+        cabecalho["valor"] += data[start:end]
+
+    def on_header_end():
+        parte["headers"][cabecalho["campo"].lower()] = cabecalho["valor"]
+        cabecalho["campo"] = b""
+        cabecalho["valor"] = b""
+
+    def on_headers_finished():
+        _, disposicao = parse_options_header(parte["headers"].get(b"content-disposition", b""))
+        nome = disposicao.get(b"filename", b"").decode("utf-8", errors="replace")
+        tipo = parte["headers"].get(b"content-type", b"").decode("latin-1")
+        parte["nome_arquivo"] = nome
+        if _eh_zip(nome, tipo):
+            parte["spool"] = SpooledTemporaryFile(max_size=ZIP_SPOOL_MEMORIA)
+
+    def on_part_data(data, start, end):
+        if parte["spool"] is not None:
+            parte["spool"].write(data[start:end])
+        elif not parte["excedeu"]:
+            parte["buffer"] += data[start:end]
+            if len(parte["buffer"]) > MAX_TAMANHO_XML:
+                parte["excedeu"] = True
+                parte["buffer"] = bytearray()
+
+    def on_part_end():
+        # Partes sem filename são campos simples do formulário e são ignoradas
+        if parte.get("nome_arquivo"):
+            concluidas.append(dict(parte))
+        elif parte.get("spool") is not None:
+            parte["spool"].close()
+
+    parser = MultipartParser(params[b"boundary"], {
+        "on_part_begin": on_part_begin,
+        "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+        "on_header_field": on_header_field,
+        "on_header_value": on_header_value,
+        "on_header_end": on_header_end,
+        "on_headers_finished": on_headers_finished,
+    })
+
+    async for chunk in request.stream():
+        parser.write(chunk)
+        while concluidas:
+            finalizada = concluidas.pop(0)
+            nome = finalizada["nome_arquivo"]
+            if finalizada["spool"] is not None:
+                with finalizada["spool"] as spool:
+                    async for recebido in expandir_zip(spool, nome):
+                        yield recebido
+            elif finalizada["excedeu"]:
+                yield ArquivoRecebido(nome, erro="Arquivo excede o tamanho máximo permitido")
+            else:
+                yield ArquivoRecebido(nome, bytes(finalizada["buffer"]))
+
+    parser.finalize()
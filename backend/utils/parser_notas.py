@@ -0,0 +1,209 @@
+"""
+Parser de XML de notas fiscais com detecção de layout.
+
+O elemento raiz é identificado nos primeiros bytes do arquivo e escolhe o
+layout (LAYOUTS). O arquivo é lido com iterparse direto dos bytes: a cada nota
+fechada só os campos necessários são extraídos e o elemento é descartado, então
+arquivos com várias notas (ex.: ListaNfse) não montam a árvore inteira.
+
+Layouts suportados:
+- municipal: tbnfd/nfdok/NewDataSet/NOTA_FISCAL (layout original do sistema)
+- abrasf: NFS-e padrão ABRASF (v1 e v2: CompNfse, ListaNfse, respostas de consulta)
+- nacional: NFS-e padrão nacional (NFSe/infNFSe)
+- nfe: NF-e modelo 55 (nfeProc/NFe/infNFe); o "código de serviço" é o CFOP do primeiro item
+"""
+import io
+import re
+import logging
+from datetime import datetime
+from decimal import Decimal
+
+try:
+    from lxml import etree
+    LXML_DISPONIVEL = True
+except ImportError:  # lxml é opcional: a stdlib faz o mesmo trabalho, mais devagar
+    import xml.etree.ElementTree as etree
+    LXML_DISPONIVEL = False
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+ERRO_LAYOUT = "Layout de XML desconhecido. Verifique se é um XML de nota fiscal de serviço."
+
+# Bytes lidos para identificar o elemento raiz
+TAMANHO_SONDA = 4096
+_RE_RAIZ = re.compile(rb"<([A-Za-z_][\w.\-]*:)?([A-Za-z_][\w.\-]*)")
+_RE_IGNORAR = re.compile(rb"<\?.*?\?>|<!--.*?-->|<!DOCTYPE[^>]*>", re.DOTALL)
+_RE_PREFIXO_CHAVE = re.compile(r"^[A-Za-z]+")
+
+
+class Layout:
+    """
+    `elemento_nota`: nome local do elemento que contém uma nota.
+    `campos`: para cada campo, caminhos ElementPath (relativos à nota) testados
+    em ordem; "@atributo" lê um atributo da própria nota.
+    """
+
+    def __init__(self, nome: str, raizes: set, elemento_nota: str, campos: dict):
+        self.nome = nome
+        self.raizes = raizes
+        self.elemento_nota = elemento_nota
+        self.campos = campos
+
+
+LAYOUTS = [
+    Layout("municipal", {"tbnfd"}, "NOTA_FISCAL", {
+        "numero_nota": ["{*}NumeroNota"],
+        "data_emissao": ["{*}DataEmissao"],
+        "codigo_servico": ["{*}Cae"],
+        "valor_total": ["{*}ValorTotalNota"],
+        "chave_validacao": ["{*}ChaveValidacao"],
+        "cnpj_tomador": ["{*}ClienteCNPJCPF"],
+    }),
+    Layout("abrasf", {
+        "CompNfse", "ListaNfse", "Nfse", "ConsultarNfseResposta", "ConsultarLoteRpsResposta",
+        "ConsultarNfseRpsResposta", "ConsultarNfseFaixaResposta", "ConsultarNfseServicoPrestadoResposta",
+        "GerarNfseResposta", "EnviarLoteRpsSincronoResposta",
+    }, "InfNfse", {
+        "numero_nota": ["{*}Numero"],
+        "data_emissao": ["{*}DataEmissao"],
+        "codigo_servico": [
+            ".//{*}Servico/{*}CodigoTributacaoMunicipio",
+            ".//{*}Servico/{*}ItemListaServico",
+        ],
+        "valor_total": [
+            "{*}ValoresNfse/{*}ValorLiquidoNfse",
+            ".//{*}Servico/{*}Valores/{*}ValorServicos",
+        ],
+        "chave_validacao": ["{*}CodigoVerificacao"],
+        "cnpj_tomador": [
+            ".//{*}Tomador/{*}IdentificacaoTomador/{*}CpfCnpj/{*}Cnpj",
+            ".//{*}Tomador/{*}IdentificacaoTomador/{*}CpfCnpj/{*}Cpf",
+            ".//{*}TomadorServico/{*}IdentificacaoTomador/{*}CpfCnpj/{*}Cnpj",
+            ".//{*}TomadorServico/{*}IdentificacaoTomador/{*}CpfCnpj/{*}Cpf",
+        ],
+    }),
+    Layout("nacional", {"NFSe"}, "infNFSe", {
+        "numero_nota": ["{*}nNFSe"],
+        "data_emissao": [".//{*}infDPS/{*}dhEmi", "{*}dhProc"],
+        "codigo_servico": [".//{*}cServ/{*}cTribMun", ".//{*}cServ/{*}cTribNac"],
+        "valor_total": ["{*}valores/{*}vLiq", ".//{*}infDPS/{*}valores/{*}vServPrest/{*}vServ"],
+        "chave_validacao": ["@Id"],
+        "cnpj_tomador": [".//{*}toma/{*}CNPJ", ".//{*}toma/{*}CPF"],
+    }),
+    Layout("nfe", {"nfeProc", "NFe"}, "infNFe", {
+        "numero_nota": ["{*}ide/{*}nNF"],
+        "data_emissao": ["{*}ide/{*}dhEmi", "{*}ide/{*}dEmi"],
+        "codigo_servico": ["{*}det/{*}prod/{*}CFOP"],
+        "valor_total": ["{*}total/{*}ICMSTot/{*}vNF"],
+        "chave_validacao": ["@Id"],
+        "cnpj_tomador": ["{*}dest/{*}CNPJ", "{*}dest/{*}CPF"],
+    }),
+]
+
+_LAYOUT_POR_RAIZ = {raiz: layout for layout in LAYOUTS for raiz in layout.raizes}
+
+
+def detectar_layout(conteudo: bytes):
+    """
+    Identifica o layout pelo elemento raiz, lendo só o início do arquivo.
+    """
+    inicio = _RE_IGNORAR.sub(b"", conteudo[:TAMANHO_SONDA])
+    encontrado = _RE_RAIZ.search(inicio)
+    if not encontrado:
+        return None
+    return _LAYOUT_POR_RAIZ.get(encontrado.group(2).decode("ascii", errors="ignore"))
+
+
+def _nome_local(tag):
+    return tag.rsplit("}", 1)[-1] if isinstance(tag, str) else ""
+
+
+def _iterar_notas(conteudo: bytes, layout: Layout):
+    """
+    Elementos de nota, à medida que são fechados. Com lxml o filtro por tag
+    é feito no próprio parser e entidades/rede ficam desligadas.
+    """
+    if LXML_DISPONIVEL:
+        eventos = etree.iterparse(
+            io.BytesIO(conteudo), events=("end",), tag=f"{{*}}{layout.elemento_nota}",
+            resolve_entities=False, no_network=True, huge_tree=True
+        )
+        for _, elemento in eventos:
+            yield elemento
+            # Nota já extraída: libera o elemento, as notas anteriores (irmãs dele)
+            # e os irmãos já processados dos ancestrais
+            elemento.clear(keep_tail=True)
+            while elemento.getprevious() is not None:
+                del elemento.getparent()[0]
+            for ancestral in elemento.iterancestors():
+                pai = ancestral.getparent()
+                while pai is not None and ancestral.getprevious() is not None:
+                    del pai[0]
+        return
+
+    for _, elemento in etree.iterparse(io.BytesIO(conteudo), events=("end",)):
+        if _nome_local(elemento.tag) == layout.elemento_nota:
+            yield elemento
+            elemento.clear()
+
+
+def _extrair_campo(elemento, caminhos: list):
+    for caminho in caminhos:
+        if caminho.startswith("@"):
+            valor = elemento.get(caminho[1:])
+        else:
+            encontrado = elemento.find(caminho)
+            valor = encontrado.text if encontrado is not None else None
+        if valor is not None and valor.strip():
+            return valor.strip()
+    return None
+
+
+def _montar_nota(layout: Layout, elemento):
+    campos = {campo: _extrair_campo(elemento, caminhos) for campo, caminhos in layout.campos.items()}
+
+    if not campos["numero_nota"] or not campos["data_emissao"]:
+        raise ValueError("Nota sem número ou data de emissão")
+
+    chave = campos["chave_validacao"]
+    # Chaves de NF-e/NFS-e nacional vêm no Id com prefixo ("NFe...", "NFS...")
+    if chave and layout.nome in ("nfe", "nacional"):
+        chave = _RE_PREFIXO_CHAVE.sub("", chave)
+
+    data_formatada = datetime.strptime(campos["data_emissao"][:10], "%Y-%m-%d")
+    return {
+        "numero_nota": int(campos["numero_nota"]),
+        "data_emissao": data_formatada.isoformat(),
+        "codigo_servico": campos["codigo_servico"],
+        # Decimal exato como no XML; preparar_notas converte para centavos sem passar por float
+        "valor_total": Decimal(campos["valor_total"] or "0"),
+        "chave_validacao": chave,
+        "cnpj_tomador": campos["cnpj_tomador"],
+    }
+
+
+def parse_xml_notas(conteudo: bytes):
+    """
+    Lê todas as notas de um arquivo XML.
+
+    Retorna {"layout", "notas": [dados de cada nota]} ou {"erro"}.
+    Cada nota tem numero_nota, data_emissao, codigo_servico, valor_total
+    (Decimal), chave_validacao e cnpj_tomador (os campos do parser original). O XML
+    não é decodificado aqui: os bytes vão compactados para utils.armazem_xml.
+    """
+    layout = detectar_layout(conteudo)
+    if layout is None:
+        return {"erro": ERRO_LAYOUT}
+
+    try:
+        notas = [_montar_nota(layout, elemento) for elemento in _iterar_notas(conteudo, layout)]
+
+        if not notas:
+            return {"erro": "Nenhuma nota fiscal encontrada no XML"}
+
+        return {"layout": layout.nome, "notas": notas}
+
+    except Exception as e:
+        logger.error(f"Erro ao ler XML: {str(e)}")
+        return {"erro": f"Falha ao processar XML: {str(e)}"}
@@ -0,0 +1,335 @@
+"""
+PDF de uma nota fiscal (ReportLab).
+
+Estilos de parágrafo e TableStyles são montados uma vez, na importação do
+módulo (em cada worker do pool). O desenho roda no pool de PDFs, fora do event
+loop, e os PDFs prontos ficam num cache LRU por nota junto com a versão dos
+campos usados (nota + empresa): uma reauditoria ou alteração da empresa gera
+outra versão, e invalidar_empresa/invalidar_nota liberam as entradas antigas.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+import zipfile
+import logging
+from datetime import datetime
+from io import BytesIO
+from dotenv import load_dotenv
+from reportlab.lib.pagesizes import A4
+from reportlab.lib import colors
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.units import mm
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer
+from reportlab.lib.enums import TA_CENTER
+from utils.cache import CacheTTL
+from utils.pool_execucao import PoolExecucao
+from utils import campos_nota
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+PDF_EXECUTOR = os.getenv("PDF_EXECUTOR", "process").lower()
+PDF_WORKERS = int(os.getenv("PDF_WORKERS", str(os.cpu_count() or 2)))
+# PDFs sendo desenhados ao mesmo tempo (por processo da API)
+PDF_MAX_CONCORRENCIA = int(os.getenv("PDF_MAX_CONCORRENCIA", str(PDF_WORKERS * 2)))
+PDF_CACHE_TAMANHO = int(os.getenv("PDF_CACHE_TAMANHO", "500"))
+PDF_CACHE_SEGUNDOS = int(os.getenv("PDF_CACHE_SEGUNDOS", "3600"))
+# PDFs em andamento por exportação em ZIP; abaixo de PDF_MAX_CONCORRENCIA para
+# uma exportação não ocupar o pool inteiro
+PDF_ZIP_CONCORRENCIA = int(os.getenv("PDF_ZIP_CONCORRENCIA", str(max(1, PDF_MAX_CONCORRENCIA // 2))))
+
+# Muda quando o layout do PDF muda, para não servir PDFs do layout anterior
+VERSAO_LAYOUT = "2"
+
+# Campos da nota lidos para o PDF (projeção da consulta)
+PROJECAO_NOTA_PDF = {
+    "empresa_id": 1,
+    "numero_nota": 1,
+    "data_emissao": 1,
+    "chave_validacao": 1,
+    "codigo_servico_utilizado": 1,
+    "cnpj_tomador": 1,
+    "valor_centavos": 1,
+    "valor_total": 1,
+    "status_auditoria": 1,
+    "mensagem_erro": 1,
+    "data_importacao": 1,
+}
+
+# ---------- Estilos (montados uma vez) ----------
+_estilos = getSampleStyleSheet()
+
+ESTILO_TITULO = ParagraphStyle(
+    'CustomTitle',
+    parent=_estilos['Heading1'],
+    fontSize=18,
+    textColor=colors.HexColor('#1e40af'),
+    spaceAfter=20,
+    alignment=TA_CENTER
+)
+
+ESTILO_CABECALHO = ParagraphStyle(
+    'CustomHeader',
+    parent=_estilos['Heading2'],
+    fontSize=14,
+    textColor=colors.HexColor('#1f2937'),
+    spaceAfter=10
+)
+
+ESTILO_RODAPE = ParagraphStyle(
+    'Footer',
+    parent=_estilos['Normal'],
+    fontSize=8,
+    textColor=colors.grey,
+    alignment=TA_CENTER
+)
+
+_COMANDOS_TABELA = [
+    ('BACKGROUND', (0, 0), (0, -1), colors.HexColor('#f3f4f6')),
+    ('TEXTCOLOR', (0, 0), (-1, -1), colors.black),
+    ('ALIGN', (0, 0), (0, -1), 'LEFT'),
+    ('FONTNAME', (0, 0), (0, -1), 'Helvetica-Bold'),
+    ('FONTNAME', (1, 0), (1, -1), 'Helvetica'),
+    ('FONTSIZE', (0, 0), (-1, -1), 10),
+    ('GRID', (0, 0), (-1, -1), 0.5, colors.grey),
+    ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
+    ('LEFTPADDING', (0, 0), (-1, -1), 5),
+    ('RIGHTPADDING', (0, 0), (-1, -1), 5),
+    ('TOPPADDING', (0, 0), (-1, -1), 5),
+    ('BOTTOMPADDING', (0, 0), (-1, -1), 5),
+]
+
+ESTILO_TABELA = TableStyle(_COMANDOS_TABELA)
+
+
+def _estilo_auditoria(aprovada: bool):
+    return TableStyle(_COMANDOS_TABELA + [
+        ('BACKGROUND', (1, 0), (1, 0), colors.HexColor('#dcfce7') if aprovada else colors.HexColor('#fee2e2')),
+        ('TEXTCOLOR', (1, 0), (1, 0), colors.green if aprovada else colors.red),
+        ('FONTNAME', (1, 0), (1, 0), 'Helvetica-Bold'),
+    ])
+
+
+ESTILO_AUDITORIA_APROVADA = _estilo_auditoria(True)
+ESTILO_AUDITORIA_COM_ERRO = _estilo_auditoria(False)
+
+
+# ---------- Dados e desenho ----------
+def _formatar_data_hora(texto):
+    try:
+        return datetime.fromisoformat(texto.replace('Z', '+00:00')).strftime('%d/%m/%Y às %H:%M')
+    except Exception:
+        return texto
+
+
+def dados_pdf(nota: dict, empresa: dict):
+    """
+    Valores (já formatados) que entram no PDF. Também definem a versão do PDF em cache.
+    """
+    return {
+        "razao_social": empresa.get('razao_social', 'N/A'),
+        "cnpj": empresa.get('cnpj', 'N/A'),
+        "regime_tributario": empresa.get('regime_tributario', 'N/A'),
+        "numero_nota": str(nota.get('numero_nota', 'N/A')),
+        "data_emissao": _formatar_data_hora(campos_nota.data_texto(nota.get('data_emissao')) or ''),
+        "chave_validacao": nota.get('chave_validacao', 'N/A'),
+        "codigo_servico": nota.get('codigo_servico_utilizado', 'N/A'),
+        "cnpj_tomador": nota.get('cnpj_tomador', 'N/A'),
+        "valor_total": f"R$ {campos_nota.valor_nota(nota):.2f}",
+        "status": nota.get('status_auditoria', 'N/A'),
+        "mensagem": nota.get('mensagem_erro', 'Nota fiscal em conformidade'),
+        "data_importacao": _formatar_data_hora(nota.get('data_importacao', '')),
+    }
+
+
+def versao_pdf(dados: dict):
+    bruto = json.dumps([VERSAO_LAYOUT, dados], sort_keys=True, default=str)
+    return hashlib.sha256(bruto.encode()).hexdigest()
+
+
+def desenhar_pdf(dados: dict):
+    """
+    Desenha o PDF a partir de dados_pdf. Roda no pool de PDFs.
+    """
+    buffer = BytesIO()
+    doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=15*mm, bottomMargin=15*mm)
+    elements = []
+
+    # Título
+    elements.append(Paragraph("NOTA FISCAL DE SERVIÇOS ELETRÔNICA", ESTILO_TITULO))
+    elements.append(Spacer(1, 10*mm))
+
+    # Informações da Empresa Prestadora
+    elements.append(Paragraph("DADOS DA EMPRESA PRESTADORA", ESTILO_CABECALHO))
+    empresa_table = Table([
+        ['Razão Social:', dados["razao_social"]],
+        ['CNPJ:', dados["cnpj"]],
+        ['Regime Tributário:', dados["regime_tributario"]]
+    ], colWidths=[40*mm, 130*mm])
+    empresa_table.setStyle(ESTILO_TABELA)
+    elements.append(empresa_table)
+    elements.append(Spacer(1, 8*mm))
+
+    # Dados da Nota Fiscal
+    elements.append(Paragraph("DADOS DA NOTA FISCAL", ESTILO_CABECALHO))
+    nota_table = Table([
+        ['Número da Nota:', dados["numero_nota"]],
+        ['Data de Emissão:', dados["data_emissao"]],
+        ['Chave de Validação:', dados["chave_validacao"]],
+        ['Código de Serviço:', dados["codigo_servico"]],
+        ['CNPJ Tomador:', dados["cnpj_tomador"]],
+        ['Valor Total:', dados["valor_total"]]
+    ], colWidths=[40*mm, 130*mm])
+    nota_table.setStyle(ESTILO_TABELA)
+    elements.append(nota_table)
+    elements.append(Spacer(1, 8*mm))
+
+    # Status da Auditoria
+    elements.append(Paragraph("RESULTADO DA AUDITORIA", ESTILO_CABECALHO))
+    auditoria_table = Table([
+        ['Status:', dados["status"]],
+        ['Resultado:', dados["mensagem"]]
+    ], colWidths=[40*mm, 130*mm])
+    auditoria_table.setStyle(
+        ESTILO_AUDITORIA_APROVADA if dados["status"] == 'APROVADA' else ESTILO_AUDITORIA_COM_ERRO
+    )
+    elements.append(auditoria_table)
+    elements.append(Spacer(1, 8*mm))
+
+    # Rodapé. Sem a hora de geração: o PDF fica em cache e a hora ficaria velha
+    elements.append(Spacer(1, 15*mm))
+    elements.append(Paragraph(f"Importado em: {dados['data_importacao']}", ESTILO_RODAPE))
+    elements.append(Paragraph("Fiscal Fácil - Sistema de Auditoria Fiscal", ESTILO_RODAPE))
+
+    doc.build(elements)
+    return buffer.getvalue()
+
+
+# ---------- Pool e cache ----------
+pool_pdf = PoolExecucao("pdf", PDF_EXECUTOR, PDF_WORKERS, PDF_MAX_CONCORRENCIA)
+
+# nota_id -> {"versao", "empresa_id", "pdf"}
+cache_pdf = CacheTTL(PDF_CACHE_TAMANHO, PDF_CACHE_SEGUNDOS)
+
+
+async def renderizar_pdf(nota: dict, empresa: dict, guardar_em_cache: bool = True):
+    """
+    PDF da nota, do cache se a versão (campos da nota e da empresa) não mudou.
+    Exportações em massa usam `guardar_em_cache=False` para não esvaziar o LRU.
+    """
+    nota_id = str(nota["_id"])
+    dados = dados_pdf(nota, empresa)
+    versao = versao_pdf(dados)
+
+    item = cache_pdf.obter(nota_id)
+    if item is not None and item["versao"] == versao:
+        return item["pdf"]
+
+    pdf = await pool_pdf.executar(desenhar_pdf, dados)
+    if guardar_em_cache:
+        cache_pdf.definir(nota_id, {"versao": versao, "empresa_id": str(nota.get("empresa_id")), "pdf": pdf})
+    return pdf
+
+
+# ---------- Exportação em ZIP ----------
+class _SaidaZip:
+    """
+    Destino do ZipFile que só acumula o que foi escrito, para ser enviado e
+    descartado a cada arquivo. Sem seek, o zipfile grava cada entrada com
+    data descriptor e o ZIP nunca fica inteiro em memória.
+    """
+
+    def __init__(self):
+        self._partes = []
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def retirar(self):
+        dados = b"".join(self._partes)
+        self._partes = []
+        return dados
+
+
+async def gerar_zip_pdfs(notas, empresa: dict, concorrencia: int = PDF_ZIP_CONCORRENCIA):
+    """
+    Gera os bytes de um ZIP com o PDF de cada nota de `notas` (iterável
+    assíncrono, ex.: cursor do Motor), à medida que os PDFs ficam prontos.
+    No máximo `concorrencia` PDFs ficam em andamento. Notas que falharem são
+    listadas em ERROS.txt no final do arquivo.
+    """
+    saida = _SaidaZip()
+    nomes_usados = set()
+    falhas = []
+    pendentes = set()
+
+    async def renderizar(nota):
+        try:
+            return nota, await renderizar_pdf(nota, empresa, guardar_em_cache=False), None
+        except Exception as e:
+            logger.error(f"Falha ao gerar PDF da nota {nota.get('_id')}: {str(e)}")
+            return nota, None, str(e)
+
+    def nome_entrada(nota):
+        base = f"nota_{nota.get('numero_nota', nota['_id'])}"
+        nome, sufixo = f"{base}.pdf", 2
+        while nome in nomes_usados:
+            nome, sufixo = f"{base}_{sufixo}.pdf", sufixo + 1
+        nomes_usados.add(nome)
+        return nome
+
+    def escrever(arquivo_zip, concluidas):
+        for tarefa in concluidas:
+            nota, pdf, erro = tarefa.result()
+            if erro is not None:
+                falhas.append(f"Nota {nota.get('numero_nota')} ({nota['_id']}): {erro}")
+                continue
+            info = zipfile.ZipInfo(nome_entrada(nota), date_time=time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_DEFLATED
+            arquivo_zip.writestr(info, pdf)
+
+    with zipfile.ZipFile(saida, "w", zipfile.ZIP_DEFLATED) as arquivo_zip:
+        try:
+            async for nota in notas:
+                pendentes.add(asyncio.create_task(renderizar(nota)))
+                # Janela cheia: espera o primeiro PDF antes de ler a próxima nota do cursor
+                if len(pendentes) >= concorrencia:
+                    concluidas, pendentes = await asyncio.wait(pendentes, return_when=asyncio.FIRST_COMPLETED)
+                    escrever(arquivo_zip, concluidas)
+                    yield saida.retirar()
+
+            while pendentes:
+                concluidas, pendentes = await asyncio.wait(pendentes, return_when=asyncio.FIRST_COMPLETED)
+                escrever(arquivo_zip, concluidas)
+                yield saida.retirar()
+
+            if falhas:
+                arquivo_zip.writestr("ERROS.txt", "\n".join(falhas))
+        finally:
+            # Cliente desconectou no meio: não deixa PDFs sendo desenhados à toa
+            for tarefa in pendentes:
+                tarefa.cancel()
+
+    # Diretório central do ZIP
+    yield saida.retirar()
+
+
+def invalidar_nota(nota_id):
+    cache_pdf.invalidar(str(nota_id))
+
+
+def invalidar_empresa(empresa_id):
+    empresa_id = str(empresa_id)
+    cache_pdf.invalidar_se(lambda _, item: item["empresa_id"] == empresa_id)
+
+
+def encerrar_pool_pdf():
+    pool_pdf.encerrar()
@@ -0,0 +1,69 @@
+import asyncio
+import logging
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+class PoolExecucao:
+    """
+    Pool para trabalho de CPU fora do event loop, com limite de tarefas em
+    andamento por processo da API.
+
+    `tipo` "process" usa todos os núcleos; "thread" serve para ambientes sem
+    fork/multiprocessing (e é o fallback se o pool de processos não subir).
+    O executor é criado no primeiro uso.
+    """
+
+    def __init__(self, nome: str, tipo: str, workers: int, max_concorrencia: int):
+        self.nome = nome
+        self.tipo = tipo
+        self.workers = workers
+        self.max_concorrencia = max_concorrencia
+        self._executor = None
+        self._semaforo = None
+
+    def _criar_executor(self):
+        if self.tipo == "process":
+            try:
+                executor = ProcessPoolExecutor(max_workers=self.workers)
+                logger.info(f"Pool {self.nome} usando {self.workers} processos")
+                return executor
+            except (OSError, NotImplementedError, ImportError) as e:
+                logger.warning(f"Pool de processos indisponível para {self.nome} ({str(e)}), usando threads")
+
+        logger.info(f"Pool {self.nome} usando {self.workers} threads")
+        return ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.nome)
+
+    def obter_executor(self):
+        if self._executor is None:
+            self._executor = self._criar_executor()
+        return self._executor
+
+    def _obter_semaforo(self):
+        if self._semaforo is None:
+            self._semaforo = asyncio.Semaphore(self.max_concorrencia)
+        return self._semaforo
+
+    async def executar(self, funcao, *args):
+        """
+        Executa `funcao(*args)` no pool sem bloquear o event loop.
+        Se o pool de processos quebrar (ex.: worker morto), troca para threads e tenta de novo.
+        """
+        loop = asyncio.get_running_loop()
+
+        async with self._obter_semaforo():
+            try:
+                return await loop.run_in_executor(self.obter_executor(), funcao, *args)
+            except BrokenProcessPool:
+                logger.error(f"Pool de processos {self.nome} quebrado, recriando com threads")
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix=self.nome)
+                return await loop.run_in_executor(self._executor, funcao, *args)
+
+    def encerrar(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True, cancel_futures=True)
+            self._executor = None
+        self._semaforo = None
@@ -0,0 +1,419 @@
+"""
+Motor de regras da auditoria de notas.
+
+As regras de cada regime tributário são declaradas em REGRAS_POR_REGIME. Para
+cada empresa elas são compiladas uma vez (RegrasEmpresa: conjuntos e dicts
+prontos para consulta) e guardadas em cache pela versão dos campos da empresa
+que as regras usam: uma alteração feita por outro processo da API gera outra
+versão assim que a empresa recebida (do cache de empresas) estiver atualizada.
+
+Cada regra recebe o lote inteiro de notas e devolve, para cada nota, None ou
+(status, mensagem). O status final da nota é o mais grave entre as regras,
+e as mensagens de todas as regras que dispararam são mantidas.
+"""
+import hashlib
+import json
+import os
+import logging
+from collections import defaultdict
+from datetime import datetime
+from dotenv import load_dotenv
+from utils.cache import CacheTTL
+from utils import resumo_mensal
+from utils.campos_nota import centavos_nota, para_reais
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+APROVADA = "APROVADA"
+ERRO_CNAE = "ERRO_CNAE"
+ERRO_IMPOSTO = "ERRO_IMPOSTO"
+ALERTA = "ALERTA"
+
+MENSAGEM_APROVADA = "Nota fiscal em conformidade"
+
+# Ordem de gravidade: o status da nota é o mais grave entre as regras que dispararam
+GRAVIDADE = {APROVADA: 0, ALERTA: 1, ERRO_IMPOSTO: 2, ERRO_CNAE: 3}
+
+# Percentual do limite anual a partir do qual o RBT12 gera ALERTA (mesmo critério do Monitor RBT12)
+RBT12_PERCENTUAL_ALERTA = 80
+# Nota com valor acima de N vezes o ticket médio dos últimos 12 meses gera ALERTA
+AUDITORIA_FATOR_OUTLIER = float(os.getenv("AUDITORIA_FATOR_OUTLIER", "10"))
+# Mínimo de notas no histórico para o ticket médio ser considerado
+AUDITORIA_MINIMO_HISTORICO = int(os.getenv("AUDITORIA_MINIMO_HISTORICO", "10"))
+
+# Campos da empresa usados na compilação das regras (definem a versão em cache)
+CAMPOS_REGRAS = ("regime_tributario", "cnaes_permitidos", "data_abertura", "limite_faturamento_anual")
+
+CACHE_REGRAS_TTL = int(os.getenv("CACHE_REGRAS_TTL", "300"))
+cache_regras = CacheTTL(int(os.getenv("CACHE_REGRAS_TAMANHO", "5000")), CACHE_REGRAS_TTL)
+
+
+def calcular_limite_anual(empresa: dict):
+    # Obtem limite da empresa (padrão MEI: R$ 81.000,00)
+    limite_anual = 81000.00  # Padrão MEI
+
+    # Se houver limite cadastrado, usa ele
+    if "limite_faturamento_anual" in empresa:
+        limite_anual = float(empresa["limite_faturamento_anual"])
+    elif empresa.get("regime_tributario") == "Simples Nacional":
+        limite_anual = 4800000.00  # Limite Simples Nacional
+    elif empresa.get("regime_tributario") == "Lucro Presumido":
+        limite_anual = 78000000.00  # Limite Lucro Presumido
+
+    return limite_anual
+
+
+def _data_iso(valor):
+    """
+    "YYYY-MM-DD" de uma data de emissão/abertura (datetime, ISO ou DD/MM/AAAA); None se não reconhecer.
+    """
+    if not valor:
+        return None
+    if isinstance(valor, datetime):
+        return valor.strftime("%Y-%m-%d")
+    texto = str(valor).strip()
+    if len(texto) >= 10 and texto[4] == "-" and texto[7] == "-":
+        return texto[:10]
+    try:
+        return datetime.strptime(texto[:10], "%d/%m/%Y").strftime("%Y-%m-%d")
+    except ValueError:
+        return None
+
+
+def documento_valido(documento: str):
+    """
+    Valida os dígitos verificadores de um CPF (11 dígitos) ou CNPJ (14 dígitos).
+    """
+    digitos = "".join([n for n in documento or "" if n.isdigit()])
+    if len(digitos) not in (11, 14) or len(set(digitos)) == 1:
+        return False
+
+    if len(digitos) == 11:
+        series = [list(range(10, 1, -1)), list(range(11, 1, -1))]
+    else:
+        series = [[5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2], [6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2]]
+
+    for posicao, pesos in enumerate(series, len(digitos) - 2):
+        soma = sum(int(d) * p for d, p in zip(digitos, pesos))
+        resto = soma % 11
+        esperado = 0 if resto < 2 else 11 - resto
+        if int(digitos[posicao]) != esperado:
+            return False
+    return True
+
+
+class RegrasEmpresa:
+    """
+    Regras de uma empresa já compiladas: o que cada regra precisa da empresa
+    fica pré-calculado aqui, e a avaliação de uma nota não percorre listas.
+    """
+
+    def __init__(self, empresa: dict):
+        self.empresa_id = str(empresa["_id"])
+        self.regime = empresa.get("regime_tributario")
+        self.regras = REGRAS_POR_REGIME.get(self.regime, REGRAS_PADRAO)
+        # codigo_servico_municipal -> CNAE permitido
+        self.servicos_permitidos = {
+            cnae.get("codigo_servico_municipal"): cnae
+            for cnae in empresa.get("cnaes_permitidos", [])
+            if cnae.get("codigo_servico_municipal")
+        }
+        self.limite_anual = calcular_limite_anual(empresa)
+        self.limite_alerta = self.limite_anual * RBT12_PERCENTUAL_ALERTA / 100
+        self.data_abertura = _data_iso(empresa.get("data_abertura"))
+
+
+# ---------- Regras ----------
+# Assinatura: regra(regras, notas, contexto) -> lista com None ou (status, mensagem) por nota
+
+def mensagem_servico_nao_autorizado(codigo):
+    return f"Código de serviço '{codigo}' não autorizado para este CNPJ"
+
+
+def regra_servico_permitido(regras: RegrasEmpresa, notas: list, contexto: dict):
+    resultado = []
+    for nota in notas:
+        codigo = nota.get("codigo_servico_utilizado")
+        if codigo in regras.servicos_permitidos:
+            resultado.append(None)
+        else:
+            resultado.append((ERRO_CNAE, mensagem_servico_nao_autorizado(codigo)))
+    return resultado
+
+
+def regra_limite_rbt12(regras: RegrasEmpresa, notas: list, contexto: dict):
+    """
+    Faturamento dos 12 meses terminando no mês da nota (resumo mensal + notas
+    do próprio lote, na ordem do lote) comparado ao limite anual do regime.
+    As somas são feitas em centavos.
+    """
+    faturamento_mes = dict(contexto["faturamento_mes"])
+    resultado = []
+    for nota in notas:
+        mes = resumo_mensal.mes_referencia(nota["data_emissao"])
+        faturamento_mes[mes] = faturamento_mes.get(mes, 0) + centavos_nota(nota)
+        rbt12 = para_reais(sum(faturamento_mes.get(m, 0) for m in contexto["janela_rbt12"][mes]))
+
+        if rbt12 > regras.limite_anual:
+            resultado.append((ERRO_IMPOSTO, (
+                f"Faturamento dos últimos 12 meses (R$ {rbt12:.2f}) ultrapassa o limite "
+                f"do regime (R$ {regras.limite_anual:.2f})"
+            )))
+        elif rbt12 >= regras.limite_alerta:
+            resultado.append((ALERTA, (
+                f"Faturamento dos últimos 12 meses (R$ {rbt12:.2f}) acima de "
+                f"{RBT12_PERCENTUAL_ALERTA}% do limite do regime"
+            )))
+        else:
+            resultado.append(None)
+    return resultado
+
+
+def regra_valor_atipico(regras: RegrasEmpresa, notas: list, contexto: dict):
+    ticket_medio = contexto["ticket_medio"]
+    resultado = []
+    for nota in notas:
+        valor = para_reais(centavos_nota(nota))
+        if valor <= 0:
+            resultado.append((ALERTA, "Nota com valor zerado ou negativo"))
+        elif ticket_medio and valor > ticket_medio * AUDITORIA_FATOR_OUTLIER:
+            resultado.append((ALERTA, (
+                f"Valor R$ {valor:.2f} muito acima do ticket médio da empresa (R$ {ticket_medio:.2f})"
+            )))
+        else:
+            resultado.append(None)
+    return resultado
+
+
+def regra_tomador_valido(regras: RegrasEmpresa, notas: list, contexto: dict):
+    resultado = []
+    validos = {}
+    for nota in notas:
+        documento = nota.get("cnpj_tomador")
+        # Tomador não informado (ex.: pessoa física sem CPF) não é erro
+        if not documento:
+            resultado.append(None)
+            continue
+        if documento not in validos:
+            validos[documento] = documento_valido(documento)
+        resultado.append(None if validos[documento] else (ALERTA, f"CPF/CNPJ do tomador inválido: {documento}"))
+    return resultado
+
+
+def regra_data_emissao(regras: RegrasEmpresa, notas: list, contexto: dict):
+    hoje = contexto["hoje"]
+    resultado = []
+    for nota in notas:
+        data = _data_iso(nota.get("data_emissao"))
+        if data and regras.data_abertura and data < regras.data_abertura:
+            resultado.append((ALERTA, f"Data de emissão anterior à abertura da empresa ({regras.data_abertura})"))
+        elif data and data > hoje:
+            resultado.append((ALERTA, "Data de emissão no futuro"))
+        else:
+            resultado.append(None)
+    return resultado
+
+
+REGRAS_PADRAO = [regra_servico_permitido, regra_valor_atipico, regra_tomador_valido, regra_data_emissao]
+
+REGRAS_POR_REGIME = {
+    "MEI": [regra_servico_permitido, regra_limite_rbt12, regra_valor_atipico, regra_tomador_valido, regra_data_emissao],
+    "Simples Nacional": [regra_servico_permitido, regra_limite_rbt12, regra_valor_atipico, regra_tomador_valido, regra_data_emissao],
+    "Lucro Presumido": REGRAS_PADRAO,
+}
+
+
+# ---------- Compilação e cache ----------
+def versao_regras(empresa: dict):
+    bruto = json.dumps([empresa.get(campo) for campo in CAMPOS_REGRAS], sort_keys=True, default=str)
+    return hashlib.sha256(bruto.encode()).hexdigest()
+
+
+def obter_regras(empresa: dict):
+    """
+    Regras compiladas da empresa. A chave inclui a versão dos campos usados,
+    então uma empresa alterada nunca é auditada com as regras antigas.
+    """
+    empresa_id = str(empresa["_id"])
+    chave = f"{empresa_id}:{versao_regras(empresa)}"
+    regras = cache_regras.obter(chave)
+    if regras is None:
+        regras = RegrasEmpresa(empresa)
+        # Versões anteriores da mesma empresa não serão mais usadas
+        cache_regras.invalidar_se(lambda c, _: c.startswith(f"{empresa_id}:"))
+        cache_regras.definir(chave, regras)
+    return regras
+
+
+def invalidar_regras(empresa_id):
+    prefixo = f"{empresa_id}:"
+    cache_regras.invalidar_se(lambda chave, _: chave.startswith(prefixo))
+
+
+# ---------- Avaliação ----------
+async def carregar_contexto(db, regras: RegrasEmpresa, notas: list):
+    """
+    Dados do banco que as regras usam, lidos uma vez por lote: faturamento dos
+    meses que as janelas de 12 meses das notas cobrem e o ticket médio recente.
+    """
+    hoje = datetime.utcnow()
+    meses_notas = {resumo_mensal.mes_referencia(nota["data_emissao"]) for nota in notas}
+    janelas = {}
+    for mes in meses_notas:
+        ano, numero = int(mes[:4]), int(mes[5:7])
+        janelas[mes] = resumo_mensal.meses_anteriores(datetime(ano, numero, 1), 12)
+    meses_atuais = resumo_mensal.meses_anteriores(hoje, 12)
+
+    todos_meses = set(meses_atuais)
+    for janela in janelas.values():
+        todos_meses.update(janela)
+
+    # Faturamento por mês em centavos
+    faturamento_mes = defaultdict(int)
+    quantidade_recente = 0
+    centavos_recente = 0
+    async for resumo in db.resumo_mensal.find(
+        {"empresa_id": regras.empresa_id, "mes": {"$in": sorted(todos_meses)}},
+        {"mes": 1, "valor_centavos": 1, "valor_total": 1, "quantidade": 1}
+    ):
+        centavos = resumo_mensal.centavos_resumo(resumo)
+        faturamento_mes[resumo["mes"]] += centavos
+        if resumo["mes"] in meses_atuais:
+            quantidade_recente += resumo.get("quantidade", 0)
+            centavos_recente += centavos
+
+    ticket_medio = None
+    if quantidade_recente >= AUDITORIA_MINIMO_HISTORICO:
+        ticket_medio = para_reais(centavos_recente) / quantidade_recente
+
+    return {
+        "hoje": hoje.strftime("%Y-%m-%d"),
+        "faturamento_mes": faturamento_mes,
+        "janela_rbt12": janelas,
+        "ticket_medio": ticket_medio,
+    }
+
+
+def _combinar(achados: list):
+    if not achados:
+        return APROVADA, MENSAGEM_APROVADA
+    achados = sorted(achados, key=lambda achado: GRAVIDADE[achado[0]], reverse=True)
+    return achados[0][0], "; ".join(mensagem for _, mensagem in achados)
+
+
+def avaliar_lote(regras: RegrasEmpresa, notas: list, contexto: dict):
+    """
+    Aplica as regras do regime ao lote. Retorna, por nota e na mesma ordem, os
+    campos de auditoria a gravar:
+
+    - status_auditoria / mensagem_erro: resultado de todas as regras;
+    - status_regras / mensagem_regras: resultado sem a regra de código de
+      serviço, usado pela reauditoria quando os CNAEs da empresa mudam.
+    """
+    achados = [[] for _ in notas]
+    for regra in regras.regras:
+        for i, achado in enumerate(regra(regras, notas, contexto)):
+            if achado is not None:
+                achados[i].append(achado)
+
+    resultado = []
+    for lista in achados:
+        status, mensagem = _combinar(lista)
+        status_regras, mensagem_regras = _combinar([achado for achado in lista if achado[0] != ERRO_CNAE])
+        resultado.append({
+            "status_auditoria": status,
+            "mensagem_erro": mensagem,
+            "status_regras": status_regras,
+            "mensagem_regras": mensagem_regras,
+        })
+    return resultado
+
+
+async def auditar_notas(db, empresa: dict, notas: list):
+    """
+    Audita um lote de documentos de nota, preenchendo os campos de auditoria.
+    """
+    if not notas:
+        return notas
+    regras = obter_regras(empresa)
+    contexto = await carregar_contexto(db, regras, notas)
+    for nota, campos in zip(notas, avaliar_lote(regras, notas, contexto)):
+        nota.update(campos)
+    return notas
+
+
+# ---------- Reauditoria ----------
+async def reauditar_servicos(db, empresa: dict):
+    """
+    Reaplica a regra de código de serviço a todas as notas da empresa depois de
+    uma mudança em cnaes_permitidos, direto no banco: um update_many para os
+    códigos que passaram a ser permitidos e um por código não permitido (a
+    mensagem cita o código). As demais regras não dependem dos CNAEs e o
+    resultado delas já está gravado em status_regras/mensagem_regras.
+
+    Ajusta a contagem por status do resumo mensal e retorna
+    {"notas_alteradas", "por_codigo"}.
+    """
+    invalidar_regras(empresa["_id"])
+    regras = obter_regras(empresa)
+    filtro_empresa = {"empresa_id": regras.empresa_id}
+    # Notas anteriores ao motor de regras não têm status_regras: sem CNAE, ficam aprovadas
+    status_sem_cnae = {"$ifNull": ["$status_regras", APROVADA]}
+
+    grupos = []
+    codigos = await db.notas_fiscais.distinct("codigo_servico_utilizado", filtro_empresa)
+
+    liberados = [codigo for codigo in codigos if codigo in regras.servicos_permitidos]
+    if liberados:
+        grupos.append((
+            "permitidos",
+            {**filtro_empresa, "codigo_servico_utilizado": {"$in": liberados}, "status_auditoria": ERRO_CNAE},
+            status_sem_cnae,
+            {
+                "status_auditoria": status_sem_cnae,
+                "mensagem_erro": {"$ifNull": ["$mensagem_regras", MENSAGEM_APROVADA]},
+            },
+        ))
+
+    for codigo in codigos:
+        if codigo in regras.servicos_permitidos:
+            continue
+        mensagem = mensagem_servico_nao_autorizado(codigo)
+        grupos.append((
+            codigo,
+            {**filtro_empresa, "codigo_servico_utilizado": codigo, "status_auditoria": {"$ne": ERRO_CNAE}},
+            ERRO_CNAE,
+            {
+                "status_auditoria": ERRO_CNAE,
+                # Mantém as mensagens das outras regras depois da mensagem do CNAE
+                "mensagem_erro": {"$cond": [
+                    {"$eq": [status_sem_cnae, APROVADA]},
+                    mensagem,
+                    {"$concat": [mensagem, "; ", "$mensagem_regras"]},
+                ]},
+            },
+        ))
+
+    movimentos = []
+    por_codigo = {}
+    for chave, filtro, novo_status, campos in grupos:
+        # Quantas notas mudam de status em cada mês, para o resumo mensal
+        async for grupo in db.notas_fiscais.aggregate([
+            {"$match": filtro},
+            {"$group": {
+                "_id": {"mes": resumo_mensal.EXPRESSAO_MES, "de": "$status_auditoria", "para": novo_status},
+                "quantidade": {"$sum": 1},
+            }},
+        ]):
+            movimentos.append({**grupo["_id"], "quantidade": grupo["quantidade"]})
+
+        resultado = await db.notas_fiscais.update_many(filtro, [{"$set": campos}])
+        if resultado.modified_count:
+            por_codigo[chave] = resultado.modified_count
+
+    await resumo_mensal.mover_status(db, regras.empresa_id, movimentos)
+
+    return {"notas_alteradas": sum(por_codigo.values()), "por_codigo": por_codigo}
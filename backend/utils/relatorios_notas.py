@@ -0,0 +1,322 @@
+"""
+Relatórios de notas em Excel (.xlsx) e CSV.
+
+As planilhas usam o modo write-only do openpyxl: cada lote lido do cursor (já
+projetado) é escrito no arquivo temporário da aba e descartado, e as células
+só referenciam estilos nomeados registrados uma vez por arquivo, em vez de um
+Font/PatternFill por célula. A escrita roda no pool de relatórios (threads),
+fora do event loop; o .xlsx pronto fica em disco e é enviado em pedaços. O CSV
+é formatado e enviado lote a lote, sem arquivo intermediário.
+"""
+import asyncio
+import csv
+import io
+import os
+import re
+import tempfile
+import threading
+from datetime import datetime
+from dotenv import load_dotenv
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import NamedStyle, Font, PatternFill, Alignment
+from openpyxl.utils import get_column_letter
+from utils.pool_execucao import PoolExecucao
+from utils import campos_nota
+
+load_dotenv()
+
+RELATORIO_WORKERS = int(os.getenv("RELATORIO_WORKERS", "2"))
+# Relatórios .xlsx sendo gerados ao mesmo tempo e lotes de CSV sendo formatados
+# (por processo da API)
+RELATORIO_MAX_CONCORRENCIA = int(os.getenv("RELATORIO_MAX_CONCORRENCIA", str(RELATORIO_WORKERS)))
+# Notas lidas do cursor e escritas por vez
+RELATORIO_TAMANHO_LOTE = int(os.getenv("RELATORIO_TAMANHO_LOTE", "500"))
+
+MEDIA_TYPE_XLSX = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+MEDIA_TYPE_CSV = "text/csv; charset=utf-8"
+
+# Campos da nota lidos para os relatórios (projeção da consulta)
+PROJECAO_RELATORIO = {
+    "numero_nota": 1,
+    "data_emissao": 1,
+    "codigo_servico_utilizado": 1,
+    "cnpj_tomador": 1,
+    "valor_centavos": 1,
+    "valor_total": 1,
+    "status_auditoria": 1,
+    "mensagem_erro": 1,
+    "chave_validacao": 1,
+}
+
+# Threads: o Workbook em construção não pode ser enviado a outro processo
+pool_relatorios = PoolExecucao("relatorios", "thread", RELATORIO_WORKERS, RELATORIO_MAX_CONCORRENCIA)
+# O semáforo do pool vale por lote; este vale pelo .xlsx inteiro (criado no primeiro uso)
+_semaforo_xlsx = None
+
+
+# ---------- Colunas ----------
+def _data_nota(nota: dict):
+    try:
+        return campos_nota.para_data(nota.get("data_emissao"))
+    except ValueError:
+        return nota.get("data_emissao")
+
+
+# (título, largura no Excel, tipo, valor); o tipo escolhe o estilo e a formatação no CSV
+COLUNAS_INCONSISTENCIAS = [
+    ("Número da Nota", 15, "texto", lambda n: n.get("numero_nota")),
+    ("Data de Emissão", 15, "data", _data_nota),
+    ("Código de Serviço", 18, "texto", lambda n: n.get("codigo_servico_utilizado")),
+    ("Valor (R$)", 12, "moeda", campos_nota.centavos_nota),
+    ("Status", 15, "texto", lambda n: n.get("status_auditoria")),
+    ("Erro Encontrado", 50, "texto", lambda n: n.get("mensagem_erro")),
+]
+
+COLUNAS_NOTAS = [
+    ("Número da Nota", 15, "texto", lambda n: n.get("numero_nota")),
+    ("Data de Emissão", 15, "data", _data_nota),
+    ("Código de Serviço", 18, "texto", lambda n: n.get("codigo_servico_utilizado")),
+    ("CNPJ Tomador", 20, "texto", lambda n: n.get("cnpj_tomador")),
+    ("Valor (R$)", 14, "moeda", campos_nota.centavos_nota),
+    ("Status", 15, "texto", lambda n: n.get("status_auditoria")),
+    ("Mensagem", 50, "texto", lambda n: n.get("mensagem_erro")),
+    ("Chave de Validação", 25, "texto", lambda n: n.get("chave_validacao")),
+]
+
+
+# ---------- Excel ----------
+_FONTE_CABECALHO = Font(bold=True, color="FFFFFF")
+_CENTRALIZADO = Alignment(horizontal="center")
+_FUNDO_ERRO = PatternFill(start_color="FFE6E6", end_color="FFE6E6", fill_type="solid")
+_FORMATO_DATA = "DD/MM/YYYY"
+_FORMATO_MOEDA = "#,##0.00"
+
+
+def _estilos_nomeados():
+    """
+    Estilos registrados em cada workbook. Um NamedStyle pertence a um único
+    workbook, por isso são criados de novo a cada arquivo.
+    """
+    return [
+        NamedStyle("titulo", font=Font(size=14, bold=True)),
+        NamedStyle("cabecalho", font=_FONTE_CABECALHO, alignment=_CENTRALIZADO,
+                   fill=PatternFill(start_color="1E40AF", end_color="1E40AF", fill_type="solid")),
+        NamedStyle("cabecalho_erro", font=_FONTE_CABECALHO, alignment=_CENTRALIZADO,
+                   fill=PatternFill(start_color="FF0000", end_color="FF0000", fill_type="solid")),
+        NamedStyle("data", number_format=_FORMATO_DATA),
+        NamedStyle("moeda", number_format=_FORMATO_MOEDA),
+        NamedStyle("erro_texto", fill=_FUNDO_ERRO),
+        NamedStyle("erro_data", fill=_FUNDO_ERRO, number_format=_FORMATO_DATA),
+        NamedStyle("erro_moeda", fill=_FUNDO_ERRO, number_format=_FORMATO_MOEDA),
+    ]
+
+
+def titulo_aba(texto: str, usados: set):
+    """
+    Nome de aba válido no Excel (até 31 caracteres, sem []:*?/\\) e único no arquivo.
+    """
+    base = " ".join(re.sub(r"[\[\]:*?/\\]", " ", texto or "").split())[:31] or "Notas"
+    titulo, sufixo = base, 2
+    while titulo.lower() in usados:
+        titulo = f"{base[:31 - len(str(sufixo)) - 1]} {sufixo}"
+        sufixo += 1
+    usados.add(titulo.lower())
+    return titulo
+
+
+class ArquivoXlsx:
+    """
+    Workbook write-only escrito em etapas (nova_aba, escrever, salvar), cada
+    uma chamada no pool de relatórios enquanto o cursor é lido no event loop.
+    """
+
+    def __init__(self):
+        self.workbook = Workbook(write_only=True)
+        for estilo in _estilos_nomeados():
+            self.workbook.add_named_style(estilo)
+        self._titulos = set()
+        # Uma etapa por vez, e descartar espera a etapa em andamento terminar
+        self._trava = threading.Lock()
+        self._aba = None
+        self._colunas = None
+        self._destacar_erros = False
+
+    def _celula(self, valor, estilo=None):
+        celula = WriteOnlyCell(self._aba, value=valor)
+        if estilo:
+            celula.style = estilo
+        return celula
+
+    def nova_aba(self, titulo: str, topo: list, colunas: list, destacar_erros: bool = False):
+        """
+        Cria a aba com as linhas de `topo` (textos; a primeira com o estilo de
+        título) e o cabeçalho das colunas. Com `destacar_erros`, as notas não
+        aprovadas ficam com fundo vermelho claro.
+        """
+        with self._trava:
+            self._nova_aba(titulo, topo, colunas, destacar_erros)
+
+    def _nova_aba(self, titulo: str, topo: list, colunas: list, destacar_erros: bool):
+        self._aba = self.workbook.create_sheet(titulo_aba(titulo, self._titulos))
+        self._colunas = colunas
+        self._destacar_erros = destacar_erros
+
+        # No modo write-only as larguras precisam ser definidas antes da primeira linha
+        for indice, (_, largura, _, _) in enumerate(colunas, 1):
+            self._aba.column_dimensions[get_column_letter(indice)].width = largura
+
+        for indice, texto in enumerate(topo):
+            self._aba.append([self._celula(texto, "titulo" if indice == 0 else None)])
+        if topo:
+            self._aba.append([])
+
+        estilo_cabecalho = "cabecalho_erro" if destacar_erros else "cabecalho"
+        self._aba.append([self._celula(titulo_coluna, estilo_cabecalho) for titulo_coluna, _, _, _ in colunas])
+
+    def escrever(self, notas: list):
+        with self._trava:
+            self._escrever(notas)
+
+    def _escrever(self, notas: list):
+        for nota in notas:
+            erro = self._destacar_erros and nota.get("status_auditoria") != "APROVADA"
+            linha = []
+            for _, _, tipo, valor in self._colunas:
+                conteudo = valor(nota)
+                if tipo == "moeda":
+                    conteudo = campos_nota.para_reais(conteudo)
+                if erro:
+                    estilo = f"erro_{tipo}"
+                else:
+                    estilo = tipo if tipo != "texto" else None
+                linha.append(self._celula(conteudo, estilo))
+            self._aba.append(linha)
+
+    def salvar(self, caminho: str):
+        """
+        Grava o .xlsx em `caminho`. O openpyxl apaga os temporários das abas ao salvar.
+        """
+        with self._trava:
+            self.workbook.save(caminho)
+
+    def descartar(self):
+        """
+        Apaga os temporários das abas de um workbook que não vai ser salvo
+        (senão ficariam no disco até o processo terminar).
+        """
+        with self._trava:
+            for aba in self.workbook.worksheets:
+                escritor = aba._writer
+                if escritor is None or not os.path.exists(escritor.out):
+                    continue
+                try:
+                    if aba._rows is not None:
+                        aba._rows.close()
+                    escritor.close()
+                except Exception:
+                    pass
+                escritor.cleanup()
+
+
+async def _lotes(cursor):
+    lote = []
+    async for nota in cursor:
+        lote.append(nota)
+        if len(lote) >= RELATORIO_TAMANHO_LOTE:
+            yield lote
+            lote = []
+    if lote:
+        yield lote
+
+
+def _obter_semaforo_xlsx():
+    global _semaforo_xlsx
+    if _semaforo_xlsx is None:
+        _semaforo_xlsx = asyncio.Semaphore(RELATORIO_MAX_CONCORRENCIA)
+    return _semaforo_xlsx
+
+
+async def gerar_xlsx(abas: list):
+    """
+    Escreve um .xlsx com uma aba por item de `abas` (dicts com titulo, topo,
+    colunas, cursor e, opcional, destacar_erros) e devolve o caminho do
+    arquivo temporário; quem envia o arquivo passa a ser responsável por
+    removê-lo. Se a geração falhar (ou a requisição for cancelada) os
+    temporários são apagados aqui.
+    """
+    async with _obter_semaforo_xlsx():
+        descritor, caminho = tempfile.mkstemp(prefix="relatorio_", suffix=".xlsx")
+        os.close(descritor)
+        arquivo = None
+        try:
+            arquivo = await pool_relatorios.executar(ArquivoXlsx)
+            for aba in abas:
+                await pool_relatorios.executar(
+                    arquivo.nova_aba, aba["titulo"], aba.get("topo", []), aba["colunas"], aba.get("destacar_erros", False)
+                )
+                async for lote in _lotes(aba["cursor"]):
+                    await pool_relatorios.executar(arquivo.escrever, lote)
+            await pool_relatorios.executar(arquivo.salvar, caminho)
+        except BaseException:
+            if arquivo is not None:
+                await asyncio.shield(pool_relatorios.executar(arquivo.descartar))
+            remover_arquivo(caminho)
+            raise
+    return caminho
+
+
+def remover_arquivo(caminho: str):
+    try:
+        os.remove(caminho)
+    except FileNotFoundError:
+        pass
+
+
+# ---------- CSV ----------
+def _valor_csv(tipo: str, valor):
+    """
+    Formato que o Excel em português abre direto: data DD/MM/AAAA e vírgula decimal.
+    """
+    if valor is None:
+        return ""
+    if tipo == "data" and isinstance(valor, datetime):
+        return valor.strftime("%d/%m/%Y")
+    if tipo == "moeda":
+        # Centavos inteiros; o sinal vai à parte porque // e % arredondam para baixo
+        sinal = "-" if valor < 0 else ""
+        return f"{sinal}{abs(valor) // 100},{abs(valor) % 100:02d}"
+    return valor
+
+
+def linhas_csv(linhas: list):
+    saida = io.StringIO()
+    csv.writer(saida, delimiter=";", lineterminator="\r\n").writerows(linhas)
+    return saida.getvalue().encode("utf-8")
+
+
+def _formatar_lote_csv(notas: list, colunas: list, prefixo: list):
+    return linhas_csv([
+        prefixo + [_valor_csv(tipo, valor(nota)) for _, _, tipo, valor in colunas]
+        for nota in notas
+    ])
+
+
+async def gerar_csv(partes: list, colunas: list, colunas_prefixo: list = None):
+    """
+    Gera os bytes de um CSV (separador ";", UTF-8 com BOM) com as notas dos
+    cursores de `partes`, lote a lote. Cada parte é um dict com cursor e, se
+    `colunas_prefixo` for informado, os valores dessas colunas em "prefixo"
+    (ex.: CNPJ e razão social da empresa, no relatório de várias empresas).
+    """
+    cabecalho = list(colunas_prefixo or []) + [titulo for titulo, _, _, _ in colunas]
+    yield "\ufeff".encode("utf-8") + linhas_csv([cabecalho])
+    for parte in partes:
+        async for lote in _lotes(parte["cursor"]):
+            yield await pool_relatorios.executar(_formatar_lote_csv, lote, colunas, parte.get("prefixo", []))
+
+
+def encerrar_pool_relatorios():
+    global _semaforo_xlsx
+    pool_relatorios.encerrar()
+    _semaforo_xlsx = None
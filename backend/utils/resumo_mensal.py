@@ -0,0 +1,239 @@
+"""
+Resumo mensal das notas por empresa (coleção `resumo_mensal`).
+
+Cada documento guarda, para (empresa_id, mes "YYYY-MM"), o valor bruto em
+centavos (`valor_centavos`), a quantidade de notas e a contagem por status de auditoria. Ele é mantido com
+$inc a cada nota gravada ou excluída, então imposto do mês e RBT12 leem 1 e
+12 documentos pequenos em vez de agregar as notas.
+
+Para backfill ou correção de divergências (a partir da pasta backend, com as
+importações da empresa paradas: um $inc entre a agregação e a gravação se perde):
+
+    python -m utils.resumo_mensal --reconstruir [--empresa ID]
+"""
+import argparse
+import asyncio
+import os
+import logging
+from collections import defaultdict
+from datetime import datetime
+from pymongo import UpdateOne, ReplaceOne
+from dotenv import load_dotenv
+from utils.campos_nota import EXPRESSAO_CENTAVOS, centavos_nota, para_centavos, para_reais
+
+load_dotenv()
+
+logging.basicConfig(level=logging.INFO)
+logger = logging.getLogger(__name__)
+
+
+# Mês "YYYY-MM" de uma nota dentro de agregações; $toString de uma data começa
+# por "YYYY-MM-DD", então vale para datas e para notas antigas em texto ISO
+EXPRESSAO_MES = {"$substrBytes": [{"$toString": "$data_emissao"}, 0, 7]}
+
+
+def mes_referencia(data_emissao):
+    """
+    "YYYY-MM" da data de emissão de uma nota.
+    """
+    if isinstance(data_emissao, datetime):
+        return data_emissao.strftime('%Y-%m')
+    return str(data_emissao)[:7]
+
+
+def meses_anteriores(referencia: datetime, quantidade: int):
+    """
+    Lista `quantidade` meses terminando no mês de `referencia` (inclusive).
+    """
+    ano, mes = referencia.year, referencia.month
+    meses = []
+    for _ in range(quantidade):
+        meses.append(f"{ano:04d}-{mes:02d}")
+        mes -= 1
+        if mes == 0:
+            ano, mes = ano - 1, 12
+    return list(reversed(meses))
+
+
+async def registrar_notas(db, notas: list, sinal: int = 1):
+    """
+    Aplica no resumo as notas gravadas (sinal=1) ou excluídas (sinal=-1).
+    Agrupa por (empresa, mês) e envia um único bulk_write.
+    """
+    incrementos = defaultdict(lambda: defaultdict(int))
+    for nota in notas:
+        chave = (nota["empresa_id"], mes_referencia(nota["data_emissao"]))
+        incrementos[chave]["quantidade"] += sinal
+        incrementos[chave]["valor_centavos"] += sinal * centavos_nota(nota)
+        incrementos[chave][f"por_status.{nota['status_auditoria']}"] += sinal
+
+    if not incrementos:
+        return
+
+    operacoes = [
+        UpdateOne({"empresa_id": empresa_id, "mes": mes}, {"$inc": dict(campos)}, upsert=True)
+        for (empresa_id, mes), campos in incrementos.items()
+    ]
+
+    await db.resumo_mensal.bulk_write(operacoes, ordered=False)
+
+
+async def mover_status(db, empresa_id: str, movimentos: list):
+    """
+    Aplica mudanças de status de auditoria (reauditoria) na contagem por status.
+    `movimentos`: dicts com mes, de, para e quantidade.
+    """
+    operacoes = [
+        UpdateOne(
+            {"empresa_id": empresa_id, "mes": movimento["mes"]},
+            {"$inc": {
+                f"por_status.{movimento['de']}": -movimento["quantidade"],
+                f"por_status.{movimento['para']}": movimento["quantidade"],
+            }}
+        )
+        for movimento in movimentos
+        if movimento["de"] != movimento["para"]
+    ]
+    if operacoes:
+        await db.resumo_mensal.bulk_write(operacoes, ordered=False)
+
+
+async def remover_empresa(db, empresa_id: str):
+    await db.resumo_mensal.delete_many({"empresa_id": empresa_id})
+
+
+def centavos_resumo(resumo: dict):
+    """
+    Faturamento de um resumo em centavos. Resumos anteriores aos centavos têm
+    `valor_total` em float, que soma com os incrementos novos até a reconstrução.
+    """
+    return resumo.get("valor_centavos", 0) + para_centavos(resumo.get("valor_total"))
+
+
+async def somar_meses(db, empresa_id: str, meses: list):
+    """
+    Soma faturamento (valor_centavos e valor_total em reais) e quantidade dos meses informados.
+    """
+    centavos = 0
+    quantidade = 0
+    async for resumo in db.resumo_mensal.find(
+        {"empresa_id": empresa_id, "mes": {"$in": meses}},
+        {"valor_centavos": 1, "valor_total": 1, "quantidade": 1}
+    ):
+        centavos += centavos_resumo(resumo)
+        quantidade += resumo.get("quantidade", 0)
+    return {"valor_centavos": centavos, "valor_total": para_reais(centavos), "quantidade": quantidade}
+
+
+async def somar_meses_por_empresa(db, empresa_ids: list, meses: list):
+    """
+    Faturamento dos meses informados para várias empresas em uma única agregação.
+    Retorna {empresa_id: valor_total em reais}; empresas sem movimento ficam de fora.
+    """
+    if not empresa_ids:
+        return {}
+    pipeline = [
+        {"$match": {"empresa_id": {"$in": empresa_ids}, "mes": {"$in": meses}}},
+        {"$group": {
+            "_id": "$empresa_id",
+            "valor_centavos": {"$sum": "$valor_centavos"},
+            "valor_total": {"$sum": "$valor_total"}
+        }}
+    ]
+    return {
+        grupo["_id"]: para_reais(centavos_resumo(grupo))
+        async for grupo in db.resumo_mensal.aggregate(pipeline)
+    }
+
+
+async def converter_centavos(db):
+    """
+    Passa o `valor_total` (float, em reais) dos resumos antigos para
+    `valor_centavos`. Cada documento é convertido num update atômico que só
+    aplica se o `valor_total` lido não mudou; importações em andamento só
+    fazem $inc em `valor_centavos`, então a conversão roda com a API no ar.
+    Retorna a quantidade de resumos convertidos.
+    """
+    total = 0
+    async for resumo in db.resumo_mensal.find({"valor_total": {"$exists": True}}, {"valor_total": 1}):
+        resultado = await db.resumo_mensal.update_one(
+            {"_id": resumo["_id"], "valor_total": resumo["valor_total"]},
+            {"$inc": {"valor_centavos": para_centavos(resumo["valor_total"])}, "$unset": {"valor_total": ""}}
+        )
+        total += resultado.modified_count
+    return total
+
+
+async def reconstruir(db, empresa_id: str = None):
+    """
+    Recalcula o resumo a partir das notas (backfill e correção de divergências).
+    Meses sem notas são removidos. Retorna a quantidade de resumos gravados.
+
+    Não é seguro com importações da empresa em andamento: o $inc de uma nota
+    gravada entre a agregação e o ReplaceOne é sobrescrito (ou contado duas vezes).
+    """
+    filtro = {"empresa_id": empresa_id} if empresa_id else {}
+    pipeline = [
+        {"$match": filtro},
+        {"$group": {
+            "_id": {
+                "empresa_id": "$empresa_id",
+                "mes": EXPRESSAO_MES,
+                "status": "$status_auditoria"
+            },
+            "quantidade": {"$sum": 1},
+            "valor_centavos": {"$sum": EXPRESSAO_CENTAVOS}
+        }}
+    ]
+
+    # Junta os grupos por status em um documento por (empresa, mês)
+    resumos = {}
+    async for grupo in db.notas_fiscais.aggregate(pipeline, allowDiskUse=True):
+        chave = (grupo["_id"]["empresa_id"], grupo["_id"]["mes"])
+        resumo = resumos.setdefault(chave, {
+            "empresa_id": chave[0],
+            "mes": chave[1],
+            "quantidade": 0,
+            "valor_centavos": 0,
+            "por_status": {},
+        })
+        resumo["quantidade"] += grupo["quantidade"]
+        resumo["valor_centavos"] += grupo["valor_centavos"]
+        resumo["por_status"][grupo["_id"]["status"]] = grupo["quantidade"]
+
+    operacoes = [
+        ReplaceOne({"empresa_id": resumo["empresa_id"], "mes": resumo["mes"]}, resumo, upsert=True)
+        for resumo in resumos.values()
+    ]
+    if operacoes:
+        await db.resumo_mensal.bulk_write(operacoes, ordered=False)
+
+    # Remove meses que não têm mais notas
+    existentes = db.resumo_mensal.find(filtro, {"empresa_id": 1, "mes": 1})
+    async for resumo in existentes:
+        if (resumo["empresa_id"], resumo["mes"]) not in resumos:
+            await db.resumo_mensal.delete_one({"_id": resumo["_id"]})
+
+    return len(operacoes)
+
+
+async def _main():
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+    parser = argparse.ArgumentParser(description="Mantém a coleção resumo_mensal")
+    parser.add_argument("--reconstruir", action="store_true", help="Recalcula o resumo a partir das notas")
+    parser.add_argument("--empresa", help="Limita a reconstrução a uma empresa")
+    args = parser.parse_args()
+
+    if not args.reconstruir:
+        parser.print_help()
+        return
+
+    client = AsyncIOMotorClient(os.getenv("MONGO_URL", "mongodb://localhost:27017"))
+    total = await reconstruir(client.fiscal_facil, args.empresa)
+    print(f"{total} resumos mensais gravados.")
+    client.close()
+
+
+if __name__ == "__main__":
+    asyncio.run(_main())
@@ -3,6 +3,7 @@ import axios from 'axios';
 import ModalVisualizarNota from './ModalVisualizarNota';
 
 const API_URL = process.env.REACT_APP_BACKEND_URL || 'http://localhost:8001';
+const NOTAS_POR_PAGINA = 50;
 
 const ListaNotas = ({ empresaId, refreshTrigger }) => {
   const [notas, setNotas] = useState([]);
@@ -10,6 +11,8 @@ const ListaNotas = ({ empresaId, refreshTrigger }) => {
   const [loading, setLoading] = useState(true);
   const [excluindo, setExcluindo] = useState(null);
   const [notaSelecionada, setNotaSelecionada] = useState(null);
+  const [proximoCursor, setProximoCursor] = useState(null);
+  const [carregandoMais, setCarregandoMais] = useState(false);
 
   useEffect(() => {
     if (empresaId) {
@@ -20,8 +23,11 @@ const ListaNotas = ({ empresaId, refreshTrigger }) => {
 
   const carregarNotas = async () => {
     try {
-      const response = await axios.get(`${API_URL}/api/notas/empresa/${empresaId}`);
-      setNotas(response.data);
+      const response = await axios.get(`${API_URL}/api/notas/empresa/${empresaId}`, {
+        params: { limit: NOTAS_POR_PAGINA }
+      });
+      setNotas(response.data.notas);
+      setProximoCursor(response.data.proximo_cursor);
     } catch (error) {
       console.error('Erro ao carregar notas:', error);
     } finally {
@@ -29,6 +35,23 @@ const ListaNotas = ({ empresaId, refreshTrigger }) => {
     }
   };
 
+  const carregarMaisNotas = async () => {
+    if (!proximoCursor) return;
+
+    setCarregandoMais(true);
+    try {
+      const response = await axios.get(`${API_URL}/api/notas/empresa/${empresaId}`, {
+        params: { limit: NOTAS_POR_PAGINA, cursor: proximoCursor }
+      });
+      setNotas([...notas, ...response.data.notas]);
+      setProximoCursor(response.data.proximo_cursor);
+    } catch (error) {
+      console.error('Erro ao carregar mais notas:', error);
+    } finally {
+      setCarregandoMais(false);
+    }
+  };
+
   const carregarEstatisticas = async () => {
     try {
       const response = await axios.get(`${API_URL}/api/notas/estatisticas/${empresaId}`);
@@ -139,10 +162,15 @@ const ListaNotas = ({ empresaId, refreshTrigger }) => {
                       className={`px-2 py-1 rounded-full text-xs font-semibold ${
                         nota.status_auditoria === 'APROVADA'
                           ? 'bg-green-100 text-green-800'
-                          : 'bg-red-100 text-red-800'
+                          : nota.status_auditoria === 'ALERTA'
+                            ? 'bg-yellow-100 text-yellow-800'
+                            : 'bg-red-100 text-red-800'
                       }`}
+                      title={nota.mensagem_erro || ''}
                     >
-                      {nota.status_auditoria === 'APROVADA' ? '✅ Aprovada' : '❌ Erro'}
+                      {nota.status_auditoria === 'APROVADA'
+                        ? '✅ Aprovada'
+                        : nota.status_auditoria === 'ALERTA' ? '⚠️ Alerta' : '❌ Erro'}
                     </span>
                   </td>
                   <td className="px-4 py-3 text-sm text-center">
@@ -185,6 +213,19 @@ const ListaNotas = ({ empresaId, refreshTrigger }) => {
               ))}
             </tbody>
           </table>
+
+          {proximoCursor && (
+            <div className="text-center mt-4">
+              <button
+                data-testid="btn-carregar-mais-notas"
+                onClick={carregarMaisNotas}
+                disabled={carregandoMais}
+                className="px-4 py-2 bg-gray-200 text-gray-700 rounded-lg hover:bg-gray-300 transition-colors disabled:opacity-50"
+              >
+                {carregandoMais ? 'Carregando...' : 'Carregar mais notas'}
+              </button>
+            </div>
+          )}
         </div>
       )}
 
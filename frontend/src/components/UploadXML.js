@@ -222,7 +222,10 @@ const UploadXML = ({ empresaId, onUploadSuccess }) => {
 
               <div className="mt-4 p-3 bg-white rounded-lg border border-blue-200">
                 <p className="text-sm text-gray-700 text-center">
-                  <strong className="text-green-600">{resultado.sucesso}</strong> nota{resultado.sucesso !== 1 ? 's' : ''} processada{resultado.sucesso !== 1 ? 's' : ''} com sucesso
+                  <strong className="text-green-600">{resultado.sucesso}</strong> arquivo{resultado.sucesso !== 1 ? 's' : ''} processado{resultado.sucesso !== 1 ? 's' : ''} com sucesso
+                  {resultado.notas_importadas !== undefined && (
+                    <span> • <strong className="text-green-600">{resultado.notas_importadas}</strong> nota{resultado.notas_importadas !== 1 ? 's' : ''} importada{resultado.notas_importadas !== 1 ? 's' : ''}</span>
+                  )}
                   {resultado.falhas > 0 && (
                     <span> • <strong className="text-red-600">{resultado.falhas}</strong> falha{resultado.falhas !== 1 ? 's' : ''}</span>
                   )}